@@ -1,7 +1,9 @@
 import fcntl
 import logging
 import os
+import selectors
 import signal
+import socket
 import threading
 import time
 from dataclasses import dataclass
@@ -13,6 +15,7 @@ LED_COUNT = 6
 ACTIVE_LED_INDEXES = frozenset({0, 1, 4, 5})
 BRIGHTNESS = 0.3
 MODE_FILE_PATH = os.environ.get("CNC_LED_MODE_FILE", "/tmp/cnc_led_mode")
+MODE_SOCKET_PATH = os.environ.get("CNC_LED_SOCKET", "/tmp/cnc_led.sock")
 LOCK_FILE_PATH = os.environ.get("CNC_LED_LOCK_FILE", "/tmp/cnc_led.lock")
 LOG_FILE_PATH = os.environ.get("CNC_LED_LOG", "/var/log/cnc-control/led.log")
 
@@ -118,6 +121,7 @@ class LedStatusController:
     def __init__(self) -> None:
         self._lock = threading.Lock()
         self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
         self._thread: Optional[threading.Thread] = None
         self._mode = LedMode.BOOT
         self._backend = self._create_backend()
@@ -149,9 +153,11 @@ class LedStatusController:
             if self._mode != mode:
                 self._mode = mode
                 _LOGGER.info("Zmiana trybu LED: %s", mode.name)
+                self._wake_event.set()
 
     def stop(self):
         self._stop_event.set()
+        self._wake_event.set()
         thread = self._thread
         if thread and thread.is_alive():
             thread.join(timeout=2.0)
@@ -161,6 +167,7 @@ class LedStatusController:
     def _worker_loop(self) -> None:
         last_output: Optional[Tuple[bool, Tuple[int, int, int]]] = None
         while not self._stop_event.is_set():
+            self._wake_event.clear()
             with self._lock:
                 mode = self._mode
             pattern = MODE_PATTERNS.get(mode, MODE_PATTERNS[LedMode.ERROR])
@@ -176,7 +183,9 @@ class LedStatusController:
                 self._backend.show(enabled, pattern.color)
                 last_output = output
 
-            self._stop_event.wait(0.05)
+            # PL: Tryb staly nie wymaga odswiezania - watek spi do zmiany trybu.
+            # EN: Steady modes need no refresh - the thread sleeps until the mode changes.
+            self._wake_event.wait(0.05 if pattern.blink_hz > 0 else None)
 
 
 class _SingleInstanceLock:
@@ -208,13 +217,17 @@ class _SingleInstanceLock:
 def _read_mode_file(path: str) -> Optional[LedMode]:
     try:
         with open(path, "r", encoding="utf-8") as handle:
-            raw_value = handle.read().strip().upper()
+            raw_value = handle.read()
     except FileNotFoundError:
         return None
     except OSError as exc:
         _LOGGER.warning("Nie mozna odczytac pliku trybu LED (%s): %s", path, exc)
         return None
+    return _parse_mode(raw_value, "pliku IPC")
 
+
+def _parse_mode(raw_value: str, source: str) -> Optional[LedMode]:
+    raw_value = raw_value.strip().upper()
     if not raw_value:
         return None
 
@@ -230,7 +243,7 @@ def _read_mode_file(path: str) -> Optional[LedMode]:
     try:
         return LedMode[normalized_value]
     except KeyError:
-        _LOGGER.warning("Nieznany tryb LED w pliku IPC: %s", raw_value)
+        _LOGGER.warning("Nieznany tryb LED w %s: %s", source, raw_value)
         return None
 
 
@@ -245,6 +258,63 @@ def _prepare_mode_file(path: str) -> None:
         _LOGGER.warning("Nie mozna przygotowac pliku IPC LED (%s): %s", path, exc)
 
 
+def _open_mode_socket(path: str) -> Optional[socket.socket]:
+    mode_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        mode_socket.bind(path)
+        os.chmod(path, 0o666)
+        mode_socket.setblocking(False)
+    except OSError as exc:
+        mode_socket.close()
+        _LOGGER.warning("Nie mozna otworzyc gniazda IPC LED (%s): %s", path, exc)
+        return None
+    return mode_socket
+
+
+def _serve_mode_socket(controller: LedStatusController, mode_socket: socket.socket, stop_fd: int) -> None:
+    selector = selectors.DefaultSelector()
+    selector.register(mode_socket, selectors.EVENT_READ)
+    selector.register(stop_fd, selectors.EVENT_READ)
+    try:
+        while True:
+            for key, _events in selector.select():
+                if key.fileobj is not mode_socket:
+                    return
+                while True:
+                    try:
+                        payload = mode_socket.recv(64)
+                    except BlockingIOError:
+                        break
+                    mode = _parse_mode(payload.decode("utf-8", errors="replace"), "komunikacie IPC")
+                    if mode:
+                        controller.set_mode(mode)
+    finally:
+        selector.close()
+
+
+def _poll_mode_file(controller: LedStatusController, exit_event: threading.Event) -> None:
+    last_mtime_ns = None
+    while not exit_event.is_set():
+        try:
+            stat_result = os.stat(MODE_FILE_PATH)
+            current_mtime_ns = stat_result.st_mtime_ns
+            if current_mtime_ns != last_mtime_ns:
+                last_mtime_ns = current_mtime_ns
+                mode = _read_mode_file(MODE_FILE_PATH)
+                if mode:
+                    controller.set_mode(mode)
+        except FileNotFoundError:
+            pass
+        except OSError as exc:
+            _LOGGER.warning("Blad monitorowania pliku IPC: %s", exc)
+
+        exit_event.wait(0.2)
+
+
 def _run_daemon() -> int:
     _configure_logging()
     _prepare_mode_file(MODE_FILE_PATH)
@@ -255,10 +325,12 @@ def _run_daemon() -> int:
         return 1
 
     controller = LedStatusController()
-    controller.set_mode(LedMode.BOOT)
+    controller.set_mode(_read_mode_file(MODE_FILE_PATH) or LedMode.BOOT)
     controller.start()
 
     exit_event = threading.Event()
+    stop_read_fd, stop_write_fd = os.pipe()
+    os.set_blocking(stop_write_fd, False)
 
     def _signal_handler(signum, _frame):
         _LOGGER.info("Odebrano sygnal %s. Zatrzymywanie...", signum)
@@ -266,27 +338,29 @@ def _run_daemon() -> int:
 
     signal.signal(signal.SIGTERM, _signal_handler)
     signal.signal(signal.SIGINT, _signal_handler)
+    # PL: Sygnal zapisuje bajt do potoku i budzi select() - bez cyklicznego wybudzania.
+    # EN: A signal writes a byte to the pipe and wakes select() - no periodic wakeups.
+    signal.set_wakeup_fd(stop_write_fd)
 
-    _LOGGER.info("Demon LED uruchomiony. Monitor IPC: %s", MODE_FILE_PATH)
-    last_mtime_ns = None
+    mode_socket = _open_mode_socket(MODE_SOCKET_PATH)
     try:
-        while not exit_event.is_set():
-            try:
-                stat_result = os.stat(MODE_FILE_PATH)
-                current_mtime_ns = stat_result.st_mtime_ns
-                if current_mtime_ns != last_mtime_ns:
-                    last_mtime_ns = current_mtime_ns
-                    mode = _read_mode_file(MODE_FILE_PATH)
-                    if mode:
-                        controller.set_mode(mode)
-            except FileNotFoundError:
-                pass
-            except OSError as exc:
-                _LOGGER.warning("Blad monitorowania pliku IPC: %s", exc)
-
-            exit_event.wait(0.2)
+        if mode_socket is None:
+            _LOGGER.info("Demon LED uruchomiony. Monitor IPC: %s", MODE_FILE_PATH)
+            _poll_mode_file(controller, exit_event)
+        else:
+            _LOGGER.info("Demon LED uruchomiony. Gniazdo IPC: %s", MODE_SOCKET_PATH)
+            _serve_mode_socket(controller, mode_socket, stop_read_fd)
         return 0
     finally:
+        signal.set_wakeup_fd(-1)
+        os.close(stop_read_fd)
+        os.close(stop_write_fd)
+        if mode_socket is not None:
+            mode_socket.close()
+            try:
+                os.unlink(MODE_SOCKET_PATH)
+            except OSError:
+                pass
         controller.stop()
         lock.release()
 
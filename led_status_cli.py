@@ -1,8 +1,19 @@
+import logging
 import os
+import socket
 import sys
 import tempfile
+import threading
+from typing import Callable, Optional, Tuple
 
-from led_status import LedMode, MODE_FILE_PATH
+from led_status import LedMode, MODE_FILE_PATH, MODE_SOCKET_PATH
+
+
+_LOGGER = logging.getLogger(__name__)
+_CLIENT_LOCK = threading.Lock()
+_CLIENT: Optional["LedClient"] = None
+
+LedFallback = Callable[[str], object]
 
 
 def _usage() -> str:
@@ -46,6 +57,91 @@ def _write_mode_atomic(mode_name: str, path: str) -> None:
             os.unlink(tmp_path)
 
 
+class LedClient:
+    def __init__(self, mode_file_path: str = MODE_FILE_PATH, socket_path: str = MODE_SOCKET_PATH) -> None:
+        self._mode_file_path = mode_file_path
+        self._socket_path = socket_path
+        self._condition = threading.Condition()
+        self._pending: Optional[Tuple[str, Optional[LedFallback]]] = None
+        self._last_mode: Optional[str] = None
+        self._worker: Optional[threading.Thread] = None
+
+    @property
+    def last_mode(self) -> Optional[str]:
+        with self._condition:
+            return self._last_mode
+
+    def set_mode(self, mode_name: str, fallback: Optional[LedFallback] = None) -> bool:
+        normalized = mode_name.strip().upper()
+        if normalized not in LedMode.__members__:
+            return False
+        with self._condition:
+            if self._pending is None and normalized == self._last_mode:
+                return True
+            self._pending = (normalized, fallback)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._worker_loop, name="led-client", daemon=True)
+                self._worker.start()
+            self._condition.notify()
+        return True
+
+    def flush(self, timeout_seconds: float = 2.0) -> bool:
+        with self._condition:
+            return self._condition.wait_for(lambda: self._pending is None, timeout_seconds)
+
+    def _worker_loop(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending is not None)
+                mode_name, fallback = self._pending
+            applied = self._apply(mode_name, fallback)
+            with self._condition:
+                if applied:
+                    self._last_mode = mode_name
+                if self._pending == (mode_name, fallback):
+                    self._pending = None
+                self._condition.notify_all()
+
+    def _apply(self, mode_name: str, fallback: Optional[LedFallback]) -> bool:
+        # PL: Najpierw komunikat do demona (natychmiastowa zmiana), potem trwaly zapis ostatniego trybu.
+        # EN: Notify the daemon first (immediate change), then persist the last mode.
+        _notify_daemon(mode_name, self._socket_path)
+        try:
+            _write_mode_atomic(mode_name, self._mode_file_path)
+            return True
+        except OSError as exc:
+            _LOGGER.warning("Blad zapisu pliku IPC %s: %s", self._mode_file_path, exc)
+        if fallback is None:
+            return False
+        try:
+            return bool(fallback(mode_name))
+        except Exception as exc:
+            _LOGGER.warning("Nie mozna ustawic trybu LED (%s): %s", mode_name, exc)
+            return False
+
+
+def get_led_client() -> LedClient:
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = LedClient()
+        return _CLIENT
+
+
+def set_led_mode(mode_name: str, fallback: Optional[LedFallback] = None) -> bool:
+    return get_led_client().set_mode(mode_name, fallback=fallback)
+
+
+def _notify_daemon(mode_name: str, socket_path: str) -> bool:
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as client_socket:
+            client_socket.setblocking(False)
+            client_socket.sendto(mode_name.encode("utf-8"), socket_path)
+    except OSError:
+        return False
+    return True
+
+
 def main(argv=None) -> int:
     args = list(sys.argv[1:] if argv is None else argv)
     if len(args) != 1:
@@ -63,6 +159,7 @@ def main(argv=None) -> int:
     except OSError as exc:
         print(f"Blad zapisu pliku IPC {MODE_FILE_PATH}: {exc}", file=sys.stderr)
         return 1
+    _notify_daemon(mode_name, MODE_SOCKET_PATH)
 
     return 0
 
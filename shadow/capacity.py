@@ -0,0 +1,278 @@
+import os
+import threading
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from shadow.change_events import ChangeEvent
+from shadow.fat_image import FAT32_MAX_FILE_SIZE
+from shadow.ignore_rules import IgnoreRules
+from shadow.manifest import ManifestEntry, MasterSnapshot, scan_master
+from shadow.slot_sizing import SlotCapacityError, SlotLayout, SlotSizingPolicy
+
+
+_DISK_SLOT_COPIES = 2
+_DISK_RESERVE_PERCENT = 10
+_PENDING_UPLOAD_NAME = "\0upload"
+
+
+class CapacityError(SlotCapacityError):
+    def __init__(self, message: str, code: str = "ERR_NO_SPACE") -> None:
+        super().__init__(message)
+        self.code = code
+
+
+@dataclass(frozen=True)
+class CapacityStatus:
+    master_files: int
+    master_bytes: int
+    max_files: int
+    slot_used_bytes: int
+    slot_capacity_bytes: int
+    slot_free_bytes: int
+    disk_available_bytes: Optional[int]
+    disk_required_bytes: Optional[int]
+
+    def to_dict(self) -> Dict[str, object]:
+        return asdict(self)
+
+
+class CapacityModel:
+    def __init__(
+        self,
+        master_dir: str,
+        sizing: SlotSizingPolicy,
+        max_files: int,
+        ignore_rules: Optional[IgnoreRules] = None,
+    ) -> None:
+        self._master_dir = master_dir
+        self._sizing = sizing
+        self._max_files = max_files
+        self._ignore_rules = ignore_rules
+        self._lock = threading.Lock()
+        self._snapshot: Optional[MasterSnapshot] = None
+        self._usage_cache: Optional[Tuple[int, int, Optional[SlotLayout]]] = None
+
+    def sync(self, snapshot: MasterSnapshot) -> None:
+        with self._lock:
+            self._snapshot = MasterSnapshot(files=dict(snapshot.files), directories=set(snapshot.directories))
+            self._usage_cache = None
+
+    def apply_change(self, event: ChangeEvent) -> None:
+        with self._lock:
+            if self._snapshot is None:
+                return
+            self._usage_cache = None
+            if not event.path:
+                self._snapshot = None
+                return
+            self._forget_path(event.path)
+            if event.previous_path:
+                self._forget_path(event.previous_path)
+            if event.operation != "delete":
+                self._track_path(event.path)
+
+    def check_upload(
+        self,
+        relative_path: str,
+        size: int,
+        image_dir: Optional[str] = None,
+        slot_paths: Sequence[str] = (),
+    ) -> None:
+        if self._ignore_rules is not None and self._ignore_rules.is_ignored(relative_path):
+            return
+        self._check_candidate(relative_path, relative_path, size, image_dir, slot_paths)
+
+    def check_upload_size(
+        self,
+        relative_dir: str,
+        size: int,
+        image_dir: Optional[str] = None,
+        slot_paths: Sequence[str] = (),
+    ) -> None:
+        label = f"{relative_dir}/" if relative_dir else "uploadu"
+        pending_path = "/".join(part for part in (relative_dir, _PENDING_UPLOAD_NAME) if part)
+        self._check_candidate(pending_path, label, size, image_dir, slot_paths)
+
+    def _check_candidate(
+        self,
+        relative_path: str,
+        label: str,
+        size: int,
+        image_dir: Optional[str],
+        slot_paths: Sequence[str],
+    ) -> None:
+        if size > FAT32_MAX_FILE_SIZE:
+            raise CapacityError(
+                f"Plik {label} ({_format_mb(size)} MB) przekracza limit 4 GB systemu FAT.",
+                code="ERR_FILE_TOO_LARGE",
+            )
+        with self._lock:
+            snapshot = self._ensure_snapshot()
+            previous = snapshot.files.get(relative_path)
+            candidate = MasterSnapshot(files=dict(snapshot.files), directories=set(snapshot.directories))
+        candidate.files[relative_path] = ManifestEntry(size=size, mtime_ns=0)
+        candidate.directories.update(_parent_directories(relative_path))
+
+        self._check_file_count(candidate)
+        layout = self._choose_layout(candidate)
+        if image_dir is not None:
+            growth = size - (previous.size if previous is not None else 0)
+            shares_disk = self._same_filesystem(self._master_dir, image_dir)
+            self._check_disk(image_dir, layout, slot_paths, pending_bytes=growth if shares_disk else 0)
+
+    def check_rebuild(
+        self,
+        snapshot: MasterSnapshot,
+        layout: SlotLayout,
+        image_dir: str,
+        slot_paths: Sequence[str] = (),
+    ) -> None:
+        self.sync(snapshot)
+        self._check_file_count(snapshot)
+        for path, entry in snapshot.files.items():
+            if entry.size > FAT32_MAX_FILE_SIZE:
+                raise CapacityError(
+                    f"Plik {path} ({_format_mb(entry.size)} MB) przekracza limit 4 GB systemu FAT.",
+                    code="ERR_FILE_TOO_LARGE",
+                )
+        self._check_disk(image_dir, layout, slot_paths)
+
+    def status(self, image_dir: Optional[str] = None, slot_paths: Sequence[str] = ()) -> CapacityStatus:
+        with self._lock:
+            snapshot = self._ensure_snapshot()
+            if self._usage_cache is None:
+                used_bytes, capacity_bytes = self._sizing.usage_bytes(snapshot)
+                try:
+                    layout: Optional[SlotLayout] = self._sizing.choose(snapshot)
+                except SlotCapacityError:
+                    layout = None
+                self._usage_cache = (used_bytes, capacity_bytes, layout)
+            used_bytes, capacity_bytes, layout = self._usage_cache
+            master_files = len(snapshot.files)
+            master_bytes = snapshot.total_bytes
+        return CapacityStatus(
+            master_files=master_files,
+            master_bytes=master_bytes,
+            max_files=self._max_files,
+            slot_used_bytes=used_bytes,
+            slot_capacity_bytes=capacity_bytes,
+            slot_free_bytes=max(0, capacity_bytes - used_bytes),
+            disk_available_bytes=self._available_disk_bytes(image_dir) if image_dir is not None else None,
+            disk_required_bytes=(
+                self._required_disk_bytes(layout, slot_paths) if image_dir is not None and layout is not None else None
+            ),
+        )
+
+    def _ensure_snapshot(self) -> MasterSnapshot:
+        if self._snapshot is None:
+            try:
+                self._snapshot = scan_master(self._master_dir, self._ignore_rules)
+            except OSError:
+                self._snapshot = MasterSnapshot()
+        return self._snapshot
+
+    def _forget_path(self, relative_path: str) -> None:
+        snapshot = self._snapshot
+        prefix = f"{relative_path}/"
+        snapshot.files.pop(relative_path, None)
+        snapshot.directories.discard(relative_path)
+        for path in [path for path in snapshot.files if path.startswith(prefix)]:
+            del snapshot.files[path]
+        snapshot.directories.difference_update(
+            [path for path in snapshot.directories if path.startswith(prefix)]
+        )
+
+    def _track_path(self, relative_path: str) -> None:
+        snapshot = self._snapshot
+        absolute_path = os.path.join(self._master_dir, relative_path)
+        try:
+            is_dir = os.path.isdir(absolute_path) and not os.path.islink(absolute_path)
+            if self._ignore_rules is not None and self._ignore_rules.is_ignored(relative_path, is_dir):
+                return
+            if is_dir:
+                subtree = scan_master(self._master_dir, self._ignore_rules, relative_path)
+                snapshot.directories.add(relative_path)
+                snapshot.directories.update(subtree.directories)
+                snapshot.files.update(subtree.files)
+            elif os.path.isfile(absolute_path) and not os.path.islink(absolute_path):
+                stat_result = os.stat(absolute_path)
+                snapshot.files[relative_path] = ManifestEntry(
+                    size=stat_result.st_size,
+                    mtime_ns=stat_result.st_mtime_ns,
+                )
+            else:
+                return
+        except OSError:
+            return
+        snapshot.directories.update(_parent_directories(relative_path))
+
+    def _check_file_count(self, snapshot: MasterSnapshot) -> None:
+        if len(snapshot.files) > self._max_files:
+            raise CapacityError(
+                f"Liczba plikow w CNC_MASTER_DIR ({len(snapshot.files)}) przekracza "
+                f"CNC_SHADOW_MAX_FILES={self._max_files}.",
+                code="ERR_TOO_MANY_FILES",
+            )
+
+    def _choose_layout(self, snapshot: MasterSnapshot) -> SlotLayout:
+        try:
+            return self._sizing.choose(snapshot)
+        except SlotCapacityError as exc:
+            raise CapacityError(str(exc)) from exc
+
+    def _check_disk(
+        self,
+        image_dir: str,
+        layout: SlotLayout,
+        slot_paths: Sequence[str],
+        pending_bytes: int = 0,
+    ) -> None:
+        available = self._available_disk_bytes(image_dir)
+        if available is None:
+            return
+        available = max(0, available - max(0, pending_bytes))
+        required = self._required_disk_bytes(layout, slot_paths)
+        if available < required:
+            raise CapacityError(
+                f"Za malo miejsca na obrazy slotow w {image_dir}: dostepne {_format_mb(available)} MB, "
+                f"wymagane {_format_mb(required)} MB."
+            )
+
+    @staticmethod
+    def _required_disk_bytes(layout: SlotLayout, slot_paths: Sequence[str] = ()) -> int:
+        existing_slots = list(dict.fromkeys(slot_paths))[:_DISK_SLOT_COPIES]
+        allocated = sum(min(_allocated_bytes(path), layout.size_bytes) for path in existing_slots)
+        unallocated = max(layout.size_bytes, _DISK_SLOT_COPIES * layout.size_bytes - allocated)
+        return unallocated + layout.size_bytes * _DISK_RESERVE_PERCENT // 100
+
+    @staticmethod
+    def _available_disk_bytes(path: str) -> Optional[int]:
+        try:
+            filesystem = os.statvfs(path)
+        except OSError:
+            return None
+        return filesystem.f_bavail * filesystem.f_frsize
+
+    @staticmethod
+    def _same_filesystem(first_path: str, second_path: str) -> bool:
+        try:
+            return os.stat(first_path).st_dev == os.stat(second_path).st_dev
+        except OSError:
+            return False
+
+
+def _parent_directories(relative_path: str) -> List[str]:
+    parts = relative_path.split("/")[:-1]
+    return ["/".join(parts[: index + 1]) for index in range(len(parts))]
+
+
+def _allocated_bytes(path: str) -> int:
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return 0
+    return min(stat_result.st_size, stat_result.st_blocks * 512)
+
+
+def _format_mb(size_bytes: int) -> str:
+    return f"{size_bytes / (1024 * 1024):.1f}"
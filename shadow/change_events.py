@@ -0,0 +1,186 @@
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Set, Tuple
+
+
+CHANGE_OPERATIONS = {"create", "modify", "delete", "move"}
+_WATCHER_OPERATIONS = (
+    ("DELETE", "delete"),
+    ("MOVED_FROM", "move"),
+    ("MOVED_TO", "move"),
+    ("CLOSE_WRITE", "modify"),
+    ("CREATE", "create"),
+)
+_CHANGE_SET_HISTORY_LIMIT = 50
+
+
+@dataclass(frozen=True)
+class ChangeEvent:
+    path: str
+    operation: str
+    size: Optional[int] = None
+    source: str = "watcher"
+    is_dir: bool = False
+    previous_path: Optional[str] = None
+    timestamp: float = field(default_factory=time.time, compare=False)
+
+    def describe(self) -> str:
+        size = f" ({self.size} B)" if self.size is not None else ""
+        if self.previous_path is not None:
+            return f"{self.source}:{self.operation}:{self.previous_path} -> {self.path or '.'}{size}"
+        return f"{self.source}:{self.operation}:{self.path or '.'}{size}"
+
+
+class ChangeSet:
+    def __init__(self) -> None:
+        self._kinds: Dict[str, str] = {}
+        self._renames: Dict[str, str] = {}
+        self.event_count = 0
+        self.full_rescan = False
+        self.first_event_at: Optional[float] = None
+        self.last_event_at: Optional[float] = None
+
+    def add(self, event: ChangeEvent) -> None:
+        self.event_count += 1
+        if self.first_event_at is None:
+            self.first_event_at = event.timestamp
+        self.last_event_at = event.timestamp
+        if not event.path:
+            self.full_rescan = True
+            return
+        if event.operation == "move" and event.previous_path:
+            self._rename(event.previous_path, event.path)
+        elif event.operation == "delete":
+            self._delete(event.path)
+        elif event.operation == "create":
+            if self._kinds.get(event.path) == "delete":
+                self._kinds[event.path] = "modify"
+            else:
+                self._kinds.setdefault(event.path, "create")
+        elif self._kinds.get(event.path) != "create":
+            self._kinds[event.path] = "modify"
+
+    @property
+    def paths(self) -> Set[str]:
+        return set(self._kinds) | set(self._renames) | set(self._renames.values())
+
+    @property
+    def written_paths(self) -> Set[str]:
+        written = {path for path, kind in self._kinds.items() if kind in ("create", "modify")}
+        return written | set(self._renames)
+
+    def __len__(self) -> int:
+        return len(self._kinds) + len(self._renames)
+
+    def to_dict(self, limit: int = _CHANGE_SET_HISTORY_LIMIT) -> Dict[str, object]:
+        remaining = limit
+        truncated = False
+        payload: Dict[str, object] = {"events": self.event_count, "full_rescan": self.full_rescan}
+        for kind, key in (("create", "created"), ("modify", "modified"), ("delete", "deleted")):
+            paths = sorted(path for path, path_kind in self._kinds.items() if path_kind == kind)
+            payload[key] = paths[:remaining]
+            truncated = truncated or len(paths) > remaining
+            remaining = max(0, remaining - len(paths))
+        renames = sorted(self._renames.items())
+        payload["renamed"] = [{"from": original, "to": new_path} for new_path, original in renames[:remaining]]
+        payload["truncated"] = truncated or len(renames) > remaining
+        return payload
+
+    def _delete(self, path: str) -> None:
+        prefix = f"{path}/"
+        for child in [child for child in self._kinds if child.startswith(prefix)]:
+            del self._kinds[child]
+        for child in [child for child in self._renames if child.startswith(prefix)]:
+            self._kinds[self._renames.pop(child)] = "delete"
+
+        original = self._renames.pop(path, None)
+        previous_kind = self._kinds.pop(path, None)
+        if original is not None:
+            self._kinds[original] = "delete"
+        elif previous_kind != "create":
+            self._kinds[path] = "delete"
+
+    def _rename(self, old_path: str, new_path: str) -> None:
+        if old_path == new_path:
+            return
+        self._rekey_children(old_path, new_path)
+        previous_kind = self._kinds.pop(old_path, None)
+        original = self._renames.pop(old_path, old_path)
+        overwritten = self._renames.pop(new_path, None)
+        if overwritten is not None:
+            self._kinds[overwritten] = "delete"
+        overwritten_kind = self._kinds.pop(new_path, None)
+
+        if previous_kind == "create":
+            self._kinds[new_path] = "create" if overwritten_kind in (None, "create") else "modify"
+            return
+        if original != new_path:
+            self._renames[new_path] = original
+        if previous_kind == "modify" or (original == new_path and overwritten_kind is not None):
+            self._kinds[new_path] = "modify"
+
+    def _rekey_children(self, old_path: str, new_path: str) -> None:
+        old_prefix = f"{old_path}/"
+        for child in [child for child in self._kinds if child.startswith(old_prefix)]:
+            self._kinds[f"{new_path}/{child[len(old_prefix):]}"] = self._kinds.pop(child)
+        for child in [child for child in self._renames if child.startswith(old_prefix)]:
+            self._renames[f"{new_path}/{child[len(old_prefix):]}"] = self._renames.pop(child)
+
+
+def relative_master_path(master_dir: str, path: str) -> str:
+    absolute_path = path if os.path.isabs(path) else os.path.join(master_dir, path)
+    relative_path = os.path.relpath(os.path.normpath(absolute_path), os.path.normpath(master_dir))
+    if relative_path == ".":
+        return ""
+    if relative_path == ".." or relative_path.startswith(f"..{os.sep}"):
+        raise ValueError(f"Sciezka poza CNC_MASTER_DIR: {path}")
+    return relative_path.replace(os.sep, "/")
+
+
+def split_watcher_line(line: str) -> Tuple[str, Set[str]]:
+    raw_path, separator, raw_flags = line.rpartition(":")
+    if not separator:
+        raw_path, raw_flags = line, ""
+    return raw_path, {flag.strip().upper() for flag in raw_flags.split(",") if flag.strip()}
+
+
+def watcher_change_event(
+    master_dir: str,
+    raw_path: str,
+    flags: Set[str],
+    previous_path: Optional[str] = None,
+) -> ChangeEvent:
+    path = _watcher_relative_path(master_dir, raw_path)
+    if previous_path is not None:
+        return ChangeEvent(
+            path=path,
+            operation="move",
+            is_dir="ISDIR" in flags,
+            previous_path=_watcher_relative_path(master_dir, previous_path),
+        )
+    if "MOVED_FROM" in flags:
+        operation = "delete"
+    elif "MOVED_TO" in flags:
+        operation = "create"
+    else:
+        operation = next((name for flag, name in _WATCHER_OPERATIONS if flag in flags), "modify")
+    return ChangeEvent(path=path, operation=operation, is_dir="ISDIR" in flags)
+
+
+def parse_watcher_event(line: str, master_dir: str) -> ChangeEvent:
+    raw_path, flags = split_watcher_line(line)
+    operation = next((name for flag, name in _WATCHER_OPERATIONS if flag in flags), "modify")
+    return ChangeEvent(
+        path=_watcher_relative_path(master_dir, raw_path),
+        operation=operation,
+        is_dir="ISDIR" in flags,
+    )
+
+
+def _watcher_relative_path(master_dir: str, raw_path: str) -> str:
+    try:
+        return relative_master_path(master_dir, raw_path)
+    except ValueError:
+        return raw_path
+
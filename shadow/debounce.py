@@ -0,0 +1,81 @@
+from typing import Mapping, Optional, Tuple
+
+
+class AdaptiveDebouncer:
+    _GAP_SMOOTHING = 0.3
+    _QUIET_GAP_FACTOR = 3.0
+
+    def __init__(
+        self,
+        quiet_seconds: float,
+        min_quiet_seconds: float,
+        max_latency_seconds: float,
+        min_interval_seconds: float,
+    ) -> None:
+        self._max_quiet = max(0.0, quiet_seconds)
+        self._min_quiet = min(max(0.0, min_quiet_seconds), self._max_quiet)
+        self._max_latency = max(self._max_quiet, max_latency_seconds)
+        self._min_interval = max(0.0, min_interval_seconds)
+        self._burst_started: Optional[float] = None
+        self._last_event: Optional[float] = None
+        self._gap_estimate: Optional[float] = None
+        self._event_count = 0
+        self._last_publish: Optional[float] = None
+
+    @classmethod
+    def from_environment(cls, environment: Mapping[str, str]) -> "AdaptiveDebouncer":
+        return cls(
+            quiet_seconds=float(environment.get("CNC_SHADOW_DEBOUNCE_SECONDS", "4")),
+            min_quiet_seconds=float(environment.get("CNC_SHADOW_DEBOUNCE_MIN_SECONDS", "1")),
+            max_latency_seconds=float(environment.get("CNC_SHADOW_MAX_LATENCY_SECONDS", "30")),
+            min_interval_seconds=float(environment.get("CNC_SHADOW_MIN_REBUILD_INTERVAL_SECONDS", "15")),
+        )
+
+    def record_event(self, now: float, burst_started: Optional[float] = None) -> None:
+        if self._burst_started is None:
+            self._burst_started = now if burst_started is None else min(now, burst_started)
+        elif self._last_event is not None:
+            gap = max(0.0, now - self._last_event)
+            if self._gap_estimate is None:
+                self._gap_estimate = gap
+            else:
+                self._gap_estimate = self._GAP_SMOOTHING * gap + (1 - self._GAP_SMOOTHING) * self._gap_estimate
+        self._last_event = now
+        self._event_count += 1
+
+    def quiet_window(self) -> float:
+        if self._gap_estimate is None:
+            return self._min_quiet
+        return min(self._max_quiet, max(self._min_quiet, self._gap_estimate * self._QUIET_GAP_FACTOR))
+
+    def deadline(self) -> float:
+        return self._resolve_deadline()[0]
+
+    def finish_burst(self) -> str:
+        reason = self._resolve_deadline()[1] if self._last_event is not None else "quiet"
+        self._burst_started = None
+        self._last_event = None
+        self._gap_estimate = None
+        self._event_count = 0
+        return reason
+
+    def _resolve_deadline(self) -> Tuple[float, str]:
+        if self._burst_started is None or self._last_event is None:
+            raise RuntimeError("Debounce bez zarejestrowanego zdarzenia.")
+        deadline = self._last_event + self.quiet_window()
+        reason = "quiet"
+        latency_deadline = self._burst_started + self._max_latency
+        if latency_deadline < deadline:
+            deadline = latency_deadline
+            reason = "max_latency"
+        if self._last_publish is not None and self._last_publish + self._min_interval > deadline:
+            deadline = self._last_publish + self._min_interval
+            reason = "rate_limited"
+        return deadline, reason
+
+    def mark_published(self, now: float) -> None:
+        self._last_publish = now
+
+    @property
+    def event_count(self) -> int:
+        return self._event_count
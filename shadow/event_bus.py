@@ -0,0 +1,85 @@
+import itertools
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional
+
+
+_SUBSCRIBER_QUEUE_LIMIT = 256
+_REPLAY_LIMIT = 64
+
+
+@dataclass(frozen=True)
+class BusEvent:
+    event_id: int
+    event_type: str
+    payload: Dict[str, object]
+
+
+class Subscription:
+    def __init__(self, bus: "EventBus", replay: List[BusEvent]) -> None:
+        self._bus = bus
+        self._condition = threading.Condition()
+        self._events: Deque[BusEvent] = deque(replay, maxlen=_SUBSCRIBER_QUEUE_LIMIT)
+        self._closed = False
+        self.dropped = 0
+
+    def get(self, timeout_seconds: Optional[float] = None) -> Optional[BusEvent]:
+        with self._condition:
+            if not self._events and not self._closed:
+                self._condition.wait(timeout_seconds)
+            if not self._events:
+                return None
+            return self._events.popleft()
+
+    def close(self) -> None:
+        self._bus._unsubscribe(self)
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def _deliver(self, event: BusEvent) -> None:
+        with self._condition:
+            if len(self._events) == self._events.maxlen:
+                self.dropped += 1
+            self._events.append(event)
+            self._condition.notify()
+
+
+class EventBus:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._subscribers: List[Subscription] = []
+        self._recent: Deque[BusEvent] = deque(maxlen=_REPLAY_LIMIT)
+
+    def publish(self, event_type: str, payload: Dict[str, object]) -> BusEvent:
+        with self._lock:
+            event = BusEvent(event_id=next(self._ids), event_type=event_type, payload=payload)
+            self._recent.append(event)
+            for subscription in self._subscribers:
+                subscription._deliver(event)
+        return event
+
+    def subscribe(self, last_event_id: Optional[int] = None) -> Subscription:
+        with self._lock:
+            replay = []
+            if last_event_id is not None:
+                replay = [event for event in self._recent if event.event_id > last_event_id]
+            subscription = Subscription(self, replay)
+            self._subscribers.append(subscription)
+        return subscription
+
+    @property
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+    def _unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
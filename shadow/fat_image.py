@@ -0,0 +1,721 @@
+import os
+import struct
+import sys
+import time
+from array import array
+from dataclasses import dataclass, field
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from shadow.ignore_rules import IgnoreRules
+
+
+SECTOR_SIZE = 512
+DIR_ENTRY_SIZE = 32
+FAT16 = 16
+FAT32 = 32
+FAT32_MAX_FILE_SIZE = 0xFFFFFFFF
+
+_ATTR_VOLUME_ID = 0x08
+_ATTR_DIRECTORY = 0x10
+_ATTR_ARCHIVE = 0x20
+_ATTR_LONG_NAME = 0x0F
+_NT_LOWER_BASE = 0x08
+_NT_LOWER_EXT = 0x10
+
+_FAT16_MIN_CLUSTERS = 4085
+_FAT32_MIN_CLUSTERS = 65525
+_LFN_CHARS_PER_ENTRY = 13
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+_SHORT_NAME_CHARS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!#$%&'()-@^_`{}~")
+_LONG_NAME_INVALID = frozenset('"*/:<>?\\|')
+_DIR_ENTRY = struct.Struct("<11sBBBHHHHHHHI")
+
+
+class FatImageError(RuntimeError):
+    pass
+
+
+@dataclass(frozen=True)
+class FatGeometry:
+    fat_type: int
+    total_sectors: int
+    sectors_per_cluster: int
+    reserved_sectors: int
+    fat_sectors: int
+    root_entries: int
+    num_fats: int = 2
+
+    @property
+    def cluster_size(self) -> int:
+        return self.sectors_per_cluster * SECTOR_SIZE
+
+    @property
+    def root_dir_sectors(self) -> int:
+        return (self.root_entries * DIR_ENTRY_SIZE + SECTOR_SIZE - 1) // SECTOR_SIZE
+
+    @property
+    def fat_start_sector(self) -> int:
+        return self.reserved_sectors
+
+    @property
+    def root_dir_start_sector(self) -> int:
+        return self.reserved_sectors + self.num_fats * self.fat_sectors
+
+    @property
+    def data_start_sector(self) -> int:
+        return self.root_dir_start_sector + self.root_dir_sectors
+
+    @property
+    def cluster_count(self) -> int:
+        return (self.total_sectors - self.data_start_sector) // self.sectors_per_cluster
+
+    def cluster_offset(self, cluster: int) -> int:
+        return (self.data_start_sector + (cluster - 2) * self.sectors_per_cluster) * SECTOR_SIZE
+
+
+@dataclass(frozen=True)
+class FatImageStats:
+    files: int
+    directories: int
+    bytes_written: int
+    clusters_used: int
+
+
+@dataclass
+class _Node:
+    name: str
+    source_path: Optional[str]
+    is_dir: bool
+    size: int = 0
+    mtime: float = 0.0
+    children: List["_Node"] = field(default_factory=list)
+    short_name: bytes = b""
+    long_name: Optional[str] = None
+    first_cluster: int = 0
+    cluster_count: int = 0
+    entry_count: int = 0
+
+
+def default_sectors_per_cluster(image_size: int, fat_type: int) -> int:
+    total_sectors = image_size // SECTOR_SIZE
+    if fat_type == FAT32:
+        thresholds = ((532480, 1), (16777216, 8), (33554432, 16), (67108864, 32))
+        fallback = 64
+    else:
+        thresholds = ((32680, 2), (262144, 4), (524288, 8), (1048576, 16), (2097152, 32))
+        fallback = 64
+    for limit, sectors_per_cluster in thresholds:
+        if total_sectors <= limit:
+            return sectors_per_cluster
+    return fallback
+
+
+def compute_geometry(
+    image_size: int,
+    fat_type: int = FAT32,
+    sectors_per_cluster: Optional[int] = None,
+    root_entries: int = 512,
+) -> FatGeometry:
+    if fat_type not in {FAT16, FAT32}:
+        raise FatImageError(f"Nieobslugiwany typ FAT: {fat_type}.")
+    total_sectors = image_size // SECTOR_SIZE
+    resolved_spc = sectors_per_cluster or default_sectors_per_cluster(image_size, fat_type)
+    if resolved_spc not in {1, 2, 4, 8, 16, 32, 64, 128}:
+        raise FatImageError(f"Niepoprawna liczba sektorow na klaster: {resolved_spc}.")
+
+    if fat_type == FAT32:
+        reserved_sectors = 32
+        resolved_root_entries = 0
+    else:
+        reserved_sectors = 1
+        resolved_root_entries = max(16, -(-root_entries // 16) * 16)
+
+    root_dir_sectors = (resolved_root_entries * DIR_ENTRY_SIZE + SECTOR_SIZE - 1) // SECTOR_SIZE
+    entries_per_fat_sector = SECTOR_SIZE // (4 if fat_type == FAT32 else 2)
+    available = total_sectors - reserved_sectors - root_dir_sectors
+    divisor = entries_per_fat_sector * resolved_spc + 2
+    fat_sectors = -(-(available + 2 * resolved_spc) // divisor)
+
+    geometry = FatGeometry(
+        fat_type=fat_type,
+        total_sectors=total_sectors,
+        sectors_per_cluster=resolved_spc,
+        reserved_sectors=reserved_sectors,
+        fat_sectors=fat_sectors,
+        root_entries=resolved_root_entries,
+    )
+    cluster_count = geometry.cluster_count
+    if fat_type == FAT32 and cluster_count < _FAT32_MIN_CLUSTERS:
+        raise FatImageError("Obraz jest za maly dla FAT32 przy wybranym rozmiarze klastra.")
+    if fat_type == FAT16 and not _FAT16_MIN_CLUSTERS <= cluster_count < _FAT32_MIN_CLUSTERS:
+        raise FatImageError("Rozmiar obrazu i klastra poza zakresem FAT16.")
+    return geometry
+
+
+class FatImageWriter:
+    def __init__(
+        self,
+        source_dir: str,
+        image_size: int,
+        label: str,
+        fat_type: int = FAT32,
+        sectors_per_cluster: Optional[int] = None,
+        volume_id: Optional[int] = None,
+        checkpoint: Optional[Callable[[], None]] = None,
+        ignore_rules: Optional[IgnoreRules] = None,
+    ) -> None:
+        self._source_dir = source_dir
+        self._image_size = image_size
+        self._label = label
+        self._fat_type = fat_type
+        self._sectors_per_cluster = sectors_per_cluster
+        self._volume_id = volume_id
+        self._checkpoint = checkpoint
+        self._ignore_rules = ignore_rules
+
+    def write(self, handle: BinaryIO) -> FatImageStats:
+        root = self._scan_tree()
+        root_entry_count = self._assign_names(root, is_root=True)
+        geometry = compute_geometry(
+            self._image_size,
+            fat_type=self._fat_type,
+            sectors_per_cluster=self._sectors_per_cluster,
+            root_entries=max(512, root_entry_count),
+        )
+        directories, files = self._flatten(root)
+        next_cluster = self._allocate(geometry, root, directories, files)
+        fat_table = self._build_fat(geometry, [root, *directories, *files], next_cluster)
+
+        handle.write(self._build_reserved_region(geometry, next_cluster))
+        fat_bytes = fat_table.tobytes()
+        for _ in range(geometry.num_fats):
+            handle.write(fat_bytes)
+
+        if geometry.fat_type == FAT16:
+            handle.write(self._pad(self._directory_bytes(root, None, geometry), geometry.root_dir_sectors * SECTOR_SIZE))
+        else:
+            handle.write(self._pad(self._directory_bytes(root, None, geometry), root.cluster_count * geometry.cluster_size))
+
+        parents = self._parent_map(root)
+        for directory in directories:
+            payload = self._directory_bytes(directory, parents[id(directory)], geometry)
+            handle.write(self._pad(payload, directory.cluster_count * geometry.cluster_size))
+
+        bytes_written = 0
+        for node in files:
+            if node.cluster_count == 0:
+                continue
+            bytes_written += self._stream_file(handle, node, geometry.cluster_size, self._checkpoint)
+
+        image_size = geometry.total_sectors * SECTOR_SIZE
+        if handle.tell() < image_size:
+            handle.seek(image_size - 1)
+            handle.write(b"\x00")
+        handle.truncate(image_size)
+        return FatImageStats(
+            files=len(files),
+            directories=len(directories),
+            bytes_written=bytes_written,
+            clusters_used=next_cluster - 2,
+        )
+
+    def _scan_tree(self) -> _Node:
+        root = _Node(name="", source_path=self._source_dir, is_dir=True, mtime=time.time())
+        pending = [(root, "")]
+        while pending:
+            directory, relative_dir = pending.pop()
+            matcher = self._ignore_rules.matcher(relative_dir) if self._ignore_rules is not None else None
+            with os.scandir(directory.source_path) as entries:
+                for entry in entries:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    if matcher is not None and matcher.ignores(entry.name, is_dir):
+                        continue
+                    if is_dir:
+                        stat_result = entry.stat(follow_symlinks=False)
+                        child = _Node(name=entry.name, source_path=entry.path, is_dir=True, mtime=stat_result.st_mtime)
+                        pending.append((child, f"{relative_dir}/{entry.name}" if relative_dir else entry.name))
+                    elif entry.is_file(follow_symlinks=False):
+                        stat_result = entry.stat(follow_symlinks=False)
+                        if stat_result.st_size > FAT32_MAX_FILE_SIZE:
+                            raise FatImageError(f"Plik przekracza limit 4 GB FAT: {entry.path}")
+                        child = _Node(
+                            name=entry.name,
+                            source_path=entry.path,
+                            is_dir=False,
+                            size=stat_result.st_size,
+                            mtime=stat_result.st_mtime,
+                        )
+                    else:
+                        continue
+                    directory.children.append(child)
+            directory.children.sort(key=lambda node: (node.name.upper(), node.name))
+        return root
+
+    def _assign_names(self, directory: _Node, is_root: bool) -> int:
+        used_short: Set[bytes] = set()
+        used_long: Dict[str, str] = {}
+        entry_count = 0 if is_root else 2
+        if is_root and self._label:
+            entry_count += 1
+
+        for child in directory.children:
+            long_name = _sanitize_long_name(child.name)
+            folded = long_name.upper()
+            if folded in used_long:
+                raise FatImageError(
+                    f"Konflikt nazw w obrazie FAT (wielkosc liter): {used_long[folded]} / {child.name}"
+                )
+            used_long[folded] = child.name
+
+            exact = _exact_short_name(long_name)
+            if exact is not None and exact not in used_short:
+                child.short_name = exact
+                child.long_name = None
+            else:
+                child.short_name = _generate_short_name(long_name, used_short)
+                child.long_name = long_name
+            used_short.add(child.short_name)
+            entry_count += 1 + _lfn_entry_count(child.long_name)
+            if child.is_dir:
+                child.entry_count = self._assign_names(child, is_root=False)
+
+        directory.entry_count = entry_count
+        return entry_count
+
+    @staticmethod
+    def _flatten(root: _Node) -> Tuple[List[_Node], List[_Node]]:
+        directories: List[_Node] = []
+        files: List[_Node] = []
+        queue = [root]
+        while queue:
+            directory = queue.pop(0)
+            for child in directory.children:
+                if child.is_dir:
+                    directories.append(child)
+                    queue.append(child)
+                else:
+                    files.append(child)
+        return directories, files
+
+    @staticmethod
+    def _parent_map(root: _Node) -> Dict[int, _Node]:
+        parents: Dict[int, _Node] = {}
+        pending = [root]
+        while pending:
+            directory = pending.pop()
+            for child in directory.children:
+                if child.is_dir:
+                    parents[id(child)] = directory
+                    pending.append(child)
+        return parents
+
+    @staticmethod
+    def _allocate(geometry: FatGeometry, root: _Node, directories: List[_Node], files: List[_Node]) -> int:
+        cluster_size = geometry.cluster_size
+        next_cluster = 2
+        ordered = list(directories) + list(files)
+        if geometry.fat_type == FAT32:
+            ordered.insert(0, root)
+
+        for node in ordered:
+            if node.is_dir:
+                needed = max(1, -(-(node.entry_count * DIR_ENTRY_SIZE) // cluster_size))
+            else:
+                needed = -(-node.size // cluster_size)
+            if needed == 0:
+                node.first_cluster = 0
+                node.cluster_count = 0
+                continue
+            node.first_cluster = next_cluster
+            node.cluster_count = needed
+            next_cluster += needed
+
+        if next_cluster - 2 > geometry.cluster_count:
+            raise FatImageError(
+                "Brak miejsca w obrazie FAT: wymagane klastry "
+                f"{next_cluster - 2}, dostepne {geometry.cluster_count}."
+            )
+        return next_cluster
+
+    @staticmethod
+    def _build_fat(geometry: FatGeometry, nodes: List[_Node], next_cluster: int) -> array:
+        entries = geometry.fat_sectors * SECTOR_SIZE // (4 if geometry.fat_type == FAT32 else 2)
+        if geometry.fat_type == FAT32:
+            table = array("I", bytes(entries * 4))
+            end_of_chain = 0x0FFFFFFF
+            table[0] = 0x0FFFFFF8
+            table[1] = 0x0FFFFFFF
+        else:
+            table = array("H", bytes(entries * 2))
+            end_of_chain = 0xFFFF
+            table[0] = 0xFFF8
+            table[1] = 0xFFFF
+
+        for node in nodes:
+            if node.cluster_count == 0:
+                continue
+            start = node.first_cluster
+            end = start + node.cluster_count
+            if node.cluster_count > 1:
+                table[start : end - 1] = array(table.typecode, range(start + 1, end))
+            table[end - 1] = end_of_chain
+
+        if sys.byteorder != "little":
+            table.byteswap()
+        return table
+
+    def _build_reserved_region(self, geometry: FatGeometry, next_cluster: int) -> bytes:
+        region = bytearray(geometry.reserved_sectors * SECTOR_SIZE)
+        boot_sector = self._build_boot_sector(geometry)
+        region[0:SECTOR_SIZE] = boot_sector
+        if geometry.fat_type == FAT32:
+            fs_info = self._build_fs_info(geometry, next_cluster)
+            region[SECTOR_SIZE : 2 * SECTOR_SIZE] = fs_info
+            region[6 * SECTOR_SIZE : 7 * SECTOR_SIZE] = boot_sector
+            region[7 * SECTOR_SIZE : 8 * SECTOR_SIZE] = fs_info
+        return bytes(region)
+
+    def _build_boot_sector(self, geometry: FatGeometry) -> bytes:
+        sector = bytearray(SECTOR_SIZE)
+        total_16 = geometry.total_sectors if geometry.total_sectors < 0x10000 else 0
+        total_32 = 0 if total_16 else geometry.total_sectors
+        struct.pack_into(
+            "<3s8sHBHBHHBHHHII",
+            sector,
+            0,
+            b"\xEB\x58\x90" if geometry.fat_type == FAT32 else b"\xEB\x3C\x90",
+            b"MSWIN4.1",
+            SECTOR_SIZE,
+            geometry.sectors_per_cluster,
+            geometry.reserved_sectors,
+            geometry.num_fats,
+            geometry.root_entries,
+            total_16,
+            0xF8,
+            0 if geometry.fat_type == FAT32 else geometry.fat_sectors,
+            32,
+            64,
+            0,
+            total_32,
+        )
+        volume_id = self._volume_id if self._volume_id is not None else int(time.time()) & 0xFFFFFFFF
+        label = _volume_label_bytes(self._label)
+        if geometry.fat_type == FAT32:
+            struct.pack_into(
+                "<IHHIHH12sBBBI11s8s",
+                sector,
+                36,
+                geometry.fat_sectors,
+                0,
+                0,
+                2,
+                1,
+                6,
+                bytes(12),
+                0x80,
+                0,
+                0x29,
+                volume_id,
+                label,
+                b"FAT32   ",
+            )
+        else:
+            struct.pack_into("<BBBI11s8s", sector, 36, 0x80, 0, 0x29, volume_id, label, b"FAT16   ")
+        sector[510:512] = b"\x55\xAA"
+        return bytes(sector)
+
+    @staticmethod
+    def _build_fs_info(geometry: FatGeometry, next_cluster: int) -> bytes:
+        sector = bytearray(SECTOR_SIZE)
+        free_clusters = geometry.cluster_count - (next_cluster - 2)
+        struct.pack_into("<I", sector, 0, 0x41615252)
+        struct.pack_into("<III", sector, 484, 0x61417272, free_clusters, next_cluster)
+        struct.pack_into("<I", sector, 508, 0xAA550000)
+        return bytes(sector)
+
+    def _directory_bytes(self, directory: _Node, parent: Optional[_Node], geometry: FatGeometry) -> bytes:
+        payload = bytearray()
+        if parent is None:
+            if self._label:
+                date_value, time_value = _fat_datetime(directory.mtime)
+                payload += _DIR_ENTRY.pack(
+                    _volume_label_bytes(self._label), _ATTR_VOLUME_ID, 0, 0, 0, 0, 0, 0, time_value, date_value, 0, 0
+                )
+        else:
+            parent_cluster = 0 if parent.name == "" else parent.first_cluster
+            payload += _short_entry(b".          ", _ATTR_DIRECTORY, directory.first_cluster, 0, directory.mtime)
+            payload += _short_entry(b"..         ", _ATTR_DIRECTORY, parent_cluster, 0, directory.mtime)
+
+        for child in directory.children:
+            if child.long_name is not None:
+                payload += _lfn_entries(child.long_name, child.short_name)
+            attributes = _ATTR_DIRECTORY if child.is_dir else _ATTR_ARCHIVE
+            payload += _short_entry(
+                child.short_name,
+                attributes,
+                child.first_cluster,
+                0 if child.is_dir else child.size,
+                child.mtime,
+            )
+        return bytes(payload)
+
+    @staticmethod
+    def _stream_file(
+        handle: BinaryIO,
+        node: _Node,
+        cluster_size: int,
+        checkpoint: Optional[Callable[[], None]] = None,
+    ) -> int:
+        remaining = node.size
+        buffer = bytearray(min(_COPY_CHUNK_SIZE, max(remaining, 1)))
+        view = memoryview(buffer)
+        with open(node.source_path, "rb") as source:
+            while remaining > 0:
+                if checkpoint is not None:
+                    checkpoint()
+                read_size = source.readinto(view[: min(len(buffer), remaining)])
+                if not read_size:
+                    break
+                handle.write(view[:read_size])
+                remaining -= read_size
+        padding = node.cluster_count * cluster_size - (node.size - remaining)
+        if padding:
+            handle.write(bytes(padding))
+        return node.size - remaining
+
+    @staticmethod
+    def _pad(payload: bytes, size: int) -> bytes:
+        if len(payload) > size:
+            raise FatImageError("Katalog nie miesci sie w przydzielonym obszarze obrazu FAT.")
+        return payload + bytes(size - len(payload))
+
+
+class FatImageReader:
+    def __init__(self, handle: BinaryIO) -> None:
+        self._handle = handle
+        handle.seek(0)
+        boot_sector = handle.read(SECTOR_SIZE)
+        if boot_sector[510:512] != b"\x55\xAA":
+            raise FatImageError("Brak sygnatury sektora rozruchowego FAT.")
+        (
+            _,
+            _,
+            bytes_per_sector,
+            sectors_per_cluster,
+            reserved_sectors,
+            num_fats,
+            root_entries,
+            total_16,
+            _,
+            fat_16,
+            _,
+            _,
+            _,
+            total_32,
+        ) = struct.unpack_from("<3s8sHBHBHHBHHHII", boot_sector, 0)
+        if bytes_per_sector != SECTOR_SIZE:
+            raise FatImageError("Nieobslugiwany rozmiar sektora FAT.")
+        fat_type = FAT16 if fat_16 else FAT32
+        fat_sectors = fat_16 or struct.unpack_from("<I", boot_sector, 36)[0]
+        self.geometry = FatGeometry(
+            fat_type=fat_type,
+            total_sectors=total_16 or total_32,
+            sectors_per_cluster=sectors_per_cluster,
+            reserved_sectors=reserved_sectors,
+            fat_sectors=fat_sectors,
+            root_entries=root_entries,
+            num_fats=num_fats,
+        )
+        self._root_cluster = struct.unpack_from("<I", boot_sector, 44)[0] if fat_type == FAT32 else 0
+        handle.seek(reserved_sectors * SECTOR_SIZE)
+        raw_fat = handle.read(fat_sectors * SECTOR_SIZE)
+        self._fat = array("I" if fat_type == FAT32 else "H", raw_fat)
+        if sys.byteorder != "little":
+            self._fat.byteswap()
+        self._end_of_chain = 0x0FFFFFF8 if fat_type == FAT32 else 0xFFF8
+
+    def cluster_chain(self, first_cluster: int) -> List[int]:
+        chain: List[int] = []
+        cluster = first_cluster
+        while 2 <= cluster < self._end_of_chain:
+            chain.append(cluster)
+            if len(chain) > self.geometry.cluster_count:
+                raise FatImageError("Petla w lancuchu klastrow FAT.")
+            cluster = self._fat[cluster] & (0x0FFFFFFF if self.geometry.fat_type == FAT32 else 0xFFFF)
+        return chain
+
+    def iter_entries(self) -> Iterator[Tuple[str, bool, int, int]]:
+        pending = [("", self._root_cluster)]
+        while pending:
+            directory_path, cluster = pending.pop(0)
+            for name, is_dir, first_cluster, size in self._read_directory(cluster):
+                child_path = f"{directory_path}/{name}" if directory_path else name
+                yield child_path, is_dir, first_cluster, size
+                if is_dir:
+                    pending.append((child_path, first_cluster))
+
+    def read_file(self, first_cluster: int, size: int) -> bytes:
+        cluster_size = self.geometry.cluster_size
+        payload = bytearray()
+        for cluster in self.cluster_chain(first_cluster):
+            self._handle.seek(self.geometry.cluster_offset(cluster))
+            payload += self._handle.read(cluster_size)
+        return bytes(payload[:size])
+
+    def _read_directory(self, cluster: int) -> Iterator[Tuple[str, bool, int, int]]:
+        if cluster == 0:
+            self._handle.seek(self.geometry.root_dir_start_sector * SECTOR_SIZE)
+            raw = self._handle.read(self.geometry.root_dir_sectors * SECTOR_SIZE)
+        else:
+            raw = self.read_file(cluster, len(self.cluster_chain(cluster)) * self.geometry.cluster_size)
+
+        long_parts: List[str] = []
+        for offset in range(0, len(raw), DIR_ENTRY_SIZE):
+            entry = raw[offset : offset + DIR_ENTRY_SIZE]
+            if entry[0] == 0x00:
+                return
+            if entry[0] == 0xE5:
+                long_parts = []
+                continue
+            if entry[11] == _ATTR_LONG_NAME:
+                units = entry[1:11] + entry[14:26] + entry[28:32]
+                part = units.decode("utf-16-le").split("\x00", 1)[0].replace("\uffff", "")
+                long_parts.insert(0, part)
+                continue
+            fields = _DIR_ENTRY.unpack(entry)
+            short_name, attributes, nt_flags = fields[0], fields[1], fields[2]
+            long_name = "".join(long_parts)
+            long_parts = []
+            if attributes & _ATTR_VOLUME_ID or short_name[:1] == b".":
+                continue
+            first_cluster = (fields[7] << 16) | fields[10]
+            name = long_name or _decode_short_name(short_name, nt_flags)
+            yield name, bool(attributes & _ATTR_DIRECTORY), first_cluster, fields[11]
+
+
+def _sanitize_long_name(name: str) -> str:
+    cleaned = "".join("_" if char in _LONG_NAME_INVALID or ord(char) < 0x20 else char for char in name)
+    cleaned = cleaned.rstrip(" .")
+    if not cleaned:
+        cleaned = "_"
+    if len(cleaned.encode("utf-16-le")) // 2 > 255:
+        raise FatImageError(f"Nazwa pliku przekracza 255 znakow FAT: {name}")
+    return cleaned
+
+
+def _exact_short_name(name: str) -> Optional[bytes]:
+    if name != name.upper() or name.startswith(".") or name.count(".") > 1:
+        return None
+    base, _, extension = name.partition(".")
+    if not 1 <= len(base) <= 8 or len(extension) > 3:
+        return None
+    if not all(char in _SHORT_NAME_CHARS for char in base + extension):
+        return None
+    return (base.ljust(8) + extension.ljust(3)).encode("ascii")
+
+
+def _generate_short_name(name: str, used: Set[bytes]) -> bytes:
+    stripped = name.lstrip(".").replace(" ", "")
+    base, dot, extension = stripped.rpartition(".")
+    if not dot:
+        base, extension = stripped, ""
+    base = "".join(_short_char(char) for char in base.replace(".", ""))
+    extension = "".join(_short_char(char) for char in extension)[:3]
+    if not base:
+        base = "_"
+
+    for index in range(1, 1000000):
+        tail = f"~{index}"
+        candidate = (base[: 8 - len(tail)] + tail).ljust(8) + extension.ljust(3)
+        encoded = candidate.encode("ascii")
+        if encoded not in used:
+            if encoded[0] == 0xE5:
+                encoded = b"\x05" + encoded[1:]
+            return encoded
+    raise FatImageError(f"Nie mozna wygenerowac krotkiej nazwy FAT: {name}")
+
+
+def _short_char(char: str) -> str:
+    upper = char.upper()
+    if len(upper) == 1 and upper in _SHORT_NAME_CHARS:
+        return upper
+    return "_"
+
+
+def _decode_short_name(short_name: bytes, nt_flags: int) -> str:
+    base = short_name[:8].decode("ascii", "replace").rstrip()
+    extension = short_name[8:].decode("ascii", "replace").rstrip()
+    if nt_flags & _NT_LOWER_BASE:
+        base = base.lower()
+    if nt_flags & _NT_LOWER_EXT:
+        extension = extension.lower()
+    return f"{base}.{extension}" if extension else base
+
+
+def _lfn_entry_count(long_name: Optional[str]) -> int:
+    if long_name is None:
+        return 0
+    units = len(long_name.encode("utf-16-le")) // 2
+    return -(-units // _LFN_CHARS_PER_ENTRY)
+
+
+def _lfn_checksum(short_name: bytes) -> int:
+    checksum = 0
+    for byte in short_name:
+        checksum = (((checksum & 1) << 7) + (checksum >> 1) + byte) & 0xFF
+    return checksum
+
+
+def _lfn_entries(long_name: str, short_name: bytes) -> bytes:
+    encoded = long_name.encode("utf-16-le")
+    units = [encoded[index : index + 2] for index in range(0, len(encoded), 2)]
+    if len(units) % _LFN_CHARS_PER_ENTRY:
+        units.append(b"\x00\x00")
+    while len(units) % _LFN_CHARS_PER_ENTRY:
+        units.append(b"\xFF\xFF")
+
+    checksum = _lfn_checksum(short_name)
+    count = len(units) // _LFN_CHARS_PER_ENTRY
+    payload = bytearray()
+    for sequence in range(count, 0, -1):
+        chunk = units[(sequence - 1) * _LFN_CHARS_PER_ENTRY : sequence * _LFN_CHARS_PER_ENTRY]
+        order = sequence | (0x40 if sequence == count else 0)
+        payload += bytes([order]) + b"".join(chunk[0:5])
+        payload += bytes([_ATTR_LONG_NAME, 0, checksum]) + b"".join(chunk[5:11])
+        payload += b"\x00\x00" + b"".join(chunk[11:13])
+    return bytes(payload)
+
+
+def _short_entry(short_name: bytes, attributes: int, cluster: int, size: int, mtime: float) -> bytes:
+    date_value, time_value = _fat_datetime(mtime)
+    return _DIR_ENTRY.pack(
+        short_name,
+        attributes,
+        0,
+        0,
+        time_value,
+        date_value,
+        date_value,
+        (cluster >> 16) & 0xFFFF,
+        time_value,
+        date_value,
+        cluster & 0xFFFF,
+        size,
+    )
+
+
+def _fat_datetime(timestamp: float) -> Tuple[int, int]:
+    moment = time.localtime(timestamp)
+    if moment.tm_year < 1980:
+        return (1 << 5) | 1, 0
+    year = min(moment.tm_year, 2107)
+    date_value = ((year - 1980) << 9) | (moment.tm_mon << 5) | moment.tm_mday
+    time_value = (moment.tm_hour << 11) | (moment.tm_min << 5) | (min(moment.tm_sec, 59) // 2)
+    return date_value, time_value
+
+
+def _volume_label_bytes(label: str) -> bytes:
+    if not label:
+        return b"NO NAME    "
+    return label.upper().encode("ascii", "replace")[:11].ljust(11)
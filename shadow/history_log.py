@@ -0,0 +1,299 @@
+import json
+import os
+import struct
+import tempfile
+import threading
+from typing import Dict, Iterator, List, Mapping, Optional
+
+
+DEFAULT_HISTORY_FILE = "/var/lib/cnc-control/shadow_history.jsonl"
+INDEX_SUFFIX = ".idx"
+
+_OFFSET = struct.Struct("<Q")
+_SCAN_CHUNK_BYTES = 64 * 1024
+_MIN_SEGMENT_BYTES = 4096
+
+
+class HistoryLog:
+    def __init__(self, path: str, max_bytes: int = 1024 * 1024, backups: int = 3) -> None:
+        self._path = path
+        self._max_bytes = max(_MIN_SEGMENT_BYTES, max_bytes)
+        self._backups = max(0, backups)
+        self._lock = threading.Lock()
+        self._prepared = False
+        self._next_seq = 1
+
+    @classmethod
+    def from_environment(cls, environment: Mapping[str, str]) -> "HistoryLog":
+        return cls(
+            path=environment.get("CNC_SHADOW_HISTORY_FILE", DEFAULT_HISTORY_FILE),
+            max_bytes=int(environment.get("CNC_SHADOW_HISTORY_MAX_BYTES", "1048576")),
+            backups=int(environment.get("CNC_SHADOW_HISTORY_BACKUPS", "3")),
+        )
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def prepare(self) -> None:
+        with self._lock:
+            self._prepare()
+
+    def append(self, entry: Mapping[str, object]) -> Dict[str, object]:
+        with self._lock:
+            self._prepare()
+            stored = {"seq": self._next_seq, **entry}
+            line = (json.dumps(stored, ensure_ascii=False) + "\n").encode("utf-8")
+            os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+            try:
+                size = os.path.getsize(self._path)
+            except OSError:
+                size = 0
+            if size and size + len(line) > self._max_bytes:
+                self._rotate()
+            with open(self._path, "ab") as log_handle:
+                offset = log_handle.tell()
+                log_handle.write(line)
+                log_handle.flush()
+                os.fsync(log_handle.fileno())
+            with open(self._path + INDEX_SUFFIX, "ab") as index_handle:
+                index_handle.write(_OFFSET.pack(offset))
+            self._next_seq += 1
+        return stored
+
+    def latest(self, limit: int) -> List[Dict[str, object]]:
+        entries: List[Dict[str, object]] = []
+        for segment_path in self.segments():
+            if len(entries) >= limit:
+                break
+            entries.extend(_read_tail(segment_path, limit - len(entries)))
+        return entries
+
+    def iter_latest(self) -> Iterator[Dict[str, object]]:
+        for segment_path in self.segments():
+            yield from _iter_reversed(segment_path)
+
+    def segments(self) -> List[str]:
+        paths = [self._path]
+        generation = 1
+        while os.path.exists(f"{self._path}.{generation}"):
+            paths.append(f"{self._path}.{generation}")
+            generation += 1
+        return paths
+
+    def _prepare(self) -> None:
+        if self._prepared:
+            return
+        self._migrate_legacy()
+        for segment_path in self.segments():
+            _repair_segment(segment_path)
+        last_entry = next(self.iter_latest(), None)
+        if last_entry is not None and isinstance(last_entry.get("seq"), int):
+            self._next_seq = last_entry["seq"] + 1
+        self._prepared = True
+
+    def _rotate(self) -> None:
+        if self._backups == 0:
+            for path in (self._path, self._path + INDEX_SUFFIX):
+                _remove_quietly(path)
+            return
+        for generation in range(self._backups, 0, -1):
+            source = self._path if generation == 1 else f"{self._path}.{generation - 1}"
+            target = f"{self._path}.{generation}"
+            if not os.path.exists(source):
+                continue
+            os.replace(source, target)
+            if os.path.exists(source + INDEX_SUFFIX):
+                os.replace(source + INDEX_SUFFIX, target + INDEX_SUFFIX)
+            else:
+                _remove_quietly(target + INDEX_SUFFIX)
+
+    def _migrate_legacy(self) -> None:
+        candidates = [self._path]
+        if self._path.endswith(".jsonl") and not os.path.exists(self._path):
+            candidates.append(self._path[:-1])
+        for candidate in candidates:
+            entries = _read_legacy_list(candidate)
+            if entries is None:
+                continue
+            directory = os.path.dirname(self._path) or "."
+            os.makedirs(directory, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                mode="wb",
+                dir=directory,
+                prefix="shadow-history-",
+                suffix=".tmp",
+                delete=False,
+            ) as temp_handle:
+                for seq, entry in enumerate(entries, start=1):
+                    stored = {"seq": seq, **entry}
+                    temp_handle.write((json.dumps(stored, ensure_ascii=False) + "\n").encode("utf-8"))
+                temp_handle.flush()
+                os.fsync(temp_handle.fileno())
+                temp_path = temp_handle.name
+            os.replace(temp_path, self._path)
+            _remove_quietly(self._path + INDEX_SUFFIX)
+            if candidate != self._path:
+                _remove_quietly(candidate)
+            return
+
+
+def _read_legacy_list(path: str) -> Optional[List[Dict[str, object]]]:
+    try:
+        with open(path, "r", encoding="utf-8") as legacy_handle:
+            if not legacy_handle.read(64).lstrip().startswith("["):
+                return None
+            legacy_handle.seek(0)
+            payload = json.load(legacy_handle)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(payload, list):
+        return None
+    return [entry for entry in payload if isinstance(entry, dict)]
+
+
+def _repair_segment(log_path: str) -> None:
+    index_path = log_path + INDEX_SUFFIX
+    try:
+        log_size = os.path.getsize(log_path)
+    except OSError:
+        _remove_quietly(index_path)
+        return
+    with open(index_path, "a+b") as index_handle:
+        index_handle.seek(0, os.SEEK_END)
+        indexed = index_handle.tell() // _OFFSET.size
+        scan_from = 0
+        if indexed:
+            index_handle.seek((indexed - 1) * _OFFSET.size)
+            (last_offset,) = _OFFSET.unpack(index_handle.read(_OFFSET.size))
+            if _is_line_start(log_path, last_offset, log_size):
+                scan_from = last_offset
+                indexed -= 1
+            else:
+                indexed = 0
+        offsets, complete_size = _line_offsets(log_path, scan_from)
+        index_handle.truncate(indexed * _OFFSET.size)
+        index_handle.write(b"".join(_OFFSET.pack(offset) for offset in offsets))
+    if complete_size < log_size:
+        with open(log_path, "r+b") as log_handle:
+            log_handle.truncate(complete_size)
+
+
+def _line_offsets(log_path: str, start: int):
+    offsets = []
+    position = start
+    with open(log_path, "rb") as log_handle:
+        log_handle.seek(start)
+        for line in log_handle:
+            if not line.endswith(b"\n"):
+                break
+            offsets.append(position)
+            position += len(line)
+    return offsets, position
+
+
+def _is_line_start(log_path: str, offset: int, log_size: int) -> bool:
+    if offset >= log_size:
+        return False
+    if offset == 0:
+        return True
+    with open(log_path, "rb") as log_handle:
+        log_handle.seek(offset - 1)
+        return log_handle.read(1) == b"\n"
+
+
+def _read_tail(log_path: str, count: int) -> List[Dict[str, object]]:
+    try:
+        log_size = os.path.getsize(log_path)
+    except OSError:
+        return []
+    if count <= 0 or log_size == 0:
+        return []
+    start = _indexed_start(log_path, count, log_size)
+    if start is None:
+        start = _scanned_start(log_path, count, log_size)
+    with open(log_path, "rb") as log_handle:
+        log_handle.seek(start)
+        lines = log_handle.read(log_size - start).split(b"\n")[:-1]
+    entries: List[Dict[str, object]] = []
+    for raw_line in reversed(lines):
+        entry = _decode_line(raw_line)
+        if entry is not None:
+            entries.append(entry)
+            if len(entries) >= count:
+                break
+    return entries
+
+
+def _iter_reversed(log_path: str) -> Iterator[Dict[str, object]]:
+    try:
+        log_handle = open(log_path, "rb")
+    except OSError:
+        return
+    with log_handle:
+        position = log_handle.seek(0, os.SEEK_END)
+        remainder = b""
+        while position > 0:
+            chunk_start = max(0, position - _SCAN_CHUNK_BYTES)
+            log_handle.seek(chunk_start)
+            lines = (log_handle.read(position - chunk_start) + remainder).split(b"\n")
+            remainder = lines.pop(0)
+            for raw_line in reversed(lines):
+                entry = _decode_line(raw_line)
+                if entry is not None:
+                    yield entry
+            position = chunk_start
+        entry = _decode_line(remainder)
+        if entry is not None:
+            yield entry
+
+
+def _decode_line(raw_line: bytes) -> Optional[Dict[str, object]]:
+    try:
+        entry = json.loads(raw_line)
+    except ValueError:
+        return None
+    return entry if isinstance(entry, dict) else None
+
+
+def _indexed_start(log_path: str, count: int, log_size: int) -> Optional[int]:
+    try:
+        with open(log_path + INDEX_SUFFIX, "rb") as index_handle:
+            index_handle.seek(0, os.SEEK_END)
+            indexed = index_handle.tell() // _OFFSET.size
+            if indexed < count:
+                return 0 if indexed else None
+            index_handle.seek((indexed - count) * _OFFSET.size)
+            (offset,) = _OFFSET.unpack(index_handle.read(_OFFSET.size))
+    except OSError:
+        return None
+    if not _is_line_start(log_path, offset, log_size):
+        return None
+    return offset
+
+
+def _scanned_start(log_path: str, count: int, log_size: int) -> int:
+    newlines = 0
+    position = log_size
+    with open(log_path, "rb") as log_handle:
+        while position > 0:
+            chunk_start = max(0, position - _SCAN_CHUNK_BYTES)
+            log_handle.seek(chunk_start)
+            chunk = log_handle.read(position - chunk_start)
+            index = len(chunk)
+            while True:
+                index = chunk.rfind(b"\n", 0, index)
+                if index < 0:
+                    break
+                newlines += 1
+                if newlines > count:
+                    return chunk_start + index + 1
+            position = chunk_start
+    return 0
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
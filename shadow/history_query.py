@@ -0,0 +1,137 @@
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+
+MAX_QUERY_LIMIT = 100
+
+HistoryKey = Tuple[datetime, str, int]
+
+_OLDEST = datetime.min.replace(tzinfo=timezone.utc)
+
+
+def parse_timestamp(value: object) -> Optional[datetime]:
+    if not isinstance(value, str) or not value.strip():
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def entry_key(entry: Mapping[str, object]) -> HistoryKey:
+    seq = entry.get("seq")
+    return (
+        parse_timestamp(entry.get("finished_at")) or _OLDEST,
+        str(entry.get("lun") or ""),
+        seq if isinstance(seq, int) else 0,
+    )
+
+
+def encode_cursor(entry: Mapping[str, object]) -> str:
+    payload = json.dumps(
+        [entry.get("finished_at"), entry.get("lun") or "", entry.get("seq") or 0],
+        separators=(",", ":"),
+    )
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> HistoryKey:
+    try:
+        raw_cursor = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        finished_at, lun, seq = json.loads(raw_cursor)
+    except (binascii.Error, TypeError, ValueError):
+        raise ValueError(f"Nieprawidlowy kursor historii: {cursor}") from None
+    if parse_timestamp(finished_at) is None:
+        raise ValueError(f"Nieprawidlowy kursor historii: {cursor}")
+    return entry_key({"finished_at": finished_at, "lun": lun, "seq": seq})
+
+
+@dataclass(frozen=True)
+class HistoryQuery:
+    limit: int = 20
+    triggers: Tuple[str, ...] = ()
+    results: Tuple[str, ...] = ()
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+    before: Optional[HistoryKey] = None
+
+    @classmethod
+    def from_args(cls, args: Mapping[str, str]) -> "HistoryQuery":
+        try:
+            limit = int(args.get("limit", "20"))
+        except (TypeError, ValueError):
+            limit = 20
+        cursor = (args.get("cursor") or "").strip()
+        return cls(
+            limit=max(1, min(limit, MAX_QUERY_LIMIT)),
+            triggers=_split_values(args.get("trigger")),
+            results=_split_values(args.get("result")),
+            since=_parse_bound(args, "since"),
+            until=_parse_bound(args, "until"),
+            before=decode_cursor(cursor) if cursor else None,
+        )
+
+    def matches(self, entry: Mapping[str, object]) -> bool:
+        if self.triggers and entry.get("trigger") not in self.triggers:
+            return False
+        if self.results and entry.get("result") not in self.results:
+            return False
+        finished_at = parse_timestamp(entry.get("finished_at"))
+        if self.since is not None and (finished_at is None or finished_at < self.since):
+            return False
+        if self.until is not None and (finished_at is None or finished_at >= self.until):
+            return False
+        return True
+
+
+def query_entries(
+    entries: Iterable[Mapping[str, object]],
+    query: HistoryQuery,
+) -> Tuple[List[Dict[str, object]], Optional[str]]:
+    page: List[Dict[str, object]] = []
+    for entry in entries:
+        key = entry_key(entry)
+        if query.before is not None and key >= query.before:
+            continue
+        if query.since is not None and key[0] < query.since:
+            break
+        if not query.matches(entry):
+            continue
+        if len(page) == query.limit:
+            return page, encode_cursor(page[-1])
+        page.append(dict(entry))
+    return page, None
+
+
+def merge_pages(
+    pages: Sequence[Tuple[List[Dict[str, object]], Optional[str]]],
+    limit: int,
+) -> Tuple[List[Dict[str, object]], Optional[str]]:
+    merged = [entry for entries, _cursor in pages for entry in entries]
+    merged.sort(key=entry_key, reverse=True)
+    page = merged[:limit]
+    has_more = len(merged) > limit or any(cursor is not None for _entries, cursor in pages)
+    return page, encode_cursor(page[-1]) if has_more and page else None
+
+
+def _split_values(raw_value: Optional[str]) -> Tuple[str, ...]:
+    if not raw_value:
+        return ()
+    return tuple(value.strip() for value in raw_value.split(",") if value.strip())
+
+
+def _parse_bound(args: Mapping[str, str], name: str) -> Optional[datetime]:
+    raw_value = (args.get(name) or "").strip()
+    if not raw_value:
+        return None
+    parsed = parse_timestamp(raw_value)
+    if parsed is None:
+        raise ValueError(f"Nieprawidlowa wartosc {name}: {raw_value}")
+    return parsed
@@ -0,0 +1,128 @@
+import math
+import threading
+from collections import Counter, deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Deque, Dict, Iterable, List, Mapping, Optional, Sequence
+
+from shadow.history_query import parse_timestamp
+
+
+PERCENTILES = (50, 95, 99)
+_MAX_SAMPLES = 10000
+
+
+@dataclass(frozen=True)
+class HistorySample:
+    finished_at: datetime
+    trigger: str
+    result: str
+    duration_ms: Optional[float]
+    phases_ms: Dict[str, float]
+
+    @classmethod
+    def from_entry(cls, entry: Mapping[str, object]) -> Optional["HistorySample"]:
+        finished_at = parse_timestamp(entry.get("finished_at"))
+        if finished_at is None:
+            return None
+        duration_ms = entry.get("duration_ms")
+        raw_phases = entry.get("phases_ms")
+        phases_ms = {}
+        if isinstance(raw_phases, dict):
+            phases_ms = {
+                str(name): float(value)
+                for name, value in raw_phases.items()
+                if isinstance(value, (int, float)) and not isinstance(value, bool)
+            }
+        return cls(
+            finished_at=finished_at,
+            trigger=str(entry.get("trigger") or ""),
+            result=str(entry.get("result") or ""),
+            duration_ms=float(duration_ms) if isinstance(duration_ms, (int, float)) else None,
+            phases_ms=phases_ms,
+        )
+
+
+class HistoryStats:
+    def __init__(self, retention_seconds: float, max_samples: int = _MAX_SAMPLES) -> None:
+        self._retention = timedelta(seconds=max(0.0, retention_seconds))
+        self._lock = threading.Lock()
+        self._samples: Deque[HistorySample] = deque(maxlen=max(1, max_samples))
+
+    @classmethod
+    def from_environment(cls, environment: Mapping[str, str]) -> "HistoryStats":
+        return cls(retention_seconds=float(environment.get("CNC_SHADOW_STATS_RETENTION_HOURS", "168")) * 3600)
+
+    @property
+    def retention_seconds(self) -> float:
+        return self._retention.total_seconds()
+
+    def seed(self, entries: Iterable[Mapping[str, object]]) -> None:
+        cutoff = _utc_now() - self._retention
+        seeded: List[HistorySample] = []
+        for entry in entries:
+            sample = HistorySample.from_entry(entry)
+            if sample is None:
+                continue
+            if sample.finished_at < cutoff or len(seeded) == self._samples.maxlen:
+                break
+            seeded.append(sample)
+        with self._lock:
+            self._samples.clear()
+            self._samples.extend(sorted(seeded, key=lambda sample: sample.finished_at))
+
+    def add(self, entry: Mapping[str, object]) -> None:
+        sample = HistorySample.from_entry(entry)
+        if sample is None:
+            return
+        cutoff = _utc_now() - self._retention
+        with self._lock:
+            self._samples.append(sample)
+            while self._samples and self._samples[0].finished_at < cutoff:
+                self._samples.popleft()
+
+    def samples(self, window_seconds: float, trigger: Optional[str] = None) -> List[HistorySample]:
+        if math.isnan(window_seconds):
+            window_seconds = 0.0
+        cutoff = _utc_now() - timedelta(seconds=min(max(0.0, window_seconds), self.retention_seconds))
+        selected: List[HistorySample] = []
+        with self._lock:
+            for sample in reversed(self._samples):
+                if sample.finished_at < cutoff:
+                    break
+                if trigger is None or sample.trigger == trigger:
+                    selected.append(sample)
+        return selected
+
+
+def summarize_samples(samples: Sequence[HistorySample], window_seconds: float) -> Dict[str, object]:
+    results = Counter(sample.result for sample in samples)
+    runs = results["ok"] + results["error"]
+    completed = [sample for sample in samples if sample.result == "ok"]
+    phases: Dict[str, List[float]] = {}
+    for sample in completed:
+        for name, value in sample.phases_ms.items():
+            phases.setdefault(name, []).append(value)
+    return {
+        "window_seconds": window_seconds,
+        "count": len(samples),
+        "results": dict(results),
+        "failure_rate": round(results["error"] / runs, 4) if runs else None,
+        "duration_ms": _distribution(sample.duration_ms for sample in completed if sample.duration_ms is not None),
+        "phases_ms": {name: _distribution(values) for name, values in sorted(phases.items())},
+    }
+
+
+def _distribution(values: Iterable[float]) -> Optional[Dict[str, float]]:
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    distribution = {"count": len(ordered), "min": ordered[0], "max": ordered[-1]}
+    for percentile in PERCENTILES:
+        rank = max(1, math.ceil(percentile / 100 * len(ordered)))
+        distribution[f"p{percentile}"] = ordered[rank - 1]
+    return distribution
+
+
+def _utc_now() -> datetime:
+    return datetime.now(timezone.utc)
@@ -0,0 +1,144 @@
+import os
+from dataclasses import dataclass
+from fnmatch import fnmatchcase
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+
+DEFAULT_IGNORE_PATTERNS = (
+    ".*",
+    "~$*",
+    "*~",
+    "*.part",
+    "*.tmp",
+    "*.crdownload",
+    "Thumbs.db",
+    "desktop.ini",
+)
+DEFAULT_IGNORE_FILE = ".cncignore"
+
+
+@dataclass(frozen=True)
+class _IgnoreRule:
+    pattern: str
+    base_dir: str
+    anchored: bool
+    directory_only: bool
+
+    def matches(self, relative_path: str, name: str, is_dir: bool) -> bool:
+        if self.directory_only and not is_dir:
+            return False
+        if not self.anchored:
+            return fnmatchcase(name.lower(), self.pattern)
+        prefix = f"{self.base_dir}/" if self.base_dir else ""
+        if not relative_path.startswith(prefix):
+            return False
+        return fnmatchcase(relative_path[len(prefix):].lower(), self.pattern)
+
+
+class IgnoreMatcher:
+    def __init__(self, relative_dir: str, rules: Sequence[_IgnoreRule], ignore_file: str) -> None:
+        self._relative_dir = relative_dir
+        self._rules = rules
+        self._ignore_file = ignore_file
+
+    def ignores(self, name: str, is_dir: bool = False) -> bool:
+        if self._ignore_file and name == self._ignore_file:
+            return True
+        relative_path = f"{self._relative_dir}/{name}" if self._relative_dir else name
+        return any(rule.matches(relative_path, name, is_dir) for rule in self._rules)
+
+
+class IgnoreRules:
+    def __init__(
+        self,
+        root_dir: str,
+        patterns: Sequence[str] = DEFAULT_IGNORE_PATTERNS,
+        ignore_file: str = DEFAULT_IGNORE_FILE,
+    ) -> None:
+        self._root_dir = root_dir
+        self._patterns = tuple(patterns)
+        self._ignore_file = ignore_file
+        self._global_rules = [rule for rule in (_parse_rule(pattern, "") for pattern in self._patterns) if rule]
+        self._directory_rules: Dict[str, Tuple[Tuple[int, int], List[_IgnoreRule]]] = {}
+
+    @classmethod
+    def from_environment(cls, environment: Mapping[str, str]) -> "IgnoreRules":
+        raw_patterns = environment.get("CNC_SHADOW_IGNORE_PATTERNS")
+        if raw_patterns is None:
+            patterns: Sequence[str] = DEFAULT_IGNORE_PATTERNS
+        else:
+            patterns = [pattern.strip() for pattern in raw_patterns.split(",") if pattern.strip()]
+        ignore_file = environment.get("CNC_SHADOW_IGNORE_FILE", DEFAULT_IGNORE_FILE).strip()
+        if "/" in ignore_file:
+            raise ValueError(f"Nieprawidlowa wartosc CNC_SHADOW_IGNORE_FILE: {ignore_file}")
+        return cls(
+            root_dir=environment.get("CNC_MASTER_DIR", "/var/lib/cnc-control/master"),
+            patterns=patterns,
+            ignore_file=ignore_file,
+        )
+
+    @property
+    def patterns(self) -> Tuple[str, ...]:
+        return self._patterns
+
+    @property
+    def ignore_file(self) -> str:
+        return self._ignore_file
+
+    def matcher(self, relative_dir: str = "") -> IgnoreMatcher:
+        relative_dir = relative_dir.strip("/")
+        rules = list(self._global_rules)
+        if self._ignore_file:
+            rules.extend(self._load_directory_rules(""))
+            parts = relative_dir.split("/") if relative_dir else []
+            for depth in range(1, len(parts) + 1):
+                rules.extend(self._load_directory_rules("/".join(parts[:depth])))
+        return IgnoreMatcher(relative_dir, rules, self._ignore_file)
+
+    def is_ignored(self, relative_path: str, is_dir: bool = False) -> bool:
+        parts = [part for part in relative_path.split("/") if part]
+        for depth, name in enumerate(parts):
+            is_last = depth == len(parts) - 1
+            if self.matcher("/".join(parts[:depth])).ignores(name, is_dir=is_dir or not is_last):
+                return True
+        return False
+
+    def is_ignore_file(self, relative_path: str) -> bool:
+        return bool(self._ignore_file) and relative_path.rsplit("/", 1)[-1] == self._ignore_file
+
+    def _load_directory_rules(self, relative_dir: str) -> List[_IgnoreRule]:
+        path = os.path.join(self._root_dir, relative_dir, self._ignore_file)
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            self._directory_rules.pop(relative_dir, None)
+            return []
+        signature = (stat_result.st_mtime_ns, stat_result.st_size)
+        cached = self._directory_rules.get(relative_dir)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        try:
+            with open(path, "r", encoding="utf-8", errors="replace") as ignore_handle:
+                rules = [rule for rule in (_parse_rule(line, relative_dir) for line in ignore_handle) if rule]
+        except OSError:
+            return []
+        self._directory_rules[relative_dir] = (signature, rules)
+        return rules
+
+
+def _parse_rule(raw_pattern: str, base_dir: str) -> Optional[_IgnoreRule]:
+    pattern = raw_pattern.strip()
+    if not pattern or pattern.startswith("#"):
+        return None
+    directory_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+    if not pattern:
+        return None
+    return _IgnoreRule(
+        pattern=pattern.lower(),
+        base_dir=base_dir,
+        anchored=anchored,
+        directory_only=directory_only,
+    )
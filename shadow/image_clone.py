@@ -0,0 +1,116 @@
+import errno
+import fcntl
+import os
+from typing import Iterator, Tuple
+
+
+FICLONE = 0x40049409
+_COPY_CHUNK_SIZE = 4 * 1024 * 1024
+_UNSUPPORTED_ERRNOS = {
+    errno.EBADF,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+    errno.EXDEV,
+    errno.EPERM,
+}
+
+
+def clone_file(source_path: str, target_path: str, preallocate: bool = True) -> str:
+    with open(source_path, "rb") as source_handle, open(target_path, "wb") as target_handle:
+        source_fd = source_handle.fileno()
+        target_fd = target_handle.fileno()
+        try:
+            fcntl.ioctl(target_fd, FICLONE, source_fd)
+            return "reflink"
+        except OSError as exc:
+            if exc.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+
+        size = os.fstat(source_fd).st_size
+        if preallocate:
+            preallocate_fd(target_fd, size)
+        if _copy_file_range(source_fd, target_fd, size):
+            return "copy_file_range"
+
+        os.lseek(source_fd, 0, os.SEEK_SET)
+        os.lseek(target_fd, 0, os.SEEK_SET)
+        while True:
+            chunk = source_handle.read(_COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            target_handle.write(chunk)
+        target_handle.truncate(size)
+        return "copy"
+
+
+def preallocate_fd(fd: int, size: int) -> bool:
+    if size <= 0 or not hasattr(os, "posix_fallocate"):
+        return False
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError as exc:
+        if exc.errno in _UNSUPPORTED_ERRNOS:
+            return False
+        raise
+    return True
+
+
+def _copy_file_range(source_fd: int, target_fd: int, size: int) -> bool:
+    if not hasattr(os, "copy_file_range"):
+        return False
+    offset = 0
+    while offset < size:
+        try:
+            copied = os.copy_file_range(source_fd, target_fd, size - offset, offset, offset)
+        except OSError as exc:
+            if offset == 0 and exc.errno in _UNSUPPORTED_ERRNOS:
+                return False
+            raise
+        if copied == 0:
+            break
+        offset += copied
+    if offset != size:
+        raise OSError(errno.EIO, f"Niepelna kopia obrazu ({offset}/{size} B).")
+    return True
+
+
+def stream_file(source_path: str, target_path: str) -> int:
+    with open(source_path, "rb") as source_handle, open(target_path, "wb") as target_handle:
+        size = os.fstat(source_handle.fileno()).st_size
+        preallocate_fd(target_handle.fileno(), size)
+        written = 0
+        for start, end in _data_segments(source_handle.fileno(), size):
+            source_handle.seek(start)
+            target_handle.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = source_handle.read(min(_COPY_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                target_handle.write(chunk)
+                remaining -= len(chunk)
+                written += len(chunk)
+        target_handle.truncate(size)
+        return written
+
+
+def _data_segments(fd: int, size: int) -> Iterator[Tuple[int, int]]:
+    if not hasattr(os, "SEEK_DATA"):
+        yield 0, size
+        return
+    offset = 0
+    while offset < size:
+        try:
+            data_start = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as exc:
+            if exc.errno == errno.ENXIO:
+                return
+            if offset == 0 and exc.errno in _UNSUPPORTED_ERRNOS:
+                yield 0, size
+                return
+            raise
+        hole_start = min(os.lseek(fd, data_start, os.SEEK_HOLE), size)
+        yield data_start, hole_start
+        offset = hole_start
@@ -0,0 +1,264 @@
+import logging
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from shadow.capacity import CapacityError
+from shadow.change_events import relative_master_path
+from shadow.event_bus import EventBus, Subscription
+from shadow.history_query import HistoryQuery, merge_pages
+from shadow.history_stats import summarize_samples
+from shadow.shadow_manager import ShadowManager
+from shadow.slot_manager import SlotManager
+from shadow.state_store import ShadowState
+from shadow.usb_manager import MultiLunExport, UsbManager
+
+
+MAX_LUNS = 8
+_LUN_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,11}$")
+_COMBINED_STATE_PRIORITY = (
+    "EXPORT_STOP",
+    "EXPORT_START",
+    "BUILD_SLOT_A",
+    "BUILD_SLOT_B",
+    "CHANGE_DETECTED",
+    "ERROR",
+    "READY",
+    "IDLE",
+)
+
+
+class LunConfigError(RuntimeError):
+    pass
+
+
+@dataclass(frozen=True)
+class LunConfig:
+    name: str
+    master_dir: str
+    state_dir: str
+
+    def environment(self, base_environment: Mapping[str, str]) -> Dict[str, str]:
+        environment = dict(base_environment)
+        lock_root, lock_ext = os.path.splitext(
+            base_environment.get("CNC_SHADOW_LOCK_FILE", "/var/run/cnc-shadow.lock")
+        )
+        environment.update(
+            {
+                "CNC_MASTER_DIR": self.master_dir,
+                "CNC_USB_IMG_A": os.path.join(self.state_dir, "cnc_usb_a.img"),
+                "CNC_USB_IMG_B": os.path.join(self.state_dir, "cnc_usb_b.img"),
+                "CNC_ACTIVE_SLOT_FILE": os.path.join(self.state_dir, "shadow_active_slot.state"),
+                "CNC_SHADOW_STATE_FILE": os.path.join(self.state_dir, "shadow_state.json"),
+                "CNC_SHADOW_HISTORY_FILE": os.path.join(self.state_dir, "shadow_history.jsonl"),
+                "CNC_SHADOW_MANIFEST_FILE": os.path.join(self.state_dir, "shadow_manifest.json"),
+                "CNC_SHADOW_LOCK_FILE": f"{lock_root}-{self.name}{lock_ext}",
+                "CNC_USB_LABEL": self.name.upper(),
+            }
+        )
+        for key in ("CNC_SHADOW_TEMPLATE_DIR", "CNC_SHADOW_STAGING_DIR"):
+            shared_dir = base_environment.get(key, "").strip()
+            if shared_dir:
+                environment[key] = os.path.join(shared_dir, self.name)
+        return environment
+
+
+def load_lun_configs(environment: Mapping[str, str]) -> List[LunConfig]:
+    names = [name.strip() for name in environment.get("CNC_SHADOW_LUNS", "").split(",") if name.strip()]
+    if not names:
+        return []
+    if len(names) > MAX_LUNS:
+        raise LunConfigError(f"Nieprawidlowa wartosc CNC_SHADOW_LUNS: maksymalnie {MAX_LUNS} LUN.")
+    seen = set()
+    for name in names:
+        if not _LUN_NAME_PATTERN.match(name):
+            raise LunConfigError(
+                f"Nieprawidlowa nazwa LUN w CNC_SHADOW_LUNS: {name} (litery, cyfry, _ i -, maksymalnie 11 znakow)."
+            )
+        if name.upper() in seen:
+            raise LunConfigError(f"Zduplikowana nazwa LUN w CNC_SHADOW_LUNS: {name}")
+        seen.add(name.upper())
+
+    master_root = environment.get("CNC_MASTER_DIR", "/var/lib/cnc-control/master")
+    lun_root = environment.get("CNC_SHADOW_LUN_DIR", "/var/lib/cnc-control/luns")
+    return [
+        LunConfig(name=name, master_dir=os.path.join(master_root, name), state_dir=os.path.join(lun_root, name))
+        for name in names
+    ]
+
+
+class ShadowLunGroup:
+    def __init__(
+        self,
+        master_dir: str,
+        luns: List[LunConfig],
+        managers: Mapping[str, ShadowManager],
+        export: MultiLunExport,
+        environment: Mapping[str, str],
+        event_bus: Optional[EventBus] = None,
+    ) -> None:
+        self._master_dir = master_dir
+        self._luns = luns
+        self._managers = dict(managers)
+        self._export = export
+        self._environment = dict(environment)
+        self._event_bus = event_bus or EventBus()
+        self._logger = logging.getLogger(__name__)
+
+    @classmethod
+    def from_environment(cls, environment: Mapping[str, str]) -> "ShadowLunGroup":
+        luns = load_lun_configs(environment)
+        if not luns:
+            raise LunConfigError("Brak LUN w CNC_SHADOW_LUNS.")
+        export = MultiLunExport(UsbManager.from_environment(environment), [lun.name for lun in luns])
+        event_bus = EventBus()
+        managers = {
+            lun.name: ShadowManager.from_environment(
+                lun.environment(environment),
+                usb_manager=export.lun(lun.name),
+                lun_name=lun.name,
+                event_bus=event_bus,
+            )
+            for lun in luns
+        }
+        return cls(
+            master_dir=environment.get("CNC_MASTER_DIR", "/var/lib/cnc-control/master"),
+            luns=luns,
+            managers=managers,
+            export=export,
+            environment=environment,
+            event_bus=event_bus,
+        )
+
+    def start(self) -> None:
+        for lun in self._luns:
+            os.makedirs(lun.master_dir, exist_ok=True)
+            os.makedirs(lun.state_dir, exist_ok=True)
+            slot_manager = SlotManager.from_environment(lun.environment(self._environment))
+            self._export.register(lun.name, slot_manager.get_slot_path(slot_manager.read_active_slot()))
+        for lun in self._luns:
+            self._managers[lun.name].start()
+        self._logger.info("SHADOW LUN gotowe: %s", ", ".join(lun.name for lun in self._luns))
+
+    def notify_change(self, path: str, operation: str, size: Optional[int] = None) -> None:
+        manager, _relative_path = self._resolve_lun(path)
+        if manager is None:
+            self._logger.info("SHADOW zmiana poza katalogami LUN pominieta: %s", path)
+            return
+        manager.notify_change(path, operation, size)
+
+    def check_upload(self, path: str, size: int) -> None:
+        manager, relative_path = self._resolve_lun(path)
+        if manager is None:
+            raise CapacityError(
+                f"Plik {relative_path} jest poza katalogami LUN ({', '.join(self._managers)}) i nie zostanie "
+                "wyeksportowany."
+            )
+        manager.check_upload(path, size)
+
+    def check_upload_size(self, directory: str, size: int) -> None:
+        manager, _relative_dir = self._resolve_lun(directory)
+        if manager is not None:
+            manager.check_upload_size(directory, size)
+
+    def trigger_manual_rebuild(self):
+        results = [manager.trigger_manual_rebuild() for manager in self._managers.values()]
+        started = [name for name, (was_started, _message) in zip(self._managers, results) if was_started]
+        if not started:
+            return False, "Manual rebuild juz jest uruchomiony dla wszystkich LUN."
+        return True, f"Manual rebuild uruchomiony dla LUN: {', '.join(started)}."
+
+    def get_manual_status(self):
+        statuses = {name: manager.get_manual_status() for name, manager in self._managers.items()}
+        manual_entries = [status["last_manual"] for status in statuses.values() if status["last_manual"]]
+        return {
+            "running": any(status["running"] for status in statuses.values()),
+            "last_manual": max(manual_entries, key=lambda entry: entry.get("finished_at") or "", default=None),
+            "luns": statuses,
+        }
+
+    def get_rebuild_history(self, limit: int = 20):
+        entries = []
+        for manager in self._managers.values():
+            entries.extend(manager.get_rebuild_history(limit))
+        entries.sort(key=lambda entry: entry.get("finished_at") or "", reverse=True)
+        return entries[: max(1, limit)]
+
+    def query_history(self, query: HistoryQuery) -> Tuple[List[Dict[str, object]], Optional[str]]:
+        return merge_pages([manager.query_history(query) for manager in self._managers.values()], query.limit)
+
+    def get_history_stats(self, window_seconds: float, trigger: Optional[str] = None) -> Dict[str, object]:
+        samples = [
+            sample
+            for manager in self._managers.values()
+            for sample in manager.get_history_samples(window_seconds, trigger)
+        ]
+        return summarize_samples(samples, window_seconds)
+
+    def get_capacity_status(self) -> "LunCapacityStatus":
+        return LunCapacityStatus(
+            {name: manager.get_capacity_status() for name, manager in self._managers.items()}
+        )
+
+    def get_watcher_status(self) -> Dict[str, object]:
+        return {"luns": {name: manager.get_watcher_status() for name, manager in self._managers.items()}}
+
+    def subscribe_events(self, last_event_id: Optional[int] = None) -> Subscription:
+        return self._event_bus.subscribe(last_event_id)
+
+    def get_state(self) -> ShadowState:
+        states = {lun.name: self._managers[lun.name].get_state() for lun in self._luns}
+        lead = min(states.values(), key=lambda state: _COMBINED_STATE_PRIORITY.index(state.fsm_state))
+        failed = next(((name, state) for name, state in states.items() if state.fsm_state == "ERROR"), None)
+        last_error = None
+        if failed is not None and failed[1].last_error:
+            last_error = {**failed[1].last_error, "lun": failed[0]}
+        run_id = max(state.run_id for state in states.values())
+        return ShadowState(
+            fsm_state=lead.fsm_state,
+            active_slot=lead.active_slot,
+            rebuild_slot=lead.rebuild_slot,
+            run_id=run_id,
+            last_error=last_error,
+            rebuild_counter=run_id,
+        )
+
+    def get_lun_states(self) -> List[Dict[str, object]]:
+        states = []
+        for lun in self._luns:
+            state = self._managers[lun.name].get_state()
+            states.append(
+                {
+                    "name": lun.name,
+                    "master_dir": lun.master_dir,
+                    "fsm_state": state.fsm_state,
+                    "active_slot": state.active_slot,
+                    "rebuild_slot": state.rebuild_slot,
+                    "run_id": state.run_id,
+                    "last_error": state.last_error,
+                }
+            )
+        return states
+
+    def _resolve_lun(self, path: str) -> Tuple[Optional[ShadowManager], str]:
+        try:
+            relative_path = relative_master_path(self._master_dir, path)
+        except ValueError:
+            return None, path
+        lun_name = relative_path.split("/", 1)[0]
+        return self._managers.get(lun_name), relative_path
+
+
+class LunCapacityStatus:
+    def __init__(self, statuses: Mapping[str, object]) -> None:
+        self._statuses = dict(statuses)
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "luns": {
+                name: status.to_dict() if status is not None else None
+                for name, status in self._statuses.items()
+            }
+        }
+
@@ -0,0 +1,283 @@
+import hashlib
+import json
+import os
+import tempfile
+from dataclasses import dataclass, field
+from typing import Dict, List, Mapping, Optional, Set
+
+from shadow.ignore_rules import IgnoreRules
+
+
+MANIFEST_VERSION = 1
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class ManifestEntry:
+    size: int
+    mtime_ns: int
+
+
+@dataclass(frozen=True)
+class ContentEntry:
+    size: int
+    mtime_ns: int
+    sha256: Optional[str]
+
+
+@dataclass
+class ContentCheck:
+    changed: bool
+    files: Dict[str, ContentEntry]
+    directories: Set[str]
+    hashed_files: int
+
+
+@dataclass
+class MasterSnapshot:
+    files: Dict[str, ManifestEntry] = field(default_factory=dict)
+    directories: Set[str] = field(default_factory=set)
+    ignored: Set[str] = field(default_factory=set, compare=False)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(entry.size for entry in self.files.values())
+
+
+@dataclass
+class ManifestDiff:
+    added_files: List[str] = field(default_factory=list)
+    modified_files: List[str] = field(default_factory=list)
+    removed_files: List[str] = field(default_factory=list)
+    added_directories: List[str] = field(default_factory=list)
+    removed_directories: List[str] = field(default_factory=list)
+
+    @property
+    def change_count(self) -> int:
+        return (
+            len(self.added_files)
+            + len(self.modified_files)
+            + len(self.removed_files)
+            + len(self.added_directories)
+            + len(self.removed_directories)
+        )
+
+    @property
+    def is_empty(self) -> bool:
+        return self.change_count == 0
+
+
+def scan_master(
+    master_dir: str,
+    ignore_rules: Optional[IgnoreRules] = None,
+    relative_root: str = "",
+) -> MasterSnapshot:
+    snapshot = MasterSnapshot()
+    pending = [relative_root]
+    while pending:
+        relative_dir = pending.pop()
+        absolute_dir = os.path.join(master_dir, relative_dir) if relative_dir else master_dir
+        matcher = ignore_rules.matcher(relative_dir) if ignore_rules is not None else None
+        with os.scandir(absolute_dir) as entries:
+            for entry in entries:
+                relative_path = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if matcher is not None and matcher.ignores(entry.name, is_dir):
+                    snapshot.ignored.add(relative_path)
+                    continue
+                if is_dir:
+                    snapshot.directories.add(relative_path)
+                    pending.append(relative_path)
+                elif entry.is_file(follow_symlinks=False):
+                    stat_result = entry.stat(follow_symlinks=False)
+                    snapshot.files[relative_path] = ManifestEntry(
+                        size=stat_result.st_size,
+                        mtime_ns=stat_result.st_mtime_ns,
+                    )
+    return snapshot
+
+
+def diff_snapshots(previous: MasterSnapshot, current: MasterSnapshot) -> ManifestDiff:
+    diff = ManifestDiff()
+    for path, entry in current.files.items():
+        previous_entry = previous.files.get(path)
+        if previous_entry is None:
+            diff.added_files.append(path)
+        elif previous_entry != entry:
+            diff.modified_files.append(path)
+    diff.removed_files = [path for path in previous.files if path not in current.files]
+    diff.added_directories = [path for path in current.directories if path not in previous.directories]
+    diff.removed_directories = [path for path in previous.directories if path not in current.directories]
+
+    diff.added_files.sort()
+    diff.modified_files.sort()
+    diff.removed_files.sort()
+    diff.added_directories.sort(key=lambda path: (path.count("/"), path))
+    diff.removed_directories.sort(key=lambda path: (-path.count("/"), path))
+    return diff
+
+
+def snapshot_to_dict(snapshot: MasterSnapshot, metadata: Mapping[str, object]) -> Dict[str, object]:
+    return {
+        "version": MANIFEST_VERSION,
+        **metadata,
+        "files": {
+            path: [entry.size, entry.mtime_ns]
+            for path, entry in sorted(snapshot.files.items())
+        },
+        "directories": sorted(snapshot.directories),
+    }
+
+
+def snapshot_from_dict(payload: Mapping[str, object]) -> MasterSnapshot:
+    raw_files = payload.get("files")
+    raw_directories = payload.get("directories")
+    if not isinstance(raw_files, dict) or not isinstance(raw_directories, list):
+        raise ValueError("Niepoprawna struktura manifestu.")
+    files = {
+        str(path): ManifestEntry(size=int(values[0]), mtime_ns=int(values[1]))
+        for path, values in raw_files.items()
+    }
+    return MasterSnapshot(files=files, directories={str(path) for path in raw_directories})
+
+
+def load_manifest(path: str) -> Optional[Dict[str, object]]:
+    try:
+        with open(path, "r", encoding="utf-8") as manifest_handle:
+            payload = json.load(manifest_handle)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if not isinstance(payload, dict) or payload.get("version") != MANIFEST_VERSION:
+        return None
+    return payload
+
+
+def save_manifest(path: str, payload: Mapping[str, object]) -> None:
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+
+    with tempfile.NamedTemporaryFile(
+        mode="w",
+        encoding="utf-8",
+        dir=directory,
+        prefix="shadow-manifest-",
+        suffix=".tmp",
+        delete=False,
+    ) as temp_handle:
+        json.dump(payload, temp_handle, ensure_ascii=False)
+        temp_handle.write("\n")
+        temp_handle.flush()
+        os.fsync(temp_handle.fileno())
+        temp_path = temp_handle.name
+
+    os.replace(temp_path, path)
+
+
+def remove_manifest(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return
+
+
+class ContentManifest:
+    def __init__(
+        self,
+        master_dir: str,
+        manifest_file: str,
+        ignore_rules: Optional[IgnoreRules] = None,
+    ) -> None:
+        self._master_dir = master_dir
+        self._manifest_file = manifest_file
+        self._ignore_rules = ignore_rules
+
+    @classmethod
+    def from_environment(cls, environment: Mapping[str, str]) -> "ContentManifest":
+        return cls(
+            master_dir=environment.get("CNC_MASTER_DIR", "/var/lib/cnc-control/master"),
+            manifest_file=environment.get(
+                "CNC_SHADOW_MANIFEST_FILE",
+                "/var/lib/cnc-control/shadow_manifest.json",
+            ),
+            ignore_rules=IgnoreRules.from_environment(environment),
+        )
+
+    def check(self) -> ContentCheck:
+        published_files, published_directories = self._load_published()
+        snapshot = scan_master(self._master_dir, self._ignore_rules)
+
+        changed = published_files is None or snapshot.directories != published_directories
+        if published_files is not None and set(snapshot.files) != set(published_files):
+            changed = True
+
+        files: Dict[str, ContentEntry] = {}
+        hashed_files = 0
+        for path, entry in snapshot.files.items():
+            published = (published_files or {}).get(path)
+            if published is not None and (published.size, published.mtime_ns) == (entry.size, entry.mtime_ns):
+                files[path] = published
+                continue
+
+            digest = None
+            if published_files is not None:
+                digest = self._hash_file(os.path.join(self._master_dir, path))
+                hashed_files += 1
+            if published is None or digest is None or digest != published.sha256:
+                changed = True
+            files[path] = ContentEntry(size=entry.size, mtime_ns=entry.mtime_ns, sha256=digest)
+
+        return ContentCheck(
+            changed=changed,
+            files=files,
+            directories=snapshot.directories,
+            hashed_files=hashed_files,
+        )
+
+    def commit(self, content_check: ContentCheck) -> None:
+        save_manifest(
+            self._manifest_file,
+            {
+                "version": MANIFEST_VERSION,
+                "files": {
+                    path: [entry.size, entry.mtime_ns, entry.sha256]
+                    for path, entry in sorted(content_check.files.items())
+                },
+                "directories": sorted(content_check.directories),
+            },
+        )
+
+    def _load_published(self):
+        payload = load_manifest(self._manifest_file)
+        if payload is None:
+            return None, set()
+        try:
+            files = {
+                str(path): ContentEntry(
+                    size=int(values[0]),
+                    mtime_ns=int(values[1]),
+                    sha256=str(values[2]) if values[2] else None,
+                )
+                for path, values in payload["files"].items()
+            }
+            directories = {str(path) for path in payload["directories"]}
+        except (KeyError, TypeError, ValueError, IndexError, AttributeError):
+            return None, set()
+        return files, directories
+
+    @staticmethod
+    def _hash_file(path: str) -> Optional[str]:
+        digest = hashlib.sha256()
+        try:
+            with open(path, "rb") as file_handle:
+                while True:
+                    chunk = file_handle.read(_HASH_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+        except OSError:
+            return None
+        return digest.hexdigest()
+
+    @property
+    def path(self) -> str:
+        return self._manifest_file
@@ -1,61 +1,414 @@
+import logging
 import os
 import shutil
+import struct
 import subprocess
-from dataclasses import dataclass
-from typing import Mapping
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Mapping, Optional, Tuple
+
+from shadow.capacity import CapacityModel
+from shadow.fat_image import FAT32, SECTOR_SIZE, FatImageWriter
+from shadow.ignore_rules import DEFAULT_IGNORE_FILE, DEFAULT_IGNORE_PATTERNS, IgnoreRules
+from shadow.image_clone import clone_file, preallocate_fd, stream_file
+from shadow.manifest import (
+    ManifestDiff,
+    MasterSnapshot,
+    diff_snapshots,
+    load_manifest,
+    remove_manifest,
+    save_manifest,
+    scan_master,
+    snapshot_from_dict,
+    snapshot_to_dict,
+)
+from shadow.slot_sizing import (
+    FAT_TYPE_CHOICES,
+    LAYOUT_POLICIES,
+    SLOT_SIZING_MODES,
+    SlotLayout,
+    SlotSizingPolicy,
+    estimate_image_bytes,
+)
+
+
+_IMAGE_BUILDERS = {"native", "mtools"}
+_IMAGE_WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+_TEMPLATE_PREFIX = "blank-"
+_TEMPLATE_SUFFIX = ".img"
+_THROUGHPUT_PHASES = ("format", "copy", "clone", "delta", "write", "stream", "fsync")
+_MEMINFO_PATH = "/proc/meminfo"
+_CANCEL_POLL_SECONDS = 0.2
+_FAT16_VOLUME_ID_OFFSET = 39
+_FAT32_VOLUME_ID_OFFSET = 67
+_FAT32_BACKUP_BOOT_SECTOR = 6
 
 
 class RebuildError(RuntimeError):
     pass
 
 
+class RebuildCancelled(RebuildError):
+    pass
+
+
 @dataclass(frozen=True)
 class RebuildConfig:
     master_dir: str
     slot_size_mb: int
     tmp_suffix: str
     usb_label: str
+    incremental: bool = False
+    incremental_max_changes: int = 500
+    incremental_max_ratio: float = 0.5
+    manifest_suffix: str = ".manifest.json"
+    image_builder: str = "native"
+    template_dir: Optional[str] = None
+    slot_sizing: str = "fixed"
+    slot_min_size_mb: int = 32
+    slot_headroom_percent: int = 25
+    fat_type: str = "32"
+    layout_policy: str = "default"
+    max_files: int = 20000
+    staging_dir: Optional[str] = None
+    staging_min_free_mb: int = 64
+    ignore_patterns: Tuple[str, ...] = DEFAULT_IGNORE_PATTERNS
+    ignore_file: str = DEFAULT_IGNORE_FILE
+
+
+@dataclass
+class RebuildStats:
+    phases_ms: Dict[str, int] = field(default_factory=dict)
+    files_copied: int = 0
+    bytes_copied: int = 0
+    build_location: str = "direct"
+    staging_fallback: Optional[str] = None
+    phase_listener: Optional[Callable[[str], None]] = field(default=None, repr=False, compare=False)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        if self.phase_listener is not None:
+            self.phase_listener(name)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed_ms = int((time.monotonic() - started) * 1000)
+            self.phases_ms[name] = self.phases_ms.get(name, 0) + elapsed_ms
+
+    @property
+    def throughput_mb_s(self) -> Optional[float]:
+        build_ms = sum(self.phases_ms.get(name, 0) for name in _THROUGHPUT_PHASES)
+        if self.bytes_copied <= 0 or build_ms <= 0:
+            return None
+        return round(self.bytes_copied / (1024 * 1024) / (build_ms / 1000), 2)
+
+
+@dataclass(frozen=True)
+class RebuildReport:
+    mode: str
+    reason: Optional[str]
+    changes: int
+    slot_size_mb: Optional[int] = None
+    stats: RebuildStats = field(default_factory=RebuildStats)
 
 
 class RebuildEngine:
-    def __init__(self, config: RebuildConfig) -> None:
+    _MTOOLS_BINARIES = ("mcopy", "mdel", "mdeltree", "mmd")
+
+    def __init__(self, config: RebuildConfig, phase_listener: Optional[Callable[[str], None]] = None) -> None:
         self._config = config
+        self._phase_listener = phase_listener
+        self._logger = logging.getLogger(__name__)
+        self._cancel_event: Optional[threading.Event] = None
+        self._sizing = SlotSizingPolicy(
+            mode=config.slot_sizing,
+            max_size_mb=config.slot_size_mb,
+            fat_type=config.fat_type,
+            headroom_percent=config.slot_headroom_percent,
+            min_size_mb=config.slot_min_size_mb,
+            layout_policy=config.layout_policy,
+        )
+        self._ignore_rules = IgnoreRules(config.master_dir, config.ignore_patterns, config.ignore_file)
+        self._capacity = CapacityModel(config.master_dir, self._sizing, config.max_files, self._ignore_rules)
 
     @classmethod
-    def from_environment(cls, environment: Mapping[str, str]) -> "RebuildEngine":
+    def from_environment(
+        cls,
+        environment: Mapping[str, str],
+        phase_listener: Optional[Callable[[str], None]] = None,
+    ) -> "RebuildEngine":
         usb_label = environment.get("CNC_USB_LABEL", "CNC_USB").strip()
         if not usb_label:
             raise RebuildError("Nieprawidlowa wartosc CNC_USB_LABEL: pusty label.")
         if len(usb_label) > 11:
             raise RebuildError("Nieprawidlowa wartosc CNC_USB_LABEL: maksymalnie 11 znakow dla FAT.")
+        image_builder = environment.get("CNC_SHADOW_IMAGE_BUILDER", "native").strip().lower()
+        if image_builder not in _IMAGE_BUILDERS:
+            raise RebuildError("Nieprawidlowa wartosc CNC_SHADOW_IMAGE_BUILDER: dozwolone native lub mtools.")
+        slot_sizing = environment.get("CNC_SHADOW_SLOT_SIZING", "fixed").strip().lower()
+        if slot_sizing not in SLOT_SIZING_MODES:
+            raise RebuildError("Nieprawidlowa wartosc CNC_SHADOW_SLOT_SIZING: dozwolone fixed lub auto.")
+        fat_type = environment.get("CNC_SHADOW_FAT_TYPE", "32").strip().lower()
+        if fat_type not in FAT_TYPE_CHOICES:
+            raise RebuildError("Nieprawidlowa wartosc CNC_SHADOW_FAT_TYPE: dozwolone 16, 32 lub auto.")
+        layout_policy = environment.get("CNC_SHADOW_LAYOUT_POLICY", "default").strip().lower()
+        if layout_policy not in LAYOUT_POLICIES:
+            raise RebuildError(
+                "Nieprawidlowa wartosc CNC_SHADOW_LAYOUT_POLICY: dozwolone default lub read_optimized."
+            )
+        try:
+            ignore_rules = IgnoreRules.from_environment(environment)
+        except ValueError as exc:
+            raise RebuildError(str(exc)) from exc
 
         config = RebuildConfig(
             master_dir=environment.get("CNC_MASTER_DIR", "/var/lib/cnc-control/master"),
             slot_size_mb=int(environment.get("CNC_SHADOW_SLOT_SIZE_MB", "256")),
             tmp_suffix=environment.get("CNC_SHADOW_TMP_SUFFIX", ".tmp"),
             usb_label=usb_label,
+            incremental=_parse_bool(environment.get("CNC_SHADOW_INCREMENTAL"), default=False),
+            incremental_max_changes=int(environment.get("CNC_SHADOW_INCREMENTAL_MAX_CHANGES", "500")),
+            incremental_max_ratio=float(environment.get("CNC_SHADOW_INCREMENTAL_MAX_RATIO", "0.5")),
+            image_builder=image_builder,
+            template_dir=environment.get("CNC_SHADOW_TEMPLATE_DIR", "/var/lib/cnc-control/templates").strip() or None,
+            slot_sizing=slot_sizing,
+            slot_min_size_mb=int(environment.get("CNC_SHADOW_SLOT_MIN_SIZE_MB", "32")),
+            slot_headroom_percent=int(environment.get("CNC_SHADOW_SLOT_HEADROOM_PERCENT", "25")),
+            fat_type=fat_type,
+            layout_policy=layout_policy,
+            max_files=int(environment.get("CNC_SHADOW_MAX_FILES", "20000")),
+            staging_dir=environment.get("CNC_SHADOW_STAGING_DIR", "").strip() or None,
+            staging_min_free_mb=int(environment.get("CNC_SHADOW_STAGING_MIN_FREE_MB", "64")),
+            ignore_patterns=ignore_rules.patterns,
+            ignore_file=ignore_rules.ignore_file,
+        )
+        return cls(config=config, phase_listener=phase_listener)
+
+    def rebuild(
+        self,
+        rebuild_slot_path: str,
+        source_slot_path: Optional[str] = None,
+        cancel_event: Optional[threading.Event] = None,
+    ) -> RebuildReport:
+        if not os.path.isdir(self._config.master_dir):
+            raise RebuildError("Katalog CNC_MASTER_DIR nie istnieje.")
+
+        self._cancel_event = cancel_event
+        try:
+            return self._rebuild(rebuild_slot_path, source_slot_path)
+        finally:
+            self._cancel_event = None
+
+    def _rebuild(self, rebuild_slot_path: str, source_slot_path: Optional[str]) -> RebuildReport:
+        stats = RebuildStats(phase_listener=self._phase_listener)
+        with stats.phase("scan"):
+            snapshot = scan_master(self._config.master_dir, self._ignore_rules)
+            layout = self._sizing.choose(
+                snapshot,
+                self._current_size_mb(source_slot_path),
+                self._current_layout(source_slot_path),
+            )
+            self._capacity.check_rebuild(
+                snapshot,
+                layout,
+                os.path.dirname(os.path.abspath(rebuild_slot_path)),
+                [path for path in (rebuild_slot_path, source_slot_path) if path],
+            )
+            remove_manifest(self._manifest_path(rebuild_slot_path))
+            reason, diff = self._resolve_incremental_plan(source_slot_path, snapshot, layout)
+        self._checkpoint()
+
+        if diff is not None and source_slot_path is not None:
+            try:
+                self._incremental_rebuild(rebuild_slot_path, source_slot_path, snapshot, diff, stats)
+                with stats.phase("manifest"):
+                    self._write_slot_manifest(rebuild_slot_path, snapshot, layout)
+                return RebuildReport(
+                    mode="incremental",
+                    reason=None,
+                    changes=diff.change_count,
+                    slot_size_mb=layout.size_mb,
+                    stats=stats,
+                )
+            except RebuildCancelled:
+                raise
+            except RebuildError as exc:
+                self._logger.warning("SHADOW incremental rebuild nieudany, przejscie na full: %s", exc)
+                reason = "incremental_failed"
+
+        self._full_rebuild(rebuild_slot_path, snapshot, layout, stats)
+        with stats.phase("manifest"):
+            self._write_slot_manifest(rebuild_slot_path, snapshot, layout)
+        return RebuildReport(
+            mode="full",
+            reason=reason,
+            changes=len(snapshot.files),
+            slot_size_mb=layout.size_mb,
+            stats=stats,
         )
-        return cls(config=config)
 
-    def full_rebuild(self, rebuild_slot_path: str) -> None:
+    def full_rebuild(self, rebuild_slot_path: str) -> RebuildStats:
         if not os.path.isdir(self._config.master_dir):
             raise RebuildError("Katalog CNC_MASTER_DIR nie istnieje.")
+        stats = RebuildStats(phase_listener=self._phase_listener)
+        with stats.phase("scan"):
+            snapshot = scan_master(self._config.master_dir, self._ignore_rules)
+            layout = self._sizing.choose(snapshot)
+            self._capacity.check_rebuild(
+                snapshot,
+                layout,
+                os.path.dirname(os.path.abspath(rebuild_slot_path)),
+                [rebuild_slot_path],
+            )
+        self._full_rebuild(rebuild_slot_path, snapshot, layout, stats)
+        return stats
 
+    def _full_rebuild(
+        self,
+        rebuild_slot_path: str,
+        snapshot: MasterSnapshot,
+        layout: SlotLayout,
+        stats: RebuildStats,
+    ) -> None:
         tmp_path = f"{rebuild_slot_path}{self._config.tmp_suffix}"
         self._cleanup_tmp(tmp_path)
+        staging_path = self._resolve_staging_path(rebuild_slot_path, snapshot, layout, stats)
+        build_path = staging_path or tmp_path
 
         try:
-            self._run_command(
-                [self._resolve_binary("truncate"), "-s", f"{self._config.slot_size_mb}M", tmp_path],
-                "Nie udalo sie utworzyc obrazu tymczasowego.",
-            )
-            self._run_command(
-                [self._resolve_binary("mkfs.vfat"), "-F", "32", "-n", self._config.usb_label, tmp_path],
-                "Nie udalo sie sformatowac obrazu FAT.",
+            if self._config.image_builder == "native":
+                self._build_native_image(build_path, layout, stats, preallocate=staging_path is None)
+            else:
+                self._build_mtools_image(build_path, snapshot, layout, stats, use_template=staging_path is None)
+                stats.files_copied = len(snapshot.files)
+                stats.bytes_copied = snapshot.total_bytes
+
+            self._checkpoint()
+            if staging_path is not None:
+                with stats.phase("stream"):
+                    stream_file(staging_path, tmp_path)
+                self._checkpoint()
+            with stats.phase("fsync"):
+                self._fsync_path(tmp_path)
+                self._fsync_path(os.path.dirname(tmp_path) or ".")
+            with stats.phase("publish"):
+                os.replace(tmp_path, rebuild_slot_path)
+        except Exception as exc:
+            self._cleanup_tmp(tmp_path)
+            if isinstance(exc, RebuildError):
+                raise
+            raise RebuildError(str(exc)) from exc
+        finally:
+            if staging_path is not None:
+                self._cleanup_tmp(staging_path)
+
+    def _resolve_staging_path(
+        self,
+        rebuild_slot_path: str,
+        snapshot: MasterSnapshot,
+        layout: SlotLayout,
+        stats: RebuildStats,
+    ) -> Optional[str]:
+        staging_dir = self._config.staging_dir
+        if not staging_dir:
+            return None
+        required = estimate_image_bytes(snapshot, layout) + self._config.staging_min_free_mb * 1024 * 1024
+        available_memory = self._available_memory_bytes()
+        if available_memory is None or available_memory < required:
+            stats.staging_fallback = "low_memory"
+        else:
+            try:
+                os.makedirs(staging_dir, exist_ok=True)
+                filesystem = os.statvfs(staging_dir)
+            except OSError as exc:
+                self._logger.warning("SHADOW katalog staging niedostepny (%s): %s", staging_dir, exc)
+                stats.staging_fallback = "unavailable"
+            else:
+                if filesystem.f_bavail * filesystem.f_frsize < required:
+                    stats.staging_fallback = "low_space"
+        if stats.staging_fallback is not None:
+            self._logger.info(
+                "SHADOW staging pominiety (%s), budowa bezposrednio w slocie",
+                stats.staging_fallback,
             )
-            master_entries = self._list_master_entries()
-            if master_entries:
-                self._run_command(
+            return None
+
+        staging_path = os.path.join(
+            staging_dir,
+            f"{os.path.basename(rebuild_slot_path)}{self._config.tmp_suffix}",
+        )
+        self._cleanup_tmp(staging_path)
+        stats.build_location = "staging"
+        return staging_path
+
+    @staticmethod
+    def _available_memory_bytes() -> Optional[int]:
+        try:
+            with open(_MEMINFO_PATH, "r", encoding="ascii") as meminfo:
+                for line in meminfo:
+                    name, _separator, value = line.partition(":")
+                    if name == "MemAvailable":
+                        return int(value.split()[0]) * 1024
+        except (OSError, ValueError, IndexError):
+            return None
+        return None
+
+    def _build_native_image(
+        self,
+        tmp_path: str,
+        layout: SlotLayout,
+        stats: RebuildStats,
+        preallocate: bool = True,
+    ) -> None:
+        writer = FatImageWriter(
+            source_dir=self._config.master_dir,
+            image_size=layout.size_bytes,
+            label=self._config.usb_label,
+            fat_type=layout.fat_type,
+            sectors_per_cluster=layout.sectors_per_cluster,
+            checkpoint=self._checkpoint,
+            ignore_rules=self._ignore_rules,
+        )
+        with stats.phase("write"), open(tmp_path, "wb", buffering=_IMAGE_WRITE_BUFFER_SIZE) as image_handle:
+            if preallocate:
+                preallocate_fd(image_handle.fileno(), layout.size_bytes)
+            image_stats = writer.write(image_handle)
+        stats.files_copied = image_stats.files
+        stats.bytes_copied = image_stats.bytes_written
+
+    def _build_mtools_image(
+        self,
+        tmp_path: str,
+        snapshot: MasterSnapshot,
+        layout: SlotLayout,
+        stats: RebuildStats,
+        use_template: bool = True,
+    ) -> None:
+        with stats.phase("format"):
+            template_path = self._ensure_template(layout) if use_template else None
+            if template_path is not None:
+                method = clone_file(template_path, tmp_path)
+                self._stamp_volume_id(tmp_path, layout.fat_type)
+                self._logger.debug("SHADOW obraz z szablonu %s (%s)", template_path, method)
+            else:
+                self._format_blank_image(tmp_path, layout)
+        self._checkpoint()
+        if self._config.layout_policy == "read_optimized" or any("/" in path for path in snapshot.ignored):
+            with stats.phase("copy"):
+                for command, error_message in self._build_delta_commands(
+                    tmp_path, diff_snapshots(MasterSnapshot(), snapshot)
+                ):
+                    self._checkpoint()
+                    self._execute(command, error_message)
+            return
+        master_entries = self._list_master_entries()
+        if master_entries:
+            with stats.phase("copy"):
+                self._execute(
                     [
                         self._resolve_binary("mcopy"),
                         "-s",
@@ -67,15 +420,260 @@ class RebuildEngine:
                     "Nie udalo sie skopiowac danych do obrazu FAT.",
                 )
 
-            self._fsync_path(tmp_path)
-            self._fsync_path(os.path.dirname(tmp_path) or ".")
-            os.replace(tmp_path, rebuild_slot_path)
+    def _format_blank_image(self, image_path: str, layout: SlotLayout) -> None:
+        self._execute(
+            [self._resolve_binary("truncate"), "-s", f"{layout.size_mb}M", image_path],
+            "Nie udalo sie utworzyc obrazu tymczasowego.",
+        )
+        mkfs_command = [self._resolve_binary("mkfs.vfat"), "-F", str(layout.fat_type), "-n", self._config.usb_label]
+        if layout.sectors_per_cluster is not None:
+            mkfs_command += ["-s", str(layout.sectors_per_cluster)]
+        self._execute(
+            [*mkfs_command, image_path],
+            "Nie udalo sie sformatowac obrazu FAT.",
+        )
+
+    def _ensure_template(self, layout: SlotLayout) -> Optional[str]:
+        if not self._config.template_dir:
+            return None
+        template_path = self._template_path(layout)
+        image_size = layout.size_bytes
+        if os.path.isfile(template_path) and os.path.getsize(template_path) == image_size:
+            return template_path
+
+        build_path = f"{template_path}{self._config.tmp_suffix}"
+        try:
+            os.makedirs(self._config.template_dir, exist_ok=True)
+            self._purge_stale_templates(template_path)
+            self._cleanup_tmp(build_path)
+            self._format_blank_image(build_path, layout)
+            with open(build_path, "r+b") as template_handle:
+                preallocate_fd(template_handle.fileno(), image_size)
+            self._fsync_path(build_path)
+            os.replace(build_path, template_path)
+        except RebuildCancelled:
+            self._cleanup_tmp(build_path)
+            raise
+        except (OSError, RebuildError) as exc:
+            self._cleanup_tmp(build_path)
+            self._logger.warning("SHADOW nie przygotowal szablonu slotu, formatowanie bezposrednie: %s", exc)
+            return None
+        self._logger.info("SHADOW przygotowano szablon slotu %s", template_path)
+        return template_path
+
+    def _template_path(self, layout: SlotLayout) -> str:
+        label_key = self._config.usb_label.encode("utf-8").hex()
+        cluster_key = f"-s{layout.sectors_per_cluster}" if layout.sectors_per_cluster is not None else ""
+        return os.path.join(
+            self._config.template_dir or "",
+            f"{_TEMPLATE_PREFIX}fat{layout.fat_type}{cluster_key}-{layout.size_mb}M-{label_key}{_TEMPLATE_SUFFIX}",
+        )
+
+    def _purge_stale_templates(self, current_path: str) -> None:
+        with os.scandir(self._config.template_dir) as entries:
+            for entry in entries:
+                if (
+                    entry.name.startswith(_TEMPLATE_PREFIX)
+                    and entry.name.endswith(_TEMPLATE_SUFFIX)
+                    and entry.path != current_path
+                ):
+                    self._cleanup_tmp(entry.path)
+
+    @staticmethod
+    def _stamp_volume_id(image_path: str, fat_type: int) -> None:
+        volume_id = struct.pack("<I", int(time.time()) & 0xFFFFFFFF)
+        if fat_type == FAT32:
+            offsets = [sector * SECTOR_SIZE + _FAT32_VOLUME_ID_OFFSET for sector in (0, _FAT32_BACKUP_BOOT_SECTOR)]
+        else:
+            offsets = [_FAT16_VOLUME_ID_OFFSET]
+        with open(image_path, "r+b") as image_handle:
+            for offset in offsets:
+                image_handle.seek(offset)
+                image_handle.write(volume_id)
+
+    def _resolve_incremental_plan(
+        self,
+        source_slot_path: Optional[str],
+        snapshot: MasterSnapshot,
+        layout: SlotLayout,
+    ) -> Tuple[Optional[str], Optional[ManifestDiff]]:
+        if not self._config.incremental:
+            return "incremental_disabled", None
+        if not source_slot_path or not os.path.isfile(source_slot_path):
+            return "missing_source_slot", None
+        if not all(self._has_binary(name) for name in self._MTOOLS_BINARIES):
+            return "missing_mtools", None
+
+        payload = load_manifest(self._manifest_path(source_slot_path))
+        if payload is None:
+            return "missing_source_manifest", None
+        if any(payload.get(key) != value for key, value in self._manifest_metadata(layout).items()):
+            return "layout_changed", None
+        if os.path.getsize(source_slot_path) != layout.size_bytes:
+            return "source_slot_inconsistent", None
+        try:
+            published = snapshot_from_dict(payload)
+        except (TypeError, ValueError):
+            return "missing_source_manifest", None
+
+        diff = diff_snapshots(published, snapshot)
+        if diff.change_count > self._config.incremental_max_changes:
+            return "delta_too_large", None
+        changed_bytes = sum(snapshot.files[path].size for path in diff.added_files + diff.modified_files)
+        if changed_bytes > snapshot.total_bytes * self._config.incremental_max_ratio:
+            return "delta_too_large", None
+        return None, diff
+
+    def _incremental_rebuild(
+        self,
+        rebuild_slot_path: str,
+        source_slot_path: str,
+        snapshot: MasterSnapshot,
+        diff: ManifestDiff,
+        stats: RebuildStats,
+    ) -> None:
+        tmp_path = f"{rebuild_slot_path}{self._config.tmp_suffix}"
+        self._cleanup_tmp(tmp_path)
+
+        try:
+            with stats.phase("clone"):
+                clone_file(source_slot_path, tmp_path)
+            self._checkpoint()
+            with stats.phase("delta"):
+                for command, error_message in self._build_delta_commands(tmp_path, diff):
+                    self._execute(command, error_message)
+
+            self._checkpoint()
+            with stats.phase("fsync"):
+                self._fsync_path(tmp_path)
+                self._fsync_path(os.path.dirname(tmp_path) or ".")
+            with stats.phase("publish"):
+                os.replace(tmp_path, rebuild_slot_path)
+            copied_files = diff.added_files + diff.modified_files
+            stats.files_copied = len(copied_files)
+            stats.bytes_copied = sum(snapshot.files[path].size for path in copied_files)
         except Exception as exc:
             self._cleanup_tmp(tmp_path)
             if isinstance(exc, RebuildError):
                 raise
             raise RebuildError(str(exc)) from exc
 
+    def _build_delta_commands(self, image_path: str, diff: ManifestDiff) -> List[Tuple[List[str], str]]:
+        removed_roots = self._outermost_paths(diff.removed_directories)
+        removed_files = [
+            path for path in diff.removed_files if not self._is_nested_in(path, removed_roots)
+        ]
+        commands: List[Tuple[List[str], str]] = []
+        if removed_files:
+            commands.append(
+                (
+                    [self._resolve_binary("mdel"), "-i", image_path, *(self._image_path(p) for p in removed_files)],
+                    "Nie udalo sie usunac plikow z obrazu FAT.",
+                )
+            )
+        if removed_roots:
+            commands.append(
+                (
+                    [self._resolve_binary("mdeltree"), "-i", image_path, *(self._image_path(p) for p in removed_roots)],
+                    "Nie udalo sie usunac katalogow z obrazu FAT.",
+                )
+            )
+        if diff.added_directories:
+            commands.append(
+                (
+                    [
+                        self._resolve_binary("mmd"),
+                        "-i",
+                        image_path,
+                        *(self._image_path(p) for p in sorted(diff.added_directories, key=_fat_directory_order)),
+                    ],
+                    "Nie udalo sie utworzyc katalogow w obrazie FAT.",
+                )
+            )
+
+        files_by_parent: Dict[str, List[str]] = defaultdict(list)
+        for path in sorted(diff.added_files + diff.modified_files, key=_fat_order):
+            files_by_parent[os.path.dirname(path)].append(path)
+        for parent in sorted(files_by_parent, key=_fat_directory_order):
+            paths = files_by_parent[parent]
+            commands.append(
+                (
+                    [
+                        self._resolve_binary("mcopy"),
+                        "-o",
+                        "-i",
+                        image_path,
+                        *(os.path.join(self._config.master_dir, path) for path in paths),
+                        f"{self._image_path(parent)}/" if parent else "::",
+                    ],
+                    "Nie udalo sie skopiowac zmienionych plikow do obrazu FAT.",
+                )
+            )
+        return commands
+
+    def _write_slot_manifest(self, slot_path: str, snapshot: MasterSnapshot, layout: SlotLayout) -> None:
+        try:
+            save_manifest(
+                self._manifest_path(slot_path),
+                snapshot_to_dict(snapshot, self._manifest_metadata(layout)),
+            )
+        except OSError as exc:
+            self._logger.warning("SHADOW nie zapisal manifestu slotu %s: %s", slot_path, exc)
+
+    def _manifest_metadata(self, layout: SlotLayout) -> Dict[str, object]:
+        return {
+            "slot_size_mb": layout.size_mb,
+            "usb_label": self._config.usb_label,
+            "fat_type": layout.fat_type,
+            "sectors_per_cluster": layout.sectors_per_cluster,
+        }
+
+    @staticmethod
+    def _current_size_mb(slot_path: Optional[str]) -> Optional[int]:
+        if not slot_path:
+            return None
+        try:
+            size = os.path.getsize(slot_path)
+        except OSError:
+            return None
+        if size % (1024 * 1024):
+            return None
+        return size // (1024 * 1024)
+
+    def _current_layout(self, slot_path: Optional[str]) -> Optional[SlotLayout]:
+        if not slot_path or self._sizing.layout_policy != "read_optimized":
+            return None
+        payload = load_manifest(self._manifest_path(slot_path))
+        if payload is None:
+            return None
+        size_mb = payload.get("slot_size_mb")
+        fat_type = payload.get("fat_type")
+        sectors_per_cluster = payload.get("sectors_per_cluster")
+        if not all(isinstance(value, int) for value in (size_mb, fat_type, sectors_per_cluster)):
+            return None
+        if size_mb != self._current_size_mb(slot_path):
+            return None
+        return SlotLayout(size_mb=size_mb, fat_type=fat_type, sectors_per_cluster=sectors_per_cluster)
+
+    def _manifest_path(self, slot_path: str) -> str:
+        return f"{slot_path}{self._config.manifest_suffix}"
+
+    @staticmethod
+    def _image_path(relative_path: str) -> str:
+        return f"::/{relative_path}" if relative_path else "::"
+
+    @staticmethod
+    def _outermost_paths(paths: List[str]) -> List[str]:
+        outermost: List[str] = []
+        for path in sorted(paths, key=lambda item: (item.count("/"), item)):
+            if not RebuildEngine._is_nested_in(path, outermost):
+                outermost.append(path)
+        return outermost
+
+    @staticmethod
+    def _is_nested_in(path: str, directories: List[str]) -> bool:
+        return any(path.startswith(f"{directory}/") for directory in directories)
+
     def dry_run_diff(self, target_dir: str) -> bool:
         result = subprocess.run(
             [
@@ -95,6 +693,17 @@ class RebuildEngine:
             raise RebuildError("Nie udalo sie wykonac porownania dry-run rsync.")
         return bool(result.stdout.strip())
 
+    def _checkpoint(self) -> None:
+        if self._cancel_event is not None and self._cancel_event.is_set():
+            raise RebuildCancelled("Przebudowa przerwana: nowe zmiany w CNC_MASTER_DIR.")
+
+    def _execute(self, command, error_message: str) -> None:
+        if self._cancel_event is None:
+            self._run_command(command, error_message)
+            return
+        self._checkpoint()
+        self._run_cancellable_command(command, error_message, self._cancel_event)
+
     @staticmethod
     def _run_command(command, error_message: str) -> None:
         result = subprocess.run(command, capture_output=True, text=True, check=False)
@@ -102,8 +711,30 @@ class RebuildEngine:
             detail = result.stderr.strip() or result.stdout.strip() or "Brak szczegolow"
             raise RebuildError(f"{error_message} ({detail})")
 
+    @staticmethod
+    def _run_cancellable_command(command, error_message: str, cancel_event: threading.Event) -> None:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        while True:
+            try:
+                stdout, stderr = process.communicate(timeout=_CANCEL_POLL_SECONDS)
+                break
+            except subprocess.TimeoutExpired:
+                if cancel_event.is_set():
+                    process.kill()
+                    process.communicate()
+                    raise RebuildCancelled(
+                        f"Przebudowa przerwana: nowe zmiany w CNC_MASTER_DIR ({os.path.basename(command[0])})."
+                    )
+        if process.returncode != 0:
+            detail = stderr.strip() or stdout.strip() or "Brak szczegolow"
+            raise RebuildError(f"{error_message} ({detail})")
+
     def _list_master_entries(self):
-        return sorted(entry.path for entry in os.scandir(self._config.master_dir))
+        matcher = self._ignore_rules.matcher()
+        with os.scandir(self._config.master_dir) as entries:
+            return sorted(
+                entry.path for entry in entries if not matcher.ignores(entry.name, entry.is_dir(follow_symlinks=False))
+            )
 
     @staticmethod
     def _fsync_path(path: str) -> None:
@@ -120,6 +751,10 @@ class RebuildEngine:
         except FileNotFoundError:
             return
 
+    @staticmethod
+    def _has_binary(binary_name: str) -> bool:
+        return os.path.isabs(RebuildEngine._resolve_binary(binary_name))
+
     @staticmethod
     def _resolve_binary(binary_name: str) -> str:
         resolved = shutil.which(binary_name)
@@ -131,6 +766,24 @@ class RebuildEngine:
                 return candidate
         return binary_name
 
+    @property
+    def capacity(self) -> CapacityModel:
+        return self._capacity
+
     @property
     def master_dir(self) -> str:
         return self._config.master_dir
+
+
+def _fat_order(path: str) -> Tuple[str, str]:
+    return path.upper(), path
+
+
+def _fat_directory_order(path: str) -> Tuple[int, str, str]:
+    return (path.count("/") + 1 if path else 0, *_fat_order(path))
+
+
+def _parse_bool(value: Optional[str], default: bool) -> bool:
+    if value is None:
+        return default
+    return value.strip().lower() in {"1", "true", "yes", "on"}
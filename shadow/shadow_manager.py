@@ -1,23 +1,49 @@
-import json
 import logging
 import os
+import queue
 import subprocess
 import sys
-import tempfile
 import threading
 import time
+from dataclasses import dataclass
 from datetime import datetime, timezone
-from typing import Mapping, Optional
-
+from typing import Dict, List, Mapping, Optional, Set, Tuple
+
+from shadow.capacity import CapacityError, CapacityModel, CapacityStatus
+from shadow.change_events import CHANGE_OPERATIONS, ChangeEvent, ChangeSet, relative_master_path
+from shadow.debounce import AdaptiveDebouncer
+from shadow.event_bus import EventBus, Subscription
+from shadow.history_log import DEFAULT_HISTORY_FILE, HistoryLog
+from shadow.history_query import HistoryQuery, query_entries
+from shadow.history_stats import HistorySample, HistoryStats, summarize_samples
 from shadow.lock_manager import LockManager
-from shadow.rebuild_engine import RebuildEngine, RebuildError
+from shadow.manifest import ContentCheck, ContentManifest
+from shadow.rebuild_engine import RebuildCancelled, RebuildEngine, RebuildError
 from shadow.slot_manager import SlotManager
+from shadow.slot_sizing import SlotCapacityError
 from shadow.state_store import ShadowState, StateStore
 from shadow.usb_manager import UsbManager
 from shadow.watcher_service import WatcherService
+from shadow.write_settle import WriteSettleTracker
+
+
+@dataclass
+class _NotifiedChange:
+    expires_at: float
+    operations: Set[str]
+    size: Optional[int]
+    mtime_ns: Optional[int]
 
 
 class ShadowManager:
+    _NOTIFY_ECHO_SECONDS = 10.0
+    _NOTIFY_ECHO_OPERATIONS = {
+        "create": ("create", "modify"),
+        "modify": ("modify",),
+        "delete": ("delete",),
+        "move": ("move",),
+    }
+    _HISTORY_CACHE_LIMIT = 100
     _LED_MODE_BY_STATE = {
         "IDLE": "SHADOW_READY",
         "READY": "SHADOW_READY",
@@ -37,9 +63,16 @@ class ShadowManager:
         slot_manager: SlotManager,
         lock_manager: LockManager,
         watcher_service: WatcherService,
-        debounce_seconds: int,
+        content_manifest: ContentManifest,
+        debouncer: AdaptiveDebouncer,
         history_file: str,
         history_limit: int,
+        capacity_model: Optional[CapacityModel] = None,
+        lun_name: Optional[str] = None,
+        write_settle: Optional[WriteSettleTracker] = None,
+        event_bus: Optional[EventBus] = None,
+        history_log: Optional[HistoryLog] = None,
+        history_stats: Optional[HistoryStats] = None,
     ) -> None:
         self._state_store = state_store
         self._rebuild_engine = rebuild_engine
@@ -47,32 +80,61 @@ class ShadowManager:
         self._slot_manager = slot_manager
         self._lock_manager = lock_manager
         self._watcher_service = watcher_service
-        self._debounce_seconds = max(0, debounce_seconds)
+        self._content_manifest = content_manifest
+        self._debouncer = debouncer
+        self._capacity_model = capacity_model
+        self._lun_name = lun_name
+        self._write_settle = write_settle
+        self._event_bus = event_bus or EventBus()
         self._logger = logging.getLogger(__name__)
         self._worker: Optional[threading.Thread] = None
+        self._pump: Optional[threading.Thread] = None
+        self._change_queue: "queue.Queue[ChangeEvent]" = queue.Queue()
+        self._notified_changes: Dict[str, _NotifiedChange] = {}
+        self._preemption_lock = threading.Lock()
+        self._build_cancel: Optional[threading.Event] = None
+        self._preempted_runs = 0
+        self._carried_change_set: Optional[ChangeSet] = None
         self._manual_thread: Optional[threading.Thread] = None
         self._manual_lock = threading.Lock()
         self._last_led_mode: Optional[str] = None
-        self._history_file = history_file
+        self._history_log = history_log or HistoryLog(history_file)
         self._history_limit = max(1, history_limit)
+        self._history_cache_limit = min(self._history_limit, self._HISTORY_CACHE_LIMIT)
+        self._history_stats = history_stats or HistoryStats(retention_seconds=7 * 24 * 3600)
         self._history_lock = threading.Lock()
         self._history_entries = self._load_history()
 
     @classmethod
-    def from_environment(cls, environment: Mapping[str, str]) -> "ShadowManager":
+    def from_environment(
+        cls,
+        environment: Mapping[str, str],
+        usb_manager: Optional[UsbManager] = None,
+        lun_name: Optional[str] = None,
+        event_bus: Optional[EventBus] = None,
+    ) -> "ShadowManager":
+        event_bus = event_bus or EventBus()
+        rebuild_engine = RebuildEngine.from_environment(
+            environment,
+            phase_listener=lambda phase: event_bus.publish("progress", _lun_payload(lun_name, {"phase": phase})),
+        )
         return cls(
             state_store=StateStore.from_environment(environment),
-            rebuild_engine=RebuildEngine.from_environment(environment),
-            usb_manager=UsbManager.from_environment(environment),
+            rebuild_engine=rebuild_engine,
+            usb_manager=usb_manager or UsbManager.from_environment(environment),
             slot_manager=SlotManager.from_environment(environment),
             lock_manager=LockManager.from_environment(environment),
             watcher_service=WatcherService.from_environment(environment),
-            debounce_seconds=int(environment.get("CNC_SHADOW_DEBOUNCE_SECONDS", "4")),
-            history_file=environment.get(
-                "CNC_SHADOW_HISTORY_FILE",
-                "/var/lib/cnc-control/shadow_history.json",
-            ),
+            content_manifest=ContentManifest.from_environment(environment),
+            debouncer=AdaptiveDebouncer.from_environment(environment),
+            history_file=environment.get("CNC_SHADOW_HISTORY_FILE", DEFAULT_HISTORY_FILE),
             history_limit=int(environment.get("CNC_SHADOW_HISTORY_LIMIT", "50")),
+            capacity_model=rebuild_engine.capacity,
+            lun_name=lun_name,
+            write_settle=WriteSettleTracker.from_environment(environment),
+            event_bus=event_bus,
+            history_log=HistoryLog.from_environment(environment),
+            history_stats=HistoryStats.from_environment(environment),
         )
 
     def start(self) -> None:
@@ -88,14 +150,16 @@ class ShadowManager:
             self._set_error(code="ERR_MISSING_DEPENDENCY", message=str(exc))
             self._logger.exception("SHADOW nie uruchomil watchera.")
             return
+        self._start_pump()
         self._start_worker()
         self._logger.info(
-            "SHADOW bootstrap gotowy: state=%s active_slot=%s state_file=%s lock_file=%s watch_dir=%s",
+            "SHADOW bootstrap gotowy: state=%s active_slot=%s state_file=%s lock_file=%s watch_dir=%s watcher=%s",
             state.fsm_state,
             active_slot,
             self._state_store.path,
             self._lock_manager.path,
             self._watcher_service.watched_dir,
+            self._watcher_service.backend,
         )
 
     def trigger_manual_rebuild(self):
@@ -108,12 +172,97 @@ class ShadowManager:
                 daemon=True,
             )
             self._manual_thread.start()
+        self._publish("manual", {"running": True, "last_manual": None})
         return True, "Manual rebuild uruchomiony."
 
+    def notify_change(self, path: str, operation: str, size: Optional[int] = None) -> None:
+        if operation not in CHANGE_OPERATIONS:
+            raise ValueError(f"Nieznana operacja zmiany: {operation}")
+        event = ChangeEvent(
+            path=relative_master_path(self._rebuild_engine.master_dir, path),
+            operation=operation,
+            size=size,
+            source="webui",
+        )
+        stat_result = self._master_stat(event.path)
+        notified = _NotifiedChange(
+            expires_at=time.monotonic() + self._NOTIFY_ECHO_SECONDS,
+            operations=set(self._NOTIFY_ECHO_OPERATIONS[operation]),
+            size=size,
+            mtime_ns=stat_result.st_mtime_ns if stat_result is not None else None,
+        )
+        with self._preemption_lock:
+            self._notified_changes[event.path] = notified
+        self._enqueue_change(event)
+
+    def check_upload(self, path: str, size: int) -> None:
+        if self._capacity_model is None:
+            return
+        self._capacity_model.check_upload(
+            relative_master_path(self._rebuild_engine.master_dir, path),
+            size,
+            image_dir=self._slot_image_dir(),
+            slot_paths=self._slot_image_paths(),
+        )
+
+    def check_upload_size(self, directory: str, size: int) -> None:
+        if self._capacity_model is None:
+            return
+        self._capacity_model.check_upload_size(
+            relative_master_path(self._rebuild_engine.master_dir, directory),
+            size,
+            image_dir=self._slot_image_dir(),
+            slot_paths=self._slot_image_paths(),
+        )
+
+    def get_capacity_status(self) -> Optional[CapacityStatus]:
+        if self._capacity_model is None:
+            return None
+        return self._capacity_model.status(image_dir=self._slot_image_dir(), slot_paths=self._slot_image_paths())
+
+    def get_watcher_status(self) -> Dict[str, object]:
+        return self._watcher_service.status()
+
+    def get_state(self) -> ShadowState:
+        return self._state_store.current()
+
+    def subscribe_events(self, last_event_id: Optional[int] = None) -> Subscription:
+        return self._event_bus.subscribe(last_event_id)
+
+    def _publish(self, event_type: str, payload: Dict[str, object]) -> None:
+        self._event_bus.publish(event_type, _lun_payload(self._lun_name, payload))
+
+    def _slot_image_dir(self) -> str:
+        return os.path.dirname(os.path.abspath(self._slot_manager.get_slot_path("A")))
+
+    def _slot_image_paths(self) -> List[str]:
+        return [self._slot_manager.get_slot_path(slot) for slot in ("A", "B")]
+
     def get_rebuild_history(self, limit: int = 20):
         resolved_limit = max(1, min(limit, self._history_limit))
         with self._history_lock:
-            return list(reversed(self._history_entries))[:resolved_limit]
+            cached = list(reversed(self._history_entries))
+        if resolved_limit <= len(cached) or len(cached) < self._history_cache_limit:
+            return cached[:resolved_limit]
+        try:
+            return self._history_log.latest(resolved_limit)
+        except OSError as exc:
+            self._logger.warning("SHADOW history read failed: %s", exc)
+            return cached
+
+    def query_history(self, query: HistoryQuery) -> Tuple[List[Dict[str, object]], Optional[str]]:
+        try:
+            return query_entries(self._history_log.iter_latest(), query)
+        except OSError as exc:
+            self._logger.warning("SHADOW history read failed: %s", exc)
+            with self._history_lock:
+                return query_entries(list(reversed(self._history_entries)), query)
+
+    def get_history_samples(self, window_seconds: float, trigger: Optional[str] = None) -> List[HistorySample]:
+        return self._history_stats.samples(window_seconds, trigger)
+
+    def get_history_stats(self, window_seconds: float, trigger: Optional[str] = None) -> Dict[str, object]:
+        return summarize_samples(self.get_history_samples(window_seconds, trigger), window_seconds)
 
     def get_manual_status(self):
         with self._manual_lock:
@@ -129,7 +278,91 @@ class ShadowManager:
         return {"running": running, "last_manual": last_manual}
 
     def _manual_rebuild_worker(self) -> None:
-        self._run_rebuild_cycle(trigger="manual", mark_lock_conflict_error=False)
+        try:
+            self._run_rebuild_cycle(trigger="manual", mark_lock_conflict_error=False)
+        finally:
+            self._publish("manual", {**self.get_manual_status(), "running": False})
+
+    def _start_pump(self) -> None:
+        if self._pump is not None and self._pump.is_alive():
+            return
+        self._pump = threading.Thread(
+            target=self._pump_loop,
+            name="cnc-shadow-event-pump",
+            daemon=True,
+        )
+        self._pump.start()
+
+    def _pump_loop(self) -> None:
+        while True:
+            try:
+                event = self._watcher_service.poll_event(timeout_seconds=1.0)
+                if event is None:
+                    continue
+                self._enqueue_change(event)
+            except Exception as exc:
+                self._logger.exception("SHADOW event-pump blad krytyczny: %s", exc)
+                time.sleep(1.0)
+
+    def _enqueue_change(self, event: ChangeEvent) -> None:
+        with self._preemption_lock:
+            if event.source == "watcher" and self._is_notified_echo(event):
+                self._logger.debug("SHADOW pominieto echo watchera zmiany z WebUI: %s", event.describe())
+                return
+            cancel_event = self._build_cancel
+        if self._capacity_model is not None:
+            self._capacity_model.apply_change(event)
+        self._change_queue.put(event)
+        if cancel_event is not None and not cancel_event.is_set():
+            self._logger.info("SHADOW zmiana podczas budowy obrazu, przerwanie przebiegu: %s", event.describe())
+            cancel_event.set()
+
+    def _is_notified_echo(self, event: ChangeEvent) -> bool:
+        now = time.monotonic()
+        for notified_path, notified in list(self._notified_changes.items()):
+            if notified.expires_at <= now:
+                del self._notified_changes[notified_path]
+        notified = self._notified_changes.get(event.path)
+        if notified is None or event.operation not in notified.operations:
+            return False
+        stat_result = self._master_stat(event.path)
+        if event.operation == "delete":
+            matches = stat_result is None
+        else:
+            matches = (
+                stat_result is not None
+                and (notified.size is None or stat_result.st_size == notified.size)
+                and (notified.mtime_ns is None or stat_result.st_mtime_ns == notified.mtime_ns)
+            )
+        if not matches:
+            del self._notified_changes[event.path]
+            return False
+        notified.operations.discard(event.operation)
+        if not notified.operations:
+            del self._notified_changes[event.path]
+        return True
+
+    def _master_stat(self, relative_path: str) -> Optional[os.stat_result]:
+        try:
+            return os.stat(os.path.join(self._rebuild_engine.master_dir, relative_path))
+        except OSError:
+            return None
+
+    def _next_change(self, timeout_seconds: float) -> Optional[ChangeEvent]:
+        try:
+            return self._change_queue.get(timeout=max(0.0, timeout_seconds))
+        except queue.Empty:
+            return None
+
+    def _arm_preemption(self) -> threading.Event:
+        cancel_event = threading.Event()
+        with self._preemption_lock:
+            self._build_cancel = cancel_event
+        return cancel_event
+
+    def _disarm_preemption(self) -> None:
+        with self._preemption_lock:
+            self._build_cancel = None
 
     def _start_worker(self) -> None:
         if self._worker is not None and self._worker.is_alive():
@@ -144,32 +377,110 @@ class ShadowManager:
     def _watch_loop(self) -> None:
         while True:
             try:
-                event = self._watcher_service.poll_event(timeout_seconds=1.0)
+                event = self._next_change(timeout_seconds=1.0)
                 if event is None:
                     continue
-                self._logger.info("SHADOW wykryto zmiane: %s", event)
-                self._wait_for_debounce()
-                self._run_rebuild_cycle(trigger="watch", mark_lock_conflict_error=True)
+                self._logger.info("SHADOW wykryto zmiane: %s", event.describe())
+                debounce_meta = self._wait_for_debounce(event)
+                self._run_rebuild_cycle(
+                    trigger="watch",
+                    mark_lock_conflict_error=True,
+                    preemptible=debounce_meta["debounce_reason"] != "max_latency",
+                    debounce_meta=debounce_meta,
+                    change_set=debounce_meta["change_set"],
+                )
             except Exception as exc:
                 self._logger.exception("SHADOW watch-loop blad krytyczny: %s", exc)
                 time.sleep(1.0)
 
-    def _wait_for_debounce(self) -> None:
-        if self._debounce_seconds <= 0:
-            return
-        deadline = time.monotonic() + self._debounce_seconds
+    def _wait_for_debounce(self, first_event: ChangeEvent):
+        started = time.monotonic()
+        carried = self._carried_change_set
+        change_set = carried or ChangeSet()
+        self._carried_change_set = None
+        burst_started = None
+        if carried is not None and carried.first_event_at is not None:
+            burst_started = started - max(0.0, time.time() - carried.first_event_at)
+        change_set.add(first_event)
+        self._debouncer.record_event(started, burst_started=burst_started)
+        self._publish("progress", {"phase": "debounce", "change": first_event.describe()})
         while True:
-            remaining = deadline - time.monotonic()
+            remaining = self._debouncer.deadline() - time.monotonic()
             if remaining <= 0:
-                return
-            event = self._watcher_service.poll_event(timeout_seconds=remaining)
+                break
+            event = self._next_change(timeout_seconds=remaining)
             if event is None:
-                return
-            self._logger.info("SHADOW debounce scala zdarzenie: %s", event)
-            deadline = time.monotonic() + self._debounce_seconds
+                continue
+            self._logger.info("SHADOW debounce scala zdarzenie: %s", event.describe())
+            change_set.add(event)
+            self._debouncer.record_event(time.monotonic())
+
+        event_count = self._debouncer.event_count
+        reason = self._debouncer.finish_burst()
+        debounce_ms = int((time.monotonic() - started) * 1000)
+        self._logger.info(
+            "SHADOW debounce zakonczony: reason=%s events=%s paths=%s full_rescan=%s debounce_ms=%s",
+            reason,
+            event_count,
+            len(change_set),
+            change_set.full_rescan,
+            debounce_ms,
+        )
+        settle_ms, unsettled = self._wait_for_writes(change_set)
+        return {
+            "debounce_reason": reason,
+            "debounce_ms": debounce_ms,
+            "debounce_events": event_count,
+            "settle_ms": settle_ms,
+            "unsettled_paths": unsettled,
+            "change_set": change_set,
+        }
 
-    def _run_rebuild_cycle(self, trigger: str, mark_lock_conflict_error: bool) -> bool:
+    def _wait_for_writes(self, change_set: ChangeSet) -> Tuple[int, List[str]]:
+        tracker = self._write_settle
+        if tracker is None or not tracker.enabled:
+            return 0, []
+        started = time.monotonic()
+        deadline = started + tracker.max_wait_seconds
+        tracker.track(change_set.written_paths)
+        try:
+            pending = tracker.pending()
+            if pending:
+                self._publish("progress", {"phase": "settle", "pending": pending[:20]})
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._logger.warning(
+                        "SHADOW limit oczekiwania na zakonczenie zapisu (%.0f s), rebuild mimo otwartych plikow: %s",
+                        tracker.max_wait_seconds,
+                        ", ".join(pending[:5]),
+                    )
+                    break
+                event = self._next_change(timeout_seconds=min(remaining, tracker.next_check_in()))
+                while event is not None:
+                    self._logger.info("SHADOW zapis w toku, scalono zdarzenie: %s", event.describe())
+                    change_set.add(event)
+                    if event.operation != "delete":
+                        tracker.track([event.path])
+                    event = self._next_change(timeout_seconds=0)
+                pending = tracker.pending()
+        finally:
+            tracker.clear()
+        settle_ms = int((time.monotonic() - started) * 1000)
+        if settle_ms > 0:
+            self._logger.info("SHADOW zapis plikow zakonczony: settle_ms=%s pending=%s", settle_ms, len(pending))
+        return settle_ms, pending
+
+    def _run_rebuild_cycle(
+        self,
+        trigger: str,
+        mark_lock_conflict_error: bool,
+        preemptible: bool = True,
+        debounce_meta: Optional[Mapping[str, object]] = None,
+        change_set: Optional[ChangeSet] = None,
+    ) -> bool:
         started_at = self._utc_now()
+        changes = change_set.to_dict() if change_set is not None else None
         start_monotonic = time.monotonic()
         cycle_meta = None
         with self._lock_manager.hold(blocking=False) as acquired:
@@ -185,6 +496,7 @@ class ShadowManager:
                         "active_slot_before": None,
                         "rebuild_slot": None,
                         "active_slot_after": None,
+                        "changes": changes,
                         "started_at": started_at,
                         "finished_at": self._utc_now(),
                         "duration_ms": int((time.monotonic() - start_monotonic) * 1000),
@@ -195,8 +507,54 @@ class ShadowManager:
                     }
                 )
                 return False
+            content_check = self._check_content_changes()
+            if trigger == "watch" and content_check is not None and not content_check.changed:
+                current_state = self._state_store.load_or_initialize()
+                if current_state.fsm_state in {"IDLE", "READY"}:
+                    self._commit_content_check(content_check)
+                    self._logger.info(
+                        "SHADOW brak zmian tresci CNC_MASTER_DIR, rebuild pominiety (hashed_files=%s).",
+                        content_check.hashed_files,
+                    )
+                    self._append_history_entry(
+                        {
+                            "trigger": trigger,
+                            "result": "skipped_no_change",
+                            "run_id": current_state.run_id,
+                            "active_slot_before": current_state.active_slot,
+                            "rebuild_slot": None,
+                            "active_slot_after": current_state.active_slot,
+                            "changes": changes,
+                            "started_at": started_at,
+                            "finished_at": self._utc_now(),
+                            "duration_ms": int((time.monotonic() - start_monotonic) * 1000),
+                            "error": None,
+                        }
+                    )
+                    return True
             try:
-                cycle_meta = self._run_rebuild_cycle_unlocked()
+                cycle_meta = self._run_rebuild_cycle_unlocked(preemptible)
+            except RebuildCancelled as exc:
+                self._preempted_runs += 1
+                if change_set is not None:
+                    self._carried_change_set = change_set
+                self._logger.info("SHADOW rebuild przerwany, ponowienie po debounce: %s", exc)
+                self._append_history_entry(
+                    {
+                        "trigger": trigger,
+                        "result": "preempted",
+                        "run_id": self._current_run_id(),
+                        "active_slot_before": None,
+                        "rebuild_slot": None,
+                        "active_slot_after": self._state_store.load_or_initialize().active_slot,
+                        "changes": changes,
+                        "started_at": started_at,
+                        "finished_at": self._utc_now(),
+                        "duration_ms": int((time.monotonic() - start_monotonic) * 1000),
+                        "error": None,
+                    }
+                )
+                return False
             except Exception as exc:
                 error_code = self._map_error_code(exc)
                 self._set_error(code=error_code, message=str(exc))
@@ -210,6 +568,7 @@ class ShadowManager:
                         "active_slot_before": self._resolve_meta_value(cycle_meta, "active_slot_before"),
                         "rebuild_slot": self._resolve_meta_value(cycle_meta, "rebuild_slot"),
                         "active_slot_after": current_state.active_slot,
+                        "changes": changes,
                         "started_at": started_at,
                         "finished_at": self._utc_now(),
                         "duration_ms": int((time.monotonic() - start_monotonic) * 1000),
@@ -217,6 +576,9 @@ class ShadowManager:
                     }
                 )
                 return False
+            if content_check is not None:
+                self._commit_content_check(content_check)
+            self._debouncer.mark_published(time.monotonic())
 
         final_state = self._state_store.load_or_initialize()
         self._append_history_entry(
@@ -227,6 +589,21 @@ class ShadowManager:
                 "active_slot_before": self._resolve_meta_value(cycle_meta, "active_slot_before"),
                 "rebuild_slot": self._resolve_meta_value(cycle_meta, "rebuild_slot"),
                 "active_slot_after": final_state.active_slot,
+                "rebuild_mode": self._resolve_meta_value(cycle_meta, "rebuild_mode"),
+                "rebuild_reason": self._resolve_meta_value(cycle_meta, "rebuild_reason"),
+                "slot_size_mb": self._resolve_meta_value(cycle_meta, "slot_size_mb"),
+                "phases_ms": self._resolve_meta_value(cycle_meta, "phases_ms"),
+                "files_copied": self._resolve_meta_value(cycle_meta, "files_copied"),
+                "bytes_copied": self._resolve_meta_value(cycle_meta, "bytes_copied"),
+                "throughput_mb_s": self._resolve_meta_value(cycle_meta, "throughput_mb_s"),
+                "build_location": self._resolve_meta_value(cycle_meta, "build_location"),
+                "staging_fallback": self._resolve_meta_value(cycle_meta, "staging_fallback"),
+                "usb_downtime_ms": self._resolve_meta_value(cycle_meta, "usb_downtime_ms"),
+                "preempted_runs": self._resolve_meta_value(cycle_meta, "preempted_runs"),
+                "debounce_reason": (debounce_meta or {}).get("debounce_reason"),
+                "debounce_ms": (debounce_meta or {}).get("debounce_ms"),
+                "settle_ms": (debounce_meta or {}).get("settle_ms"),
+                "changes": changes,
                 "started_at": started_at,
                 "finished_at": self._utc_now(),
                 "duration_ms": int((time.monotonic() - start_monotonic) * 1000),
@@ -235,11 +612,13 @@ class ShadowManager:
         )
         return True
 
-    def _run_rebuild_cycle_unlocked(self):
+    def _run_rebuild_cycle_unlocked(self, preemptible: bool = True):
         state = self._state_store.load_or_initialize()
+        fsm_state_before = state.fsm_state
         active_slot = self._slot_manager.read_active_slot()
         rebuild_slot = self._slot_manager.get_rebuild_slot(active_slot)
         rebuild_path = self._slot_manager.get_slot_path(rebuild_slot)
+        active_path = self._slot_manager.get_slot_path(active_slot)
 
         state.fsm_state = "CHANGE_DETECTED"
         state.active_slot = active_slot
@@ -264,17 +643,57 @@ class ShadowManager:
             "rebuild_slot": rebuild_slot,
         }
 
-        self._rebuild_engine.full_rebuild(rebuild_path)
+        cancel_event = self._arm_preemption() if preemptible else None
+        try:
+            report = self._rebuild_engine.rebuild(rebuild_path, active_path, cancel_event=cancel_event)
+        except RebuildCancelled:
+            state.fsm_state = fsm_state_before if fsm_state_before in {"IDLE", "READY"} else "IDLE"
+            state.rebuild_slot = None
+            self._save_state(state)
+            raise
+        finally:
+            self._disarm_preemption()
+        cycle_meta["preempted_runs"] = self._preempted_runs
+        self._preempted_runs = 0
+        cycle_meta["rebuild_mode"] = report.mode
+        cycle_meta["rebuild_reason"] = report.reason
+        cycle_meta["slot_size_mb"] = report.slot_size_mb
+        phases_ms = dict(report.stats.phases_ms)
+        cycle_meta["phases_ms"] = phases_ms
+        cycle_meta["files_copied"] = report.stats.files_copied
+        cycle_meta["bytes_copied"] = report.stats.bytes_copied
+        cycle_meta["throughput_mb_s"] = report.stats.throughput_mb_s
+        cycle_meta["build_location"] = report.stats.build_location
+        cycle_meta["staging_fallback"] = report.stats.staging_fallback
+        self._logger.info(
+            "SHADOW rebuild obrazu: run_id=%s mode=%s reason=%s changes=%s slot_size_mb=%s "
+            "files=%s bytes=%s mb_s=%s location=%s phases_ms=%s",
+            state.run_id,
+            report.mode,
+            report.reason,
+            report.changes,
+            report.slot_size_mb,
+            report.stats.files_copied,
+            report.stats.bytes_copied,
+            report.stats.throughput_mb_s,
+            report.stats.build_location,
+            phases_ms,
+        )
 
         state.fsm_state = "EXPORT_STOP"
         self._save_state(state)
+        export_stop_started = time.monotonic()
         if not self._usb_manager.stop_export():
             raise RuntimeError("Nie udalo sie zatrzymac eksportu USB.")
+        phases_ms["usb_stop"] = self._elapsed_ms(export_stop_started)
 
         state.fsm_state = "EXPORT_START"
         self._save_state(state)
+        export_start_started = time.monotonic()
         if not self._usb_manager.start_export(rebuild_path):
             raise RuntimeError("Nie udalo sie uruchomic eksportu USB.")
+        phases_ms["usb_start"] = self._elapsed_ms(export_start_started)
+        cycle_meta["usb_downtime_ms"] = self._elapsed_ms(export_stop_started)
 
         self._slot_manager.write_active_slot(rebuild_slot)
         state.active_slot = rebuild_slot
@@ -289,6 +708,19 @@ class ShadowManager:
         cycle_meta["active_slot_after"] = rebuild_slot
         return cycle_meta
 
+    def _check_content_changes(self) -> Optional[ContentCheck]:
+        try:
+            return self._content_manifest.check()
+        except OSError as exc:
+            self._logger.warning("SHADOW nie mozna sprawdzic manifestu tresci: %s", exc)
+            return None
+
+    def _commit_content_check(self, content_check: ContentCheck) -> None:
+        try:
+            self._content_manifest.commit(content_check)
+        except OSError as exc:
+            self._logger.warning("SHADOW nie zapisal manifestu tresci %s: %s", self._content_manifest.path, exc)
+
     def _normalize_state(self, state: ShadowState, active_slot: str) -> ShadowState:
         if state.active_slot == active_slot and state.fsm_state in {"IDLE", "READY"}:
             return state
@@ -310,6 +742,10 @@ class ShadowManager:
 
     @staticmethod
     def _map_error_code(error: Exception) -> str:
+        if isinstance(error, CapacityError):
+            return error.code
+        if isinstance(error, SlotCapacityError):
+            return "ERR_NO_SPACE"
         if isinstance(error, RebuildError):
             return "ERR_REBUILD_TIMEOUT"
         message = str(error).lower()
@@ -323,6 +759,7 @@ class ShadowManager:
 
     def _save_state(self, state: ShadowState) -> None:
         self._state_store.save(state)
+        self._publish("state", state.to_dict())
         self._apply_led_for_state(state.fsm_state)
 
     def _apply_led_for_state(self, fsm_state: str) -> None:
@@ -333,6 +770,13 @@ class ShadowManager:
             self._last_led_mode = led_mode
 
     def _set_led_mode(self, mode_name: str) -> bool:
+        try:
+            from led_status_cli import set_led_mode
+        except ImportError:
+            return self._run_led_cli(mode_name)
+        return set_led_mode(mode_name, fallback=self._run_led_cli)
+
+    def _run_led_cli(self, mode_name: str) -> bool:
         commands = []
         if sys.executable:
             commands.append([sys.executable, "-m", "led_status_cli", mode_name])
@@ -368,53 +812,27 @@ class ShadowManager:
         return False
 
     def _append_history_entry(self, entry) -> None:
+        if self._lun_name is not None:
+            entry = {"lun": self._lun_name, **entry}
+        try:
+            entry = self._history_log.append(entry)
+        except OSError as exc:
+            self._logger.warning("SHADOW history save failed: %s", exc)
         with self._history_lock:
             self._history_entries.append(entry)
-            if len(self._history_entries) > self._history_limit:
-                self._history_entries = self._history_entries[-self._history_limit :]
-            snapshot = list(self._history_entries)
-        self._save_history(snapshot)
+            if len(self._history_entries) > self._history_cache_limit:
+                self._history_entries = self._history_entries[-self._history_cache_limit :]
+        self._history_stats.add(entry)
+        self._event_bus.publish("history", entry)
 
     def _load_history(self):
-        if not os.path.isfile(self._history_file):
-            return []
         try:
-            with open(self._history_file, "r", encoding="utf-8") as history_handle:
-                payload = json.load(history_handle)
-        except (OSError, json.JSONDecodeError):
-            return []
-        if not isinstance(payload, list):
-            return []
-        entries = [entry for entry in payload if isinstance(entry, dict)]
-        if len(entries) > self._history_limit:
-            entries = entries[-self._history_limit :]
-        return entries
-
-    def _save_history(self, entries) -> None:
-        directory = os.path.dirname(self._history_file) or "."
-        try:
-            os.makedirs(directory, exist_ok=True)
-            with tempfile.NamedTemporaryFile(
-                mode="w",
-                encoding="utf-8",
-                dir=directory,
-                prefix="shadow-history-",
-                suffix=".tmp",
-                delete=False,
-            ) as temp_handle:
-                json.dump(entries, temp_handle, ensure_ascii=False)
-                temp_handle.write("\n")
-                temp_handle.flush()
-                os.fsync(temp_handle.fileno())
-                temp_path = temp_handle.name
-            os.replace(temp_path, self._history_file)
-            directory_fd = os.open(directory, os.O_RDONLY)
-            try:
-                os.fsync(directory_fd)
-            finally:
-                os.close(directory_fd)
+            self._history_log.prepare()
+            self._history_stats.seed(self._history_log.iter_latest())
+            return list(reversed(self._history_log.latest(self._history_cache_limit)))
         except OSError as exc:
-            self._logger.warning("SHADOW history save failed: %s", exc)
+            self._logger.warning("SHADOW history load failed: %s", exc)
+            return []
 
     @staticmethod
     def _utc_now() -> str:
@@ -435,8 +853,18 @@ class ShadowManager:
                 pass
         return self._current_run_id()
 
+    @staticmethod
+    def _elapsed_ms(started_monotonic: float) -> int:
+        return int((time.monotonic() - started_monotonic) * 1000)
+
     @staticmethod
     def _resolve_meta_value(cycle_meta, key: str):
         if not isinstance(cycle_meta, dict):
             return None
         return cycle_meta.get(key)
+
+
+def _lun_payload(lun_name: Optional[str], payload: Dict[str, object]) -> Dict[str, object]:
+    if lun_name is None:
+        return payload
+    return {"lun": lun_name, **payload}
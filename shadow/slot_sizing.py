@@ -0,0 +1,282 @@
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from shadow.fat_image import (
+    DIR_ENTRY_SIZE,
+    FAT16,
+    FAT32,
+    FatGeometry,
+    SECTOR_SIZE,
+    FatImageError,
+    compute_geometry,
+)
+from shadow.manifest import MasterSnapshot
+
+
+SLOT_SIZING_MODES = {"fixed", "auto"}
+FAT_TYPE_CHOICES = {"16", "32", "auto"}
+LAYOUT_POLICIES = {"default", "read_optimized"}
+_BASE_SIZE_CLASS_MB = 32
+_FAT32_AUTO_THRESHOLD_MB = 512
+_LFN_CHARS_PER_ENTRY = 13
+_READ_OPTIMIZED_CLUSTER_SECTORS = (64, 32, 16, 8, 4, 2, 1)
+_READ_OPTIMIZED_MAX_SLACK_PERCENT = 10
+_READ_OPTIMIZED_SLACK_HYSTERESIS_PERCENT = 5
+
+
+class SlotCapacityError(RuntimeError):
+    pass
+
+
+@dataclass(frozen=True)
+class SlotLayout:
+    size_mb: int
+    fat_type: int
+    sectors_per_cluster: Optional[int]
+
+    @property
+    def size_bytes(self) -> int:
+        return self.size_mb * 1024 * 1024
+
+
+class SlotSizingPolicy:
+    def __init__(
+        self,
+        mode: str,
+        max_size_mb: int,
+        fat_type: str = "32",
+        headroom_percent: int = 25,
+        min_size_mb: int = _BASE_SIZE_CLASS_MB,
+        shrink_factor: int = 4,
+        layout_policy: str = "default",
+    ) -> None:
+        self._mode = mode
+        self._max_size_mb = max_size_mb
+        self._fat_type = fat_type
+        self._headroom_percent = headroom_percent
+        self._min_size_mb = min_size_mb
+        self._shrink_factor = shrink_factor
+        self._layout_policy = layout_policy
+
+    def choose(
+        self,
+        snapshot: MasterSnapshot,
+        current_size_mb: Optional[int] = None,
+        current_layout: Optional[SlotLayout] = None,
+    ) -> SlotLayout:
+        usage = _DirectoryUsage(snapshot)
+        if self._mode != "auto":
+            layout = self.layout_for_size(self._max_size_mb, usage, current_layout=current_layout)
+            geometry = self._geometry(layout)
+            if geometry is not None and not self._fits(usage, geometry, headroom_percent=0):
+                raise SlotCapacityError(
+                    f"Zawartosc CNC_MASTER_DIR ({_format_mb(snapshot.total_bytes)} MB) "
+                    f"nie miesci sie w slocie {layout.size_mb} MB."
+                )
+            return layout
+
+        chosen = None
+        for size_mb in self.size_classes():
+            layout = self.layout_for_size(size_mb, usage, self._headroom_percent, current_layout)
+            geometry = self._geometry(layout)
+            if geometry is not None and self._fits(usage, geometry, self._headroom_percent):
+                chosen = layout
+                break
+        if chosen is None:
+            raise SlotCapacityError(
+                f"Zawartosc CNC_MASTER_DIR ({_format_mb(snapshot.total_bytes)} MB) "
+                f"przekracza maksymalny rozmiar slotu {self._max_size_mb} MB."
+            )
+
+        if current_size_mb and chosen.size_mb < current_size_mb <= chosen.size_mb * self._shrink_factor:
+            if current_size_mb in self.size_classes():
+                current = self.layout_for_size(current_size_mb, usage, current_layout=current_layout)
+                geometry = self._geometry(current)
+                if geometry is not None and self._fits(usage, geometry, headroom_percent=0):
+                    return current
+        return chosen
+
+    def usage_bytes(self, snapshot: MasterSnapshot) -> Tuple[int, int]:
+        usage = _DirectoryUsage(snapshot)
+        geometry = self._geometry(self.layout_for_size(self._max_size_mb, usage))
+        if geometry is None:
+            return 0, 0
+        return (
+            usage.required_clusters(geometry) * geometry.cluster_size,
+            geometry.cluster_count * geometry.cluster_size,
+        )
+
+    def size_classes(self) -> List[int]:
+        classes = []
+        size_mb = _BASE_SIZE_CLASS_MB
+        while size_mb < self._max_size_mb:
+            if size_mb >= self._min_size_mb:
+                classes.append(size_mb)
+            size_mb *= 2
+        classes.append(self._max_size_mb)
+        return classes
+
+    def layout_for_size(
+        self,
+        size_mb: int,
+        usage: Optional["_DirectoryUsage"] = None,
+        headroom_percent: int = 0,
+        current_layout: Optional[SlotLayout] = None,
+    ) -> SlotLayout:
+        if self._layout_policy == "read_optimized" and usage is not None:
+            layout = self._read_optimized_layout(size_mb, usage, headroom_percent, current_layout)
+            if layout is not None:
+                return layout
+        if self._fat_type == "auto":
+            fat_type = FAT32 if size_mb >= _FAT32_AUTO_THRESHOLD_MB else FAT16
+        else:
+            fat_type = int(self._fat_type)
+        sectors_per_cluster = None
+        if self._mode == "auto":
+            try:
+                sectors_per_cluster = compute_geometry(size_mb * 1024 * 1024, fat_type).sectors_per_cluster
+            except FatImageError:
+                sectors_per_cluster = None
+        return SlotLayout(size_mb=size_mb, fat_type=fat_type, sectors_per_cluster=sectors_per_cluster)
+
+    def _read_optimized_layout(
+        self,
+        size_mb: int,
+        usage: "_DirectoryUsage",
+        headroom_percent: int,
+        current_layout: Optional[SlotLayout] = None,
+    ) -> Optional[SlotLayout]:
+        fat_types = [FAT16, FAT32] if self._fat_type == "auto" else [int(self._fat_type)]
+        chosen = None
+        for sectors_per_cluster in _READ_OPTIMIZED_CLUSTER_SECTORS:
+            smallest = sectors_per_cluster == _READ_OPTIMIZED_CLUSTER_SECTORS[-1]
+            if not smallest and not self._slack_within(usage, sectors_per_cluster, _READ_OPTIMIZED_MAX_SLACK_PERCENT):
+                continue
+            chosen = self._fitting_layout(size_mb, sectors_per_cluster, fat_types, usage, headroom_percent)
+            if chosen is not None:
+                break
+        current = self._current_read_optimized_layout(size_mb, usage, headroom_percent, current_layout, fat_types)
+        if current is None or chosen is None or chosen == current:
+            return chosen
+        if chosen.sectors_per_cluster > current.sectors_per_cluster and self._slack_within(
+            usage,
+            chosen.sectors_per_cluster,
+            _READ_OPTIMIZED_MAX_SLACK_PERCENT - _READ_OPTIMIZED_SLACK_HYSTERESIS_PERCENT,
+        ):
+            return chosen
+        return current
+
+    def _current_read_optimized_layout(
+        self,
+        size_mb: int,
+        usage: "_DirectoryUsage",
+        headroom_percent: int,
+        current_layout: Optional[SlotLayout],
+        fat_types: List[int],
+    ) -> Optional[SlotLayout]:
+        if (
+            current_layout is None
+            or current_layout.size_mb != size_mb
+            or current_layout.fat_type not in fat_types
+            or current_layout.sectors_per_cluster not in _READ_OPTIMIZED_CLUSTER_SECTORS
+        ):
+            return None
+        smallest = current_layout.sectors_per_cluster == _READ_OPTIMIZED_CLUSTER_SECTORS[-1]
+        if not smallest and not self._slack_within(
+            usage,
+            current_layout.sectors_per_cluster,
+            _READ_OPTIMIZED_MAX_SLACK_PERCENT + _READ_OPTIMIZED_SLACK_HYSTERESIS_PERCENT,
+        ):
+            return None
+        geometry = self._geometry(current_layout)
+        if geometry is None or not self._fits(usage, geometry, headroom_percent):
+            return None
+        return current_layout
+
+    def _fitting_layout(
+        self,
+        size_mb: int,
+        sectors_per_cluster: int,
+        fat_types: List[int],
+        usage: "_DirectoryUsage",
+        headroom_percent: int,
+    ) -> Optional[SlotLayout]:
+        for fat_type in fat_types:
+            layout = SlotLayout(size_mb=size_mb, fat_type=fat_type, sectors_per_cluster=sectors_per_cluster)
+            geometry = self._geometry(layout)
+            if geometry is not None and self._fits(usage, geometry, headroom_percent):
+                return layout
+        return None
+
+    @staticmethod
+    def _slack_within(usage: "_DirectoryUsage", sectors_per_cluster: int, max_slack_percent: int) -> bool:
+        return usage.slack_bytes(sectors_per_cluster * SECTOR_SIZE) * 100 <= usage.data_bytes * max_slack_percent
+
+    @staticmethod
+    def _geometry(layout: SlotLayout) -> Optional[FatGeometry]:
+        try:
+            return compute_geometry(layout.size_bytes, layout.fat_type, layout.sectors_per_cluster)
+        except FatImageError:
+            return None
+
+    @staticmethod
+    def _fits(usage: "_DirectoryUsage", geometry: FatGeometry, headroom_percent: int) -> bool:
+        if geometry.fat_type == FAT16 and usage.root_entries > geometry.root_entries:
+            return False
+        required = usage.required_clusters(geometry)
+        return required * (100 + headroom_percent) <= geometry.cluster_count * 100
+
+    @property
+    def mode(self) -> str:
+        return self._mode
+
+    @property
+    def layout_policy(self) -> str:
+        return self._layout_policy
+
+
+class _DirectoryUsage:
+    def __init__(self, snapshot: MasterSnapshot) -> None:
+        self._file_sizes = [entry.size for entry in snapshot.files.values()]
+        self._entries: Dict[str, int] = defaultdict(int)
+        for path in list(snapshot.files) + list(snapshot.directories):
+            parent, _separator, name = path.rpartition("/")
+            self._entries[parent] += 1 + -(-len(name) // _LFN_CHARS_PER_ENTRY)
+        self._directories = sorted(snapshot.directories)
+
+    @property
+    def data_bytes(self) -> int:
+        return sum(self._file_sizes)
+
+    def slack_bytes(self, cluster_size: int) -> int:
+        return sum(-size % cluster_size for size in self._file_sizes)
+
+    @property
+    def root_entries(self) -> int:
+        return self._entries[""] + 1
+
+    def required_clusters(self, geometry: FatGeometry) -> int:
+        cluster_size = geometry.cluster_size
+        clusters = sum(-(-size // cluster_size) for size in self._file_sizes)
+        for directory in self._directories:
+            clusters += max(1, -(-(self._entries[directory] + 2) * DIR_ENTRY_SIZE // cluster_size))
+        if geometry.fat_type == FAT32:
+            clusters += max(1, -(-self.root_entries * DIR_ENTRY_SIZE // cluster_size))
+        return clusters
+
+
+def estimate_image_bytes(snapshot: MasterSnapshot, layout: SlotLayout) -> int:
+    try:
+        geometry = compute_geometry(layout.size_bytes, layout.fat_type, layout.sectors_per_cluster)
+    except FatImageError:
+        return layout.size_bytes
+    used_clusters = _DirectoryUsage(snapshot).required_clusters(geometry)
+    return min(
+        layout.size_bytes,
+        geometry.data_start_sector * SECTOR_SIZE + used_clusters * geometry.cluster_size,
+    )
+
+
+def _format_mb(size_bytes: int) -> str:
+    return f"{size_bytes / (1024 * 1024):.1f}"
@@ -1,7 +1,8 @@
 import json
 import os
 import tempfile
-from dataclasses import dataclass
+import threading
+from dataclasses import dataclass, replace
 from typing import Dict, Mapping, Optional
 
 
@@ -15,6 +16,7 @@ _ALLOWED_STATES = {
     "READY",
     "ERROR",
 }
+_DURABLE_STATES = {"READY", "ERROR"}
 
 
 @dataclass
@@ -62,6 +64,9 @@ class ShadowState:
 class StateStore:
     def __init__(self, state_file: str) -> None:
         self._state_file = state_file
+        self._lock = threading.Lock()
+        self._state: Optional[ShadowState] = None
+        self._durable_state: Optional[ShadowState] = None
 
     @classmethod
     def from_environment(cls, environment: Mapping[str, str]) -> "StateStore":
@@ -79,14 +84,34 @@ class StateStore:
         return ShadowState.from_dict(payload)
 
     def load_or_initialize(self) -> ShadowState:
-        state = self.load()
-        if state is not None:
-            return state
-        state = ShadowState()
-        self.save(state)
-        return state
+        with self._lock:
+            if self._state is None:
+                state = self.load()
+                if state is None:
+                    state = ShadowState()
+                    self._write(state, sync=True)
+                self._state = _copy_state(state)
+                self._durable_state = _copy_state(state)
+            return _copy_state(self._state)
+
+    def current(self) -> ShadowState:
+        return self.load_or_initialize()
 
     def save(self, state: ShadowState) -> None:
+        with self._lock:
+            durable = self._is_durable_transition(state)
+            self._write(state, sync=durable)
+            self._state = _copy_state(state)
+            if durable:
+                self._durable_state = _copy_state(state)
+
+    def _is_durable_transition(self, state: ShadowState) -> bool:
+        previous = self._durable_state
+        if previous is None or state.fsm_state in _DURABLE_STATES:
+            return True
+        return state.run_id != previous.run_id or state.active_slot != previous.active_slot
+
+    def _write(self, state: ShadowState, sync: bool) -> None:
         directory = os.path.dirname(self._state_file) or "."
         os.makedirs(directory, exist_ok=True)
 
@@ -101,10 +126,13 @@ class StateStore:
             json.dump(state.to_dict(), temp_handle, ensure_ascii=False)
             temp_handle.write("\n")
             temp_handle.flush()
-            os.fsync(temp_handle.fileno())
+            if sync:
+                os.fsync(temp_handle.fileno())
             temp_path = temp_handle.name
 
         os.replace(temp_path, self._state_file)
+        if not sync:
+            return
         directory_fd = os.open(directory, os.O_RDONLY)
         try:
             os.fsync(directory_fd)
@@ -114,3 +142,7 @@ class StateStore:
     @property
     def path(self) -> str:
         return self._state_file
+
+
+def _copy_state(state: ShadowState) -> ShadowState:
+    return replace(state, last_error=dict(state.last_error) if state.last_error is not None else None)
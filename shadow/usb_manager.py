@@ -1,9 +1,10 @@
 import os
 import shutil
 import subprocess
+import threading
 import time
 from dataclasses import dataclass
-from typing import Mapping
+from typing import Dict, Mapping, Sequence, Union
 
 
 @dataclass(frozen=True)
@@ -28,16 +29,30 @@ class UsbManager:
             return False
         return self._wait_for_module_state(expect_loaded=False, timeout_seconds=self._timeouts.stop_timeout)
 
-    def start_export(self, active_slot_path: str) -> bool:
-        if not active_slot_path:
-            return False
-        result = self._run_root_command(
-            [self._resolve_binary("modprobe"), "g_mass_storage", f"file={active_slot_path}", "ro=1"]
-        )
+    def start_export(self, active_slot_path: Union[str, Sequence[str]]) -> bool:
+        if isinstance(active_slot_path, str):
+            if not active_slot_path:
+                return False
+            parameters = [f"file={active_slot_path}", "ro=1"]
+        else:
+            lun_paths = list(active_slot_path)
+            if not any(lun_paths):
+                return False
+            lun_flags = ",".join("1" for _ in lun_paths)
+            parameters = [
+                f"file={','.join(lun_paths)}",
+                f"luns={len(lun_paths)}",
+                f"ro={lun_flags}",
+                f"removable={lun_flags}",
+            ]
+        result = self._run_root_command([self._resolve_binary("modprobe"), "g_mass_storage", *parameters])
         if result.returncode != 0:
             return False
         return self._wait_for_module_state(expect_loaded=True, timeout_seconds=self._timeouts.start_timeout)
 
+    def is_exporting(self) -> bool:
+        return self._is_mass_storage_loaded()
+
     def _wait_for_module_state(self, expect_loaded: bool, timeout_seconds: int) -> bool:
         deadline = time.monotonic() + max(timeout_seconds, 0)
         while time.monotonic() <= deadline:
@@ -83,3 +98,47 @@ class UsbManager:
             if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
                 return candidate
         return binary_name
+
+
+class MultiLunExport:
+    def __init__(self, usb_manager: UsbManager, lun_names: Sequence[str]) -> None:
+        self._usb_manager = usb_manager
+        self._lun_paths: Dict[str, str] = {name: "" for name in lun_names}
+        self._lock = threading.Lock()
+
+    def register(self, lun_name: str, image_path: str) -> None:
+        with self._lock:
+            self._lun_paths[lun_name] = image_path
+
+    def lun(self, lun_name: str) -> "LunExport":
+        if lun_name not in self._lun_paths:
+            raise ValueError(f"Nieznany LUN: {lun_name}")
+        return LunExport(self, lun_name)
+
+    def stop_export(self) -> bool:
+        with self._lock:
+            if not self._usb_manager.is_exporting():
+                return True
+            return self._usb_manager.stop_export()
+
+    def start_export(self, lun_name: str, image_path: str) -> bool:
+        with self._lock:
+            self._lun_paths[lun_name] = image_path
+            if self._usb_manager.is_exporting() and not self._usb_manager.stop_export():
+                return False
+            return self._usb_manager.start_export(self._exported_paths())
+
+    def _exported_paths(self) -> Sequence[str]:
+        return [path if path and os.path.isfile(path) else "" for path in self._lun_paths.values()]
+
+
+class LunExport:
+    def __init__(self, export: MultiLunExport, lun_name: str) -> None:
+        self._export = export
+        self._lun_name = lun_name
+
+    def stop_export(self) -> bool:
+        return self._export.stop_export()
+
+    def start_export(self, active_slot_path: str) -> bool:
+        return self._export.start_export(self._lun_name, active_slot_path)
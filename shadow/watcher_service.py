@@ -1,23 +1,444 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
 import os
 import select
+import struct
 import subprocess
-from typing import Mapping, Optional
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Deque, Dict, List, Mapping, Optional, Tuple
+
+from shadow.change_events import ChangeEvent, split_watcher_line, watcher_change_event
+from shadow.ignore_rules import IgnoreRules
+
+
+WATCHER_BACKENDS = {"auto", "inotify", "inotifywait", "poll"}
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = IN_CLOSE_WRITE | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF
+_EVENT_HEADER = struct.Struct("iIII")
+_READ_BUFFER_SIZE = 64 * 1024
+_RESTART_BACKOFF_INITIAL_SECONDS = 1.0
+_RESTART_BACKOFF_MAX_SECONDS = 60.0
+_STABLE_RUN_SECONDS = 60.0
+_MOVE_PAIR_SECONDS = 0.05
+_EVENT_FLAGS = (
+    (IN_CLOSE_WRITE, "CLOSE_WRITE"),
+    (IN_CREATE, "CREATE"),
+    (IN_DELETE, "DELETE"),
+    (IN_MOVED_FROM, "MOVED_FROM"),
+    (IN_MOVED_TO, "MOVED_TO"),
+    (IN_DELETE_SELF, "DELETE_SELF"),
+    (IN_MOVE_SELF, "MOVE_SELF"),
+    (IN_ISDIR, "ISDIR"),
+)
+RESCAN_FLAG = "Q_OVERFLOW"
+
+
+class WatcherUnavailableError(RuntimeError):
+    pass
+
+
+class WatcherFailedError(RuntimeError):
+    pass
 
 
 class WatcherService:
-    def __init__(self, watched_dir: str) -> None:
+    def __init__(
+        self,
+        watched_dir: str,
+        backend: str = "auto",
+        poll_interval_seconds: float = 2.0,
+        poll_full_scan_seconds: float = 60.0,
+        ignore_rules: Optional[IgnoreRules] = None,
+    ) -> None:
         self._watched_dir = watched_dir
-        self._process = None
+        self._backend = backend
+        self._ignore_rules = ignore_rules
+        self._poll_interval_seconds = poll_interval_seconds
+        self._poll_full_scan_seconds = poll_full_scan_seconds
+        self._watcher = None
+        self._restart_at: Optional[float] = None
+        self._running_since: Optional[float] = None
+        self._consecutive_failures = 0
+        self._restarts = 0
+        self._last_error: Optional[str] = None
+        self._last_restart_at: Optional[str] = None
+        self._last_event_at: Optional[str] = None
+        self._logger = logging.getLogger(__name__)
 
     @classmethod
     def from_environment(cls, environment: Mapping[str, str]) -> "WatcherService":
         watched_dir = environment.get("CNC_MASTER_DIR", "/var/lib/cnc-control/master")
-        return cls(watched_dir=watched_dir)
+        backend = environment.get("CNC_SHADOW_WATCHER_BACKEND", "auto").strip().lower() or "auto"
+        if backend not in WATCHER_BACKENDS:
+            raise ValueError(f"Nieprawidlowa wartosc CNC_SHADOW_WATCHER_BACKEND: {backend}")
+        poll_interval_seconds = float(environment.get("CNC_SHADOW_POLL_INTERVAL_SECONDS", "2"))
+        if poll_interval_seconds <= 0:
+            raise ValueError(
+                f"Nieprawidlowa wartosc CNC_SHADOW_POLL_INTERVAL_SECONDS: {poll_interval_seconds}"
+            )
+        return cls(
+            watched_dir=watched_dir,
+            backend=backend,
+            poll_interval_seconds=poll_interval_seconds,
+            poll_full_scan_seconds=float(environment.get("CNC_SHADOW_POLL_FULL_SCAN_SECONDS", "60")),
+            ignore_rules=IgnoreRules.from_environment(environment),
+        )
 
     def start(self) -> None:
-        if self._process is not None:
+        if self._watcher is not None:
             return
+        self._start_backend()
+
+    def _start_backend(self) -> None:
         os.makedirs(self._watched_dir, exist_ok=True)
+        candidates = self._candidates()
+        for index, watcher in enumerate(candidates):
+            try:
+                watcher.start()
+            except (WatcherUnavailableError, OSError) as exc:
+                if index == len(candidates) - 1:
+                    raise
+                self._logger.warning(
+                    "SHADOW watcher %s niedostepny, uzyto %s: %s",
+                    watcher.name,
+                    candidates[index + 1].name,
+                    exc,
+                )
+                continue
+            self._watcher = watcher
+            self._restart_at = None
+            self._running_since = time.monotonic()
+            return
+
+    def _candidates(self) -> List[object]:
+        candidates = {
+            "inotify": lambda: InotifyWatcher(self._watched_dir),
+            "inotifywait": lambda: InotifywaitWatcher(self._watched_dir),
+            "poll": lambda: PollingWatcher(
+                self._watched_dir,
+                interval_seconds=self._poll_interval_seconds,
+                full_scan_seconds=self._poll_full_scan_seconds,
+            ),
+        }
+        if self._backend == "auto":
+            return [factory() for factory in candidates.values()]
+        return [candidates[self._backend]()]
+
+    def stop(self) -> None:
+        self._restart_at = None
+        if self._watcher is None:
+            return
+        self._watcher.stop()
+        self._watcher = None
+
+    def poll_event(self, timeout_seconds: float = 0.0) -> Optional[ChangeEvent]:
+        deadline = time.monotonic() + timeout_seconds
+        while True:
+            if self._watcher is None:
+                return self._restart_if_due(max(0.0, deadline - time.monotonic()))
+            try:
+                event = self._watcher.poll_event(max(0.0, deadline - time.monotonic()))
+            except (WatcherFailedError, OSError) as exc:
+                self._schedule_restart(exc)
+                return None
+            if event is None:
+                return None
+            self._last_event_at = _utc_now()
+            event = self._filter_ignored(event)
+            if event is not None:
+                return event
+
+    def _filter_ignored(self, event: ChangeEvent) -> Optional[ChangeEvent]:
+        rules = self._ignore_rules
+        if rules is None or not event.path:
+            return event
+        if rules.is_ignore_file(event.path) or rules.is_ignore_file(event.previous_path or ""):
+            return ChangeEvent(path="", operation="modify", timestamp=event.timestamp)
+        path_ignored = rules.is_ignored(event.path, event.is_dir)
+        if event.previous_path is None:
+            return None if path_ignored else event
+        previous_ignored = rules.is_ignored(event.previous_path, event.is_dir)
+        if path_ignored and previous_ignored:
+            return None
+        if previous_ignored:
+            return ChangeEvent(path=event.path, operation="create", is_dir=event.is_dir, timestamp=event.timestamp)
+        if path_ignored:
+            return ChangeEvent(
+                path=event.previous_path,
+                operation="delete",
+                is_dir=event.is_dir,
+                timestamp=event.timestamp,
+            )
+        return event
+
+    def status(self) -> Dict[str, object]:
+        if self._watcher is not None:
+            state = "running"
+        elif self._restart_at is not None:
+            state = "restarting"
+        else:
+            state = "stopped"
+        return {
+            "state": state,
+            "backend": self.backend,
+            "configured_backend": self._backend,
+            "restarts": self._restarts,
+            "last_restart_at": self._last_restart_at,
+            "last_event_at": self._last_event_at,
+            "last_error": self._last_error,
+            "restart_in_s": (
+                round(max(0.0, self._restart_at - time.monotonic()), 1) if self._restart_at is not None else None
+            ),
+        }
+
+    def _schedule_restart(self, error: Exception) -> None:
+        backend = self.backend
+        if self._watcher is not None:
+            try:
+                self._watcher.stop()
+            except Exception:
+                pass
+            self._watcher = None
+        now = time.monotonic()
+        if self._running_since is not None and now - self._running_since >= _STABLE_RUN_SECONDS:
+            self._consecutive_failures = 0
+        self._running_since = None
+        delay = min(
+            _RESTART_BACKOFF_MAX_SECONDS,
+            _RESTART_BACKOFF_INITIAL_SECONDS * (2 ** self._consecutive_failures),
+        )
+        self._consecutive_failures += 1
+        self._restart_at = now + delay
+        self._last_error = str(error) or error.__class__.__name__
+        self._logger.warning(
+            "SHADOW watcher %s zatrzymany, restart za %.1f s: %s",
+            backend,
+            delay,
+            self._last_error,
+        )
+
+    def _restart_if_due(self, timeout_seconds: float) -> Optional[ChangeEvent]:
+        if self._restart_at is None:
+            return None
+        remaining = self._restart_at - time.monotonic()
+        if remaining > timeout_seconds:
+            time.sleep(max(0.0, timeout_seconds))
+            return None
+        time.sleep(max(0.0, remaining))
+        try:
+            self._start_backend()
+        except (WatcherUnavailableError, OSError) as exc:
+            self._schedule_restart(exc)
+            return None
+        self._restarts += 1
+        self._last_restart_at = _utc_now()
+        self._logger.info(
+            "SHADOW watcher %s uruchomiony ponownie (restarts=%s), skan uzgadniajacy CNC_MASTER_DIR.",
+            self.backend,
+            self._restarts,
+        )
+        return ChangeEvent(path="", operation="modify")
+
+    @property
+    def watched_dir(self) -> str:
+        return self._watched_dir
+
+    @property
+    def backend(self) -> Optional[str]:
+        if self._watcher is None:
+            return None
+        return self._watcher.name
+
+
+class InotifyWatcher:
+    name = "inotify"
+
+    def __init__(self, watched_dir: str) -> None:
+        self._watched_dir = os.path.normpath(watched_dir)
+        self._fd: Optional[int] = None
+        self._libc = None
+        self._watches: Dict[int, str] = {}
+        self._moves: Dict[int, Tuple[str, bool]] = {}
+        self._pending: Deque[ChangeEvent] = deque()
+        self._logger = logging.getLogger(__name__)
+
+    def start(self) -> None:
+        if self._fd is not None:
+            return
+        self._libc = _load_libc()
+        fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise WatcherUnavailableError(f"inotify_init1: {os.strerror(ctypes.get_errno())}")
+        self._fd = fd
+        try:
+            self._add_tree(self._watched_dir, report_existing=False)
+        except WatcherUnavailableError:
+            self.stop()
+            raise
+
+    def stop(self) -> None:
+        if self._fd is None:
+            return
+        os.close(self._fd)
+        self._fd = None
+        self._watches.clear()
+        self._moves.clear()
+        self._pending.clear()
+
+    def poll_event(self, timeout_seconds: float = 0.0) -> Optional[ChangeEvent]:
+        if self._pending:
+            return self._pending.popleft()
+        if self._fd is None:
+            return None
+        ready, _, _ = select.select([self._fd], [], [], timeout_seconds)
+        if not ready:
+            return None
+        self._read_events()
+        if self._pending:
+            return self._pending.popleft()
+        return None
+
+    def _read_events(self) -> None:
+        while True:
+            try:
+                buffer = os.read(self._fd, _READ_BUFFER_SIZE)
+            except BlockingIOError:
+                break
+            if not buffer:
+                break
+            self._handle_buffer(buffer)
+        for path, is_dir in self._moves.values():
+            if is_dir:
+                self._forget_tree(path)
+            self._emit(path, ["MOVED_FROM", "ISDIR"] if is_dir else ["MOVED_FROM"])
+        self._moves.clear()
+
+    def _handle_buffer(self, buffer: bytes) -> None:
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(buffer):
+            wd, mask, cookie, name_length = _EVENT_HEADER.unpack_from(buffer, offset)
+            raw_name = buffer[offset + _EVENT_HEADER.size : offset + _EVENT_HEADER.size + name_length]
+            offset += _EVENT_HEADER.size + name_length
+            name = os.fsdecode(raw_name.rstrip(b"\0"))
+            self._handle_event(wd, mask, name, cookie)
+
+    def _handle_event(self, wd: int, mask: int, name: str, cookie: int = 0) -> None:
+        if mask & IN_Q_OVERFLOW:
+            self._logger.warning("SHADOW przepelnienie kolejki inotify, pelne ponowne skanowanie.")
+            self._pending.clear()
+            self._moves.clear()
+            self._rewatch()
+            self._emit(self._watched_dir, [RESCAN_FLAG])
+            return
+        directory = self._watches.get(wd)
+        if directory == self._watched_dir and mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+            raise WatcherFailedError(f"Katalog obserwowany usuniety albo przeniesiony: {self._watched_dir}")
+        if mask & IN_IGNORED:
+            self._watches.pop(wd, None)
+            return
+        if directory is None or mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            return
+
+        path = os.path.join(directory, name) if name else directory
+        is_dir = bool(mask & IN_ISDIR)
+        flags = [flag for bit, flag in _EVENT_FLAGS if mask & bit]
+        if mask & IN_MOVED_FROM and cookie:
+            self._moves[cookie] = (path, is_dir)
+            return
+        if mask & IN_MOVED_FROM and is_dir:
+            self._forget_tree(path)
+        previous = self._moves.pop(cookie, None) if mask & IN_MOVED_TO and cookie else None
+        if previous is not None:
+            self._emit(path, flags, previous[0])
+            if is_dir:
+                self._rekey_tree(previous[0], path)
+            return
+        self._emit(path, flags)
+        if is_dir and mask & (IN_CREATE | IN_MOVED_TO):
+            self._add_tree(path, report_existing=True)
+
+    def _add_tree(self, root: str, report_existing: bool) -> None:
+        if not self._add_watch(root):
+            return
+        for current_dir, dir_names, file_names in os.walk(root):
+            dir_names[:] = sorted(name for name in dir_names if not os.path.islink(os.path.join(current_dir, name)))
+            for dir_name in dir_names:
+                dir_path = os.path.join(current_dir, dir_name)
+                if report_existing:
+                    self._emit(dir_path, ["CREATE", "ISDIR"])
+                self._add_watch(dir_path)
+            if report_existing:
+                for file_name in sorted(file_names):
+                    self._emit(os.path.join(current_dir, file_name), ["CLOSE_WRITE"])
+
+    def _add_watch(self, path: str) -> bool:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), _WATCH_MASK | IN_ONLYDIR)
+        if wd < 0:
+            error_number = ctypes.get_errno()
+            if path == self._watched_dir:
+                raise WatcherUnavailableError(f"inotify_add_watch {path}: {os.strerror(error_number)}")
+            if error_number == errno.ENOSPC:
+                self._logger.warning("SHADOW limit fs.inotify.max_user_watches, katalog bez obserwacji: %s", path)
+            return False
+        self._watches[wd] = path
+        return True
+
+    def _forget_tree(self, root: str) -> None:
+        prefix = f"{root}{os.sep}"
+        for wd, path in list(self._watches.items()):
+            if path == root or path.startswith(prefix):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._watches[wd]
+
+    def _rekey_tree(self, old_root: str, new_root: str) -> None:
+        old_prefix = f"{old_root}{os.sep}"
+        for wd, path in list(self._watches.items()):
+            if path == old_root:
+                self._watches[wd] = new_root
+            elif path.startswith(old_prefix):
+                self._watches[wd] = os.path.join(new_root, path[len(old_prefix):])
+
+    def _rewatch(self) -> None:
+        for wd in list(self._watches):
+            self._libc.inotify_rm_watch(self._fd, wd)
+        self._watches.clear()
+        self._add_tree(self._watched_dir, report_existing=False)
+
+    def _emit(self, path: str, flags: List[str], previous_path: Optional[str] = None) -> None:
+        self._pending.append(watcher_change_event(self._watched_dir, path, set(flags), previous_path))
+
+
+class InotifywaitWatcher:
+    name = "inotifywait"
+
+    def __init__(self, watched_dir: str) -> None:
+        self._watched_dir = watched_dir
+        self._process = None
+        self._pending: Deque[ChangeEvent] = deque()
+        self._logger = logging.getLogger(__name__)
+
+    def start(self) -> None:
+        if self._process is not None:
+            return
         self._process = subprocess.Popen(
             [
                 "inotifywait",
@@ -40,8 +461,25 @@ class WatcherService:
         self._process.terminate()
         self._process.wait(timeout=2)
         self._process = None
+        self._pending.clear()
+
+    def poll_event(self, timeout_seconds: float = 0.0) -> Optional[ChangeEvent]:
+        if self._pending:
+            return self._pending.popleft()
+        line = self._read_line(timeout_seconds)
+        if line is None:
+            return None
+        raw_path, flags = split_watcher_line(line)
+        if "MOVED_FROM" in flags:
+            next_line = self._read_line(_MOVE_PAIR_SECONDS)
+            if next_line is not None:
+                next_path, next_flags = split_watcher_line(next_line)
+                if "MOVED_TO" in next_flags:
+                    return watcher_change_event(self._watched_dir, next_path, next_flags, previous_path=raw_path)
+                self._pending.append(watcher_change_event(self._watched_dir, next_path, next_flags))
+        return watcher_change_event(self._watched_dir, raw_path, flags)
 
-    def poll_event(self, timeout_seconds: float = 0.0) -> Optional[str]:
+    def _read_line(self, timeout_seconds: float) -> Optional[str]:
         if self._process is None or self._process.stdout is None:
             return None
 
@@ -51,9 +489,211 @@ class WatcherService:
 
         line = self._process.stdout.readline()
         if not line:
-            return None
+            raise WatcherFailedError(self._exit_reason())
         return line.strip()
 
-    @property
-    def watched_dir(self) -> str:
-        return self._watched_dir
+    def _exit_reason(self) -> str:
+        process = self._process
+        try:
+            return_code = process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            return "inotifywait zamknal wyjscie"
+        details = ""
+        if process.stderr is not None:
+            lines = [line.strip() for line in process.stderr.read().splitlines() if line.strip()]
+            details = f": {lines[-1]}" if lines else ""
+        return f"inotifywait zakonczony (kod {return_code}){details}"
+
+
+@dataclass(frozen=True)
+class _EntryState:
+    is_dir: bool
+    size: int
+    mtime_ns: int
+    inode: int
+
+
+@dataclass(frozen=True)
+class _DirectoryState:
+    mtime_ns: int
+    entries: Dict[str, _EntryState]
+
+
+class PollingWatcher:
+    name = "poll"
+
+    def __init__(self, watched_dir: str, interval_seconds: float = 2.0, full_scan_seconds: float = 60.0) -> None:
+        self._watched_dir = watched_dir
+        self._interval_seconds = interval_seconds
+        self._full_scan_polls = max(1, round(full_scan_seconds / interval_seconds)) if full_scan_seconds > 0 else 0
+        self._directories: Dict[str, _DirectoryState] = {}
+        self._pending: Deque[ChangeEvent] = deque()
+        self._next_poll: Optional[float] = None
+        self._poll_count = 0
+
+    def start(self) -> None:
+        if self._next_poll is not None:
+            return
+        self._directories.clear()
+        self._track_tree("")
+        self._next_poll = time.monotonic() + self._interval_seconds
+
+    def stop(self) -> None:
+        self._next_poll = None
+        self._directories.clear()
+        self._pending.clear()
+
+    def poll_event(self, timeout_seconds: float = 0.0) -> Optional[ChangeEvent]:
+        if self._pending:
+            return self._pending.popleft()
+        if self._next_poll is None:
+            return None
+        wait_seconds = self._next_poll - time.monotonic()
+        if wait_seconds > timeout_seconds:
+            time.sleep(max(0.0, timeout_seconds))
+            return None
+        time.sleep(max(0.0, wait_seconds))
+        self.poll_once()
+        self._next_poll = time.monotonic() + self._interval_seconds
+        if self._pending:
+            return self._pending.popleft()
+        return None
+
+    def poll_once(self) -> None:
+        self._poll_count += 1
+        full_scan = self._full_scan_polls > 0 and self._poll_count % self._full_scan_polls == 0
+        created: List[Tuple[str, _EntryState, List[Tuple[str, bool]]]] = []
+        deleted: List[Tuple[str, _EntryState]] = []
+        if not os.path.isdir(self._watched_dir):
+            raise WatcherFailedError(f"Katalog obserwowany niedostepny: {self._watched_dir}")
+        for directory in sorted(self._directories):
+            state = self._directories.get(directory)
+            if state is None:
+                continue
+            try:
+                mtime_ns = os.stat(self._absolute(directory)).st_mtime_ns
+            except OSError:
+                continue
+            if full_scan or mtime_ns != state.mtime_ns:
+                self._rescan(directory, state, created, deleted)
+        self._emit_structure_changes(created, deleted)
+
+    def _rescan(
+        self,
+        directory: str,
+        state: _DirectoryState,
+        created: List[Tuple[str, _EntryState, List[Tuple[str, bool]]]],
+        deleted: List[Tuple[str, _EntryState]],
+    ) -> None:
+        scanned = self._scan_directory(directory)
+        if scanned is None:
+            return
+        self._directories[directory] = scanned
+        for name, entry in scanned.entries.items():
+            path = _join_relative(directory, name)
+            previous = state.entries.get(name)
+            if previous is not None and previous.is_dir == entry.is_dir:
+                if not entry.is_dir and (previous.size, previous.mtime_ns) != (entry.size, entry.mtime_ns):
+                    self._pending.append(ChangeEvent(path=path, operation="modify"))
+                continue
+            if previous is not None:
+                deleted.append((path, previous))
+                self._forget_tree(path)
+            created.append((path, entry, self._track_tree(path) if entry.is_dir else []))
+        for name, previous in state.entries.items():
+            if name not in scanned.entries:
+                path = _join_relative(directory, name)
+                deleted.append((path, previous))
+                self._forget_tree(path)
+
+    def _emit_structure_changes(
+        self,
+        created: List[Tuple[str, _EntryState, List[Tuple[str, bool]]]],
+        deleted: List[Tuple[str, _EntryState]],
+    ) -> None:
+        deleted_by_inode = {(entry.inode, entry.is_dir): path for path, entry in deleted}
+        moves = {}
+        for path, entry, _nested in created:
+            previous_path = deleted_by_inode.pop((entry.inode, entry.is_dir), None)
+            if previous_path is not None:
+                moves[path] = previous_path
+        for (_inode, is_dir), path in deleted_by_inode.items():
+            self._pending.append(ChangeEvent(path=path, operation="delete", is_dir=is_dir))
+        for path, entry, nested in created:
+            if path in moves:
+                self._pending.append(
+                    ChangeEvent(path=path, operation="move", is_dir=entry.is_dir, previous_path=moves[path])
+                )
+                continue
+            self._pending.append(ChangeEvent(path=path, operation="create", is_dir=entry.is_dir))
+            for nested_path, nested_is_dir in nested:
+                self._pending.append(ChangeEvent(path=nested_path, operation="create", is_dir=nested_is_dir))
+
+    def _track_tree(self, root: str) -> List[Tuple[str, bool]]:
+        tracked: List[Tuple[str, bool]] = []
+        pending = [root]
+        while pending:
+            directory = pending.pop()
+            state = self._scan_directory(directory)
+            if state is None:
+                continue
+            self._directories[directory] = state
+            for name, entry in sorted(state.entries.items()):
+                path = _join_relative(directory, name)
+                tracked.append((path, entry.is_dir))
+                if entry.is_dir:
+                    pending.append(path)
+        return tracked
+
+    def _forget_tree(self, root: str) -> None:
+        prefix = f"{root}/"
+        for directory in [path for path in self._directories if path == root or path.startswith(prefix)]:
+            del self._directories[directory]
+
+    def _scan_directory(self, directory: str) -> Optional[_DirectoryState]:
+        absolute_path = self._absolute(directory)
+        entries: Dict[str, _EntryState] = {}
+        try:
+            mtime_ns = os.stat(absolute_path).st_mtime_ns
+            with os.scandir(absolute_path) as iterator:
+                for entry in iterator:
+                    try:
+                        if entry.is_symlink():
+                            continue
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                        stat_result = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    entries[entry.name] = _EntryState(
+                        is_dir=is_dir,
+                        size=0 if is_dir else stat_result.st_size,
+                        mtime_ns=0 if is_dir else stat_result.st_mtime_ns,
+                        inode=stat_result.st_ino,
+                    )
+        except OSError:
+            return None
+        return _DirectoryState(mtime_ns=mtime_ns, entries=entries)
+
+    def _absolute(self, directory: str) -> str:
+        return os.path.join(self._watched_dir, directory) if directory else self._watched_dir
+
+
+def _utc_now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def _join_relative(directory: str, name: str) -> str:
+    return f"{directory}/{name}" if directory else name
+
+
+def _load_libc():
+    library_name = ctypes.util.find_library("c") or "libc.so.6"
+    try:
+        libc = ctypes.CDLL(library_name, use_errno=True)
+        functions = (libc.inotify_init1, libc.inotify_add_watch, libc.inotify_rm_watch)
+    except (OSError, AttributeError) as exc:
+        raise WatcherUnavailableError(f"Brak inotify w libc: {exc}") from exc
+    functions[0].argtypes = [ctypes.c_int]
+    functions[1].argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    functions[2].argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
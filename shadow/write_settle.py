@@ -0,0 +1,131 @@
+import os
+import stat
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+
+_PROC_DIR = "/proc"
+_WRITE_ACCESS_FLAGS = os.O_WRONLY | os.O_RDWR
+_WRITER_RECHECK_SECONDS = 0.5
+_MIN_RECHECK_SECONDS = 0.05
+
+
+@dataclass
+class _TrackedFile:
+    signature: Tuple[int, int]
+    settled_since: float
+    open_writers: bool = False
+
+
+class WriteSettleTracker:
+    def __init__(self, master_dir: str, settle_seconds: float, max_wait_seconds: float) -> None:
+        self._master_dir = master_dir
+        self._settle_seconds = max(0.0, settle_seconds)
+        self._max_wait_seconds = max(0.0, max_wait_seconds)
+        self._tracked: Dict[str, Optional[_TrackedFile]] = {}
+
+    @classmethod
+    def from_environment(cls, environment: Mapping[str, str]) -> "WriteSettleTracker":
+        return cls(
+            master_dir=environment.get("CNC_MASTER_DIR", "/var/lib/cnc-control/master"),
+            settle_seconds=float(environment.get("CNC_SHADOW_WRITE_SETTLE_SECONDS", "2")),
+            max_wait_seconds=float(environment.get("CNC_SHADOW_WRITE_SETTLE_MAX_SECONDS", "120")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self._settle_seconds > 0 and self._max_wait_seconds > 0
+
+    @property
+    def max_wait_seconds(self) -> float:
+        return self._max_wait_seconds
+
+    def track(self, paths: Iterable[str]) -> None:
+        for path in paths:
+            if path:
+                self._tracked.setdefault(path, None)
+
+    def clear(self) -> None:
+        self._tracked.clear()
+
+    def pending(self) -> List[str]:
+        now = time.time()
+        settled: Dict[str, Tuple[int, int]] = {}
+        for path in list(self._tracked):
+            try:
+                stat_result = os.stat(os.path.join(self._master_dir, path))
+            except OSError:
+                del self._tracked[path]
+                continue
+            if not stat.S_ISREG(stat_result.st_mode):
+                del self._tracked[path]
+                continue
+            signature = (stat_result.st_size, stat_result.st_mtime_ns)
+            tracked = self._tracked[path]
+            if tracked is None:
+                tracked = _TrackedFile(signature=signature, settled_since=min(now, stat_result.st_mtime))
+                self._tracked[path] = tracked
+            elif tracked.signature != signature:
+                tracked.signature = signature
+                tracked.settled_since = now
+            if now - tracked.settled_since < self._settle_seconds:
+                continue
+            settled[path] = (stat_result.st_dev, stat_result.st_ino)
+        if settled:
+            written_inodes = _inodes_open_for_writing(set(settled.values()))
+            for path, inode in settled.items():
+                tracked = self._tracked[path]
+                tracked.open_writers = inode in written_inodes
+                if not tracked.open_writers:
+                    del self._tracked[path]
+        return sorted(self._tracked)
+
+    def next_check_in(self) -> float:
+        now = time.time()
+        delays = [
+            _WRITER_RECHECK_SECONDS if tracked.open_writers else tracked.settled_since + self._settle_seconds - now
+            for tracked in self._tracked.values()
+            if tracked is not None
+        ]
+        if not delays:
+            return _MIN_RECHECK_SECONDS
+        return max(_MIN_RECHECK_SECONDS, min(delays))
+
+
+def _inodes_open_for_writing(inodes: Set[Tuple[int, int]]) -> Set[Tuple[int, int]]:
+    # PL: Skan /proc/*/fd zamiast dzierzawy F_SETLEASE - zerwanie dzierzawy wysyla SIGIO i zabija proces.
+    # EN: Scan /proc/*/fd instead of an F_SETLEASE lease - a broken lease sends SIGIO and kills the process.
+    found: Set[Tuple[int, int]] = set()
+    try:
+        pids = [entry for entry in os.listdir(_PROC_DIR) if entry.isdigit()]
+    except OSError:
+        return found
+    for pid in pids:
+        fd_dir = os.path.join(_PROC_DIR, pid, "fd")
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                fd_stat = os.stat(os.path.join(fd_dir, fd))
+            except OSError:
+                continue
+            inode = (fd_stat.st_dev, fd_stat.st_ino)
+            if inode in inodes and inode not in found and _fd_open_for_writing(pid, fd):
+                found.add(inode)
+                if found == inodes:
+                    return found
+    return found
+
+
+def _fd_open_for_writing(pid: str, fd: str) -> bool:
+    try:
+        with open(os.path.join(_PROC_DIR, pid, "fdinfo", fd), "r", encoding="ascii") as fdinfo:
+            for line in fdinfo:
+                if line.startswith("flags:"):
+                    return bool(int(line.split()[1], 8) & _WRITE_ACCESS_FLAGS)
+    except (OSError, ValueError, IndexError):
+        return False
+    return False
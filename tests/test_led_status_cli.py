@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import os
+import socket
+import threading
+from pathlib import Path
+
+import pytest
+
+import led_status
+import led_status_cli
+from led_status import LedMode
+from led_status_cli import LedClient
+
+
+def test_client_writes_mode_in_process_and_skips_repeated_modes(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    mode_file = tmp_path / "cnc_led_mode"
+    writes: list[str] = []
+    real_write = led_status_cli._write_mode_atomic
+    monkeypatch.setattr(
+        led_status_cli,
+        "_write_mode_atomic",
+        lambda mode_name, path: writes.append(mode_name) or real_write(mode_name, path),
+    )
+    client = LedClient(str(mode_file), str(tmp_path / "cnc_led.sock"))
+
+    assert client.set_mode("shadow_sync")
+    assert client.flush()
+    assert client.set_mode("SHADOW_SYNC")
+    assert client.set_mode("SHADOW_READY")
+    assert client.flush()
+    assert not client.set_mode("RAINBOW")
+
+    assert writes == ["SHADOW_SYNC", "SHADOW_READY"]
+    assert mode_file.read_text(encoding="utf-8") == "SHADOW_READY\n"
+    assert client.last_mode == "SHADOW_READY"
+
+
+def test_client_uses_fallback_when_mode_file_cannot_be_written(tmp_path: Path) -> None:
+    blocker = tmp_path / "not-a-directory"
+    blocker.write_text("", encoding="utf-8")
+    fallback_calls: list[str] = []
+    client = LedClient(str(blocker / "cnc_led_mode"), str(tmp_path / "cnc_led.sock"))
+
+    client.set_mode("ERROR", fallback=lambda mode_name: fallback_calls.append(mode_name) or False)
+    assert client.flush()
+    assert client.last_mode is None
+
+    client.set_mode("ERROR", fallback=lambda mode_name: fallback_calls.append(mode_name) or True)
+    assert client.flush()
+
+    assert fallback_calls == ["ERROR", "ERROR"]
+    assert client.last_mode == "ERROR"
+
+
+class _RecordingController:
+    def __init__(self) -> None:
+        self.modes: list[LedMode] = []
+        self.changed = threading.Event()
+
+    def set_mode(self, mode: LedMode) -> None:
+        self.modes.append(mode)
+        self.changed.set()
+
+
+def test_daemon_applies_socket_messages_without_polling(tmp_path: Path) -> None:
+    socket_path = str(tmp_path / "cnc_led.sock")
+    mode_socket = led_status._open_mode_socket(socket_path)
+    assert mode_socket is not None
+    controller = _RecordingController()
+    stop_read_fd, stop_write_fd = os.pipe()
+    server = threading.Thread(
+        target=led_status._serve_mode_socket,
+        args=(controller, mode_socket, stop_read_fd),
+        daemon=True,
+    )
+    server.start()
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+        sender.sendto(b"BOGUS", socket_path)
+        sender.sendto(b"usb\n", socket_path)
+    assert controller.changed.wait(2.0)
+    controller.changed.clear()
+    client = LedClient(str(tmp_path / "cnc_led_mode"), socket_path)
+    client.set_mode("ERROR")
+    assert controller.changed.wait(2.0)
+    assert client.flush()
+
+    os.write(stop_write_fd, b"\0")
+    server.join(2.0)
+    mode_socket.close()
+    os.close(stop_read_fd)
+    os.close(stop_write_fd)
+
+    assert not server.is_alive()
+    assert controller.modes == [LedMode.SHADOW_READY, LedMode.ERROR]
+    assert led_status._read_mode_file(str(tmp_path / "cnc_led_mode")) == LedMode.ERROR
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+import pytest
+
+from shadow.capacity import CapacityError, CapacityModel
+from shadow.change_events import ChangeEvent
+from shadow.manifest import ManifestEntry, MasterSnapshot
+from shadow.slot_sizing import SlotSizingPolicy
+
+MB = 1024 * 1024
+
+
+def _model(master_dir: Path, max_files: int = 100) -> CapacityModel:
+    return CapacityModel(str(master_dir), SlotSizingPolicy("fixed", 64), max_files=max_files)
+
+
+def test_upload_admission_rejects_content_exceeding_slot_and_fat_limit(tmp_path: Path) -> None:
+    model = _model(tmp_path)
+    model.sync(MasterSnapshot(files={"programs/big.nc": ManifestEntry(size=40 * MB, mtime_ns=0)}, directories={"programs"}))
+
+    model.check_upload("programs/next.nc", 10 * MB)
+    model.check_upload("programs/big.nc", 60 * MB)
+    with pytest.raises(CapacityError, match="nie miesci sie w slocie 64 MB") as no_space:
+        model.check_upload("programs/next.nc", 30 * MB)
+    with pytest.raises(CapacityError) as too_large:
+        model.check_upload("huge.nc", 5 * 1024 * MB)
+
+    assert no_space.value.code == "ERR_NO_SPACE"
+    assert too_large.value.code == "ERR_FILE_TOO_LARGE"
+
+
+def test_capacity_tracks_changes_incrementally(tmp_path: Path) -> None:
+    model = _model(tmp_path, max_files=2)
+    assert model.status().master_files == 0
+
+    (tmp_path / "programs").mkdir()
+    (tmp_path / "programs" / "a.nc").write_bytes(b"G1\n" * 1000)
+    (tmp_path / "programs" / "b.nc").write_bytes(b"G1\n" * 10)
+    model.apply_change(ChangeEvent(path="programs", operation="move", is_dir=True))
+    status = model.status()
+    assert (status.master_files, status.master_bytes) == (2, 3030)
+    assert 0 < status.slot_used_bytes < status.slot_capacity_bytes
+    with pytest.raises(CapacityError) as too_many:
+        model.check_upload("programs/c.nc", 1)
+    assert too_many.value.code == "ERR_TOO_MANY_FILES"
+
+    (tmp_path / "programs" / "a.nc").unlink()
+    model.apply_change(ChangeEvent(path="programs/a.nc", operation="delete"))
+    assert model.status().master_bytes == 30
+    model.check_upload("programs/c.nc", 1)
+
+
+def test_upload_size_admission_checks_an_unnamed_file_in_the_target_directory(tmp_path: Path) -> None:
+    model = _model(tmp_path)
+    model.sync(MasterSnapshot(files={"programs/big.nc": ManifestEntry(size=40 * MB, mtime_ns=0)}, directories={"programs"}))
+
+    model.check_upload_size("programs", 10 * MB)
+    with pytest.raises(CapacityError, match="nie miesci sie w slocie 64 MB"):
+        model.check_upload_size("programs", 30 * MB)
+    with pytest.raises(CapacityError, match="Plik uploadu") as too_large:
+        model.check_upload_size("", 5 * 1024 * MB)
+
+    assert too_large.value.code == "ERR_FILE_TOO_LARGE"
+    assert model.status().master_files == 1
+
+
+def test_disk_admission_requires_room_for_slot_images(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    model = _model(tmp_path)
+    monkeypatch.setattr(CapacityModel, "_available_disk_bytes", staticmethod(lambda _path: 150 * MB))
+
+    with pytest.raises(CapacityError, match="wymagane 134.4 MB"):
+        model.check_upload("part.nc", 20 * MB, image_dir=str(tmp_path))
+    model.check_rebuild(MasterSnapshot(), SlotSizingPolicy("fixed", 64).choose(MasterSnapshot()), str(tmp_path))
+    assert model.status(image_dir=str(tmp_path)).disk_required_bytes == 2 * 64 * MB + 64 * MB // 10
+
+
+def test_disk_admission_credits_space_held_by_existing_slot_images(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    master_dir = tmp_path / "master"
+    master_dir.mkdir()
+    model = _model(master_dir)
+    slot_a = tmp_path / "cnc_usb_a.img"
+    slot_b = tmp_path / "cnc_usb_b.img"
+    slot_paths = [str(slot_a), str(slot_b)]
+    with open(slot_a, "wb") as slot_handle:
+        os.posix_fallocate(slot_handle.fileno(), 0, 48 * MB)
+
+    status = model.status(image_dir=str(tmp_path), slot_paths=slot_paths)
+    assert status.disk_available_bytes == os.statvfs(tmp_path).f_bavail * os.statvfs(tmp_path).f_frsize
+    assert status.disk_required_bytes == (2 * 64 - 48) * MB + 64 * MB // 10
+
+    for slot_path in (slot_a, slot_b):
+        with open(slot_path, "ab") as slot_handle:
+            os.posix_fallocate(slot_handle.fileno(), 0, 64 * MB)
+    assert model.status(image_dir=str(tmp_path), slot_paths=slot_paths).disk_required_bytes == 64 * MB + 64 * MB // 10
+
+    monkeypatch.setattr(CapacityModel, "_available_disk_bytes", staticmethod(lambda _path: 100 * MB))
+    model.check_upload("part.nc", 20 * MB, image_dir=str(tmp_path), slot_paths=slot_paths)
+    model.check_rebuild(MasterSnapshot(), SlotSizingPolicy("fixed", 64).choose(MasterSnapshot()), str(tmp_path), slot_paths)
+    with pytest.raises(CapacityError, match="wymagane 134.4 MB"):
+        model.check_upload("part.nc", 20 * MB, image_dir=str(tmp_path))
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+from shadow.change_events import ChangeEvent, ChangeSet, split_watcher_line, watcher_change_event
+
+
+def _change_set(*events: ChangeEvent) -> ChangeSet:
+    change_set = ChangeSet()
+    for event in events:
+        change_set.add(event)
+    return change_set
+
+
+def test_change_set_collapses_transient_files_and_resolves_rename_chains() -> None:
+    change_set = _change_set(
+        ChangeEvent(path="tmp.nc", operation="create"),
+        ChangeEvent(path="tmp.nc", operation="modify"),
+        ChangeEvent(path="tmp.nc", operation="delete"),
+        ChangeEvent(path="part.nc", operation="move", previous_path="draft.nc"),
+        ChangeEvent(path="final.nc", operation="move", previous_path="part.nc"),
+        ChangeEvent(path="new.nc", operation="create"),
+        ChangeEvent(path="new.nc", operation="modify"),
+        ChangeEvent(path="programs/new.nc", operation="move", previous_path="new.nc"),
+        ChangeEvent(path="old.nc", operation="delete"),
+        ChangeEvent(path="old.nc", operation="create"),
+        ChangeEvent(path="gone.nc", operation="move", previous_path="kept.nc"),
+        ChangeEvent(path="gone.nc", operation="delete"),
+    )
+
+    assert change_set.to_dict() == {
+        "events": 12,
+        "full_rescan": False,
+        "created": ["programs/new.nc"],
+        "modified": ["old.nc"],
+        "deleted": ["kept.nc"],
+        "renamed": [{"from": "draft.nc", "to": "final.nc"}],
+        "truncated": False,
+    }
+
+
+def test_change_set_moves_nested_records_with_directory_and_truncates_history() -> None:
+    change_set = _change_set(
+        ChangeEvent(path="programs/a.nc", operation="create"),
+        ChangeEvent(path="programs/b.nc", operation="modify"),
+        ChangeEvent(path="archive", operation="move", previous_path="programs", is_dir=True),
+        ChangeEvent(path="", operation="modify"),
+    )
+
+    payload = change_set.to_dict(limit=2)
+    assert change_set.full_rescan
+    assert payload["created"] == ["archive/a.nc"]
+    assert payload["modified"] == ["archive/b.nc"]
+    assert payload["renamed"] == []
+    assert payload["truncated"]
+    assert change_set.paths == {"archive/a.nc", "archive/b.nc", "archive", "programs"}
+
+
+def test_unpaired_watcher_moves_become_create_and_delete() -> None:
+    raw_path, flags = split_watcher_line("/master/programs/in.nc:MOVED_TO")
+
+    assert watcher_change_event("/master", raw_path, flags).operation == "create"
+    assert watcher_change_event("/master", "/master/out.nc", {"MOVED_FROM"}).operation == "delete"
+    assert watcher_change_event("/master", "/master", {"Q_OVERFLOW"}).path == ""
@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import pytest
+
+from shadow.debounce import AdaptiveDebouncer
+
+
+def _debouncer() -> AdaptiveDebouncer:
+    return AdaptiveDebouncer(
+        quiet_seconds=4.0,
+        min_quiet_seconds=1.0,
+        max_latency_seconds=30.0,
+        min_interval_seconds=15.0,
+    )
+
+
+def test_single_event_waits_only_minimum_quiet_window() -> None:
+    debouncer = _debouncer()
+    debouncer.record_event(100.0)
+
+    assert debouncer.deadline() == pytest.approx(101.0)
+    assert debouncer.finish_burst() == "quiet"
+
+
+def test_quiet_window_follows_event_rate_within_bounds() -> None:
+    debouncer = _debouncer()
+    for index in range(5):
+        debouncer.record_event(100.0 + index * 0.1)
+    assert debouncer.quiet_window() == pytest.approx(1.0)
+
+    slow = _debouncer()
+    for index in range(5):
+        slow.record_event(100.0 + index * 2.5)
+    assert slow.quiet_window() == pytest.approx(4.0)
+    assert slow.event_count == 5
+
+
+def test_steady_trickle_is_capped_by_max_latency() -> None:
+    debouncer = _debouncer()
+    for index in range(40):
+        debouncer.record_event(100.0 + index * 0.9)
+
+    assert debouncer.deadline() == pytest.approx(130.0)
+    assert debouncer.finish_burst() == "max_latency"
+
+
+def test_minimum_interval_delays_rebuild_after_publish() -> None:
+    debouncer = _debouncer()
+    debouncer.mark_published(100.0)
+    debouncer.record_event(102.0)
+
+    assert debouncer.deadline() == pytest.approx(115.0)
+    assert debouncer.finish_burst() == "rate_limited"
+
+    debouncer.record_event(200.0)
+    assert debouncer.deadline() == pytest.approx(201.0)
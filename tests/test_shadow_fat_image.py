@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import io
+from pathlib import Path
+
+import pytest
+
+from shadow.fat_image import FAT16, FAT32, FatImageError, FatImageReader, FatImageWriter, compute_geometry
+
+
+def build_image(master_dir: Path, size_mb: int, fat_type: int) -> io.BytesIO:
+    image = io.BytesIO()
+    FatImageWriter(str(master_dir), size_mb * 1024 * 1024, "CNC_USB", fat_type=fat_type).write(image)
+    return image
+
+
+@pytest.mark.parametrize(("fat_type", "size_mb"), [(FAT32, 64), (FAT16, 32)])
+def test_writer_round_trips_tree_with_long_names(tmp_path: Path, fat_type: int, size_mb: int) -> None:
+    master_dir = tmp_path / "master"
+    (master_dir / "Operator 1" / "deep").mkdir(parents=True)
+    payloads = {
+        "PART1.NC": b"G0 X0\n" * 10,
+        "lower.nc": b"G1 X1\n",
+        "Operator 1/Plyta bok lewy.gcode": bytes(range(256)) * 300,
+        "Operator 1/deep/empty.nc": b"",
+    }
+    for relative_path, payload in payloads.items():
+        (master_dir / relative_path).write_bytes(payload)
+
+    image = build_image(master_dir, size_mb, fat_type)
+
+    assert len(image.getvalue()) == size_mb * 1024 * 1024
+    reader = FatImageReader(image)
+    assert reader.geometry.fat_type == fat_type
+    entries = {path: (is_dir, cluster, size) for path, is_dir, cluster, size in reader.iter_entries()}
+    assert entries["Operator 1"][0] is True
+    for relative_path, payload in payloads.items():
+        is_dir, cluster, size = entries[relative_path]
+        assert is_dir is False
+        assert reader.read_file(cluster, size) == payload
+
+
+def test_writer_allocates_each_file_contiguously(tmp_path: Path) -> None:
+    master_dir = tmp_path / "master"
+    master_dir.mkdir()
+    for index in range(5):
+        (master_dir / f"program_{index}.nc").write_bytes(b"G1\n" * (3000 + index * 700))
+
+    reader = FatImageReader(build_image(master_dir, 64, FAT32))
+
+    for _path, _is_dir, cluster, _size in reader.iter_entries():
+        chain = reader.cluster_chain(cluster)
+        assert chain == list(range(chain[0], chain[0] + len(chain)))
+
+
+def test_writer_rejects_names_differing_only_by_case(tmp_path: Path) -> None:
+    master_dir = tmp_path / "master"
+    master_dir.mkdir()
+    (master_dir / "part.nc").write_bytes(b"a")
+    (master_dir / "PART.NC").write_bytes(b"b")
+
+    with pytest.raises(FatImageError, match="Konflikt nazw"):
+        build_image(master_dir, 64, FAT32)
+
+
+def test_compute_geometry_rejects_fat32_below_minimum_cluster_count() -> None:
+    with pytest.raises(FatImageError, match="za maly dla FAT32"):
+        compute_geometry(16 * 1024 * 1024, fat_type=FAT32, sectors_per_cluster=8)
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+from shadow.history_log import INDEX_SUFFIX, HistoryLog
+
+
+def test_appends_rotate_by_size_and_latest_reads_across_segments(tmp_path: Path) -> None:
+    history_file = tmp_path / "shadow_history.jsonl"
+    log = HistoryLog(str(history_file), max_bytes=4096, backups=2)
+
+    for run_id in range(1, 201):
+        log.append({"run_id": run_id, "result": "ok", "trigger": "auto", "note": "x" * 40})
+
+    segments = log.segments()
+    assert segments == [str(history_file), f"{history_file}.1", f"{history_file}.2"]
+    assert all(Path(segment).stat().st_size <= 4096 for segment in segments)
+    assert [entry["run_id"] for entry in log.latest(3)] == [200, 199, 198]
+
+    retained = log.latest(1000)
+    assert [entry["run_id"] for entry in retained] == list(range(200, 200 - len(retained), -1))
+    assert len(retained) < 200
+
+    (Path(str(history_file) + INDEX_SUFFIX)).write_bytes(b"\xff" * 8)
+    assert [entry["run_id"] for entry in HistoryLog(str(history_file)).latest(2)] == [200, 199]
+
+
+def test_torn_tail_is_trimmed_and_legacy_json_list_is_migrated(tmp_path: Path) -> None:
+    legacy_file = tmp_path / "shadow_history.json"
+    legacy_file.write_text(json.dumps([{"run_id": 1}, {"run_id": 2}]), encoding="utf-8")
+    history_file = tmp_path / "shadow_history.jsonl"
+
+    log = HistoryLog(str(history_file))
+    log.prepare()
+    assert not legacy_file.exists()
+    assert [entry["run_id"] for entry in log.latest(5)] == [2, 1]
+
+    with open(history_file, "ab") as history_handle:
+        history_handle.write(b'{"run_id": 3, "res')
+    assert [entry["run_id"] for entry in HistoryLog(str(history_file)).latest(5)] == [2, 1]
+
+    reopened = HistoryLog(str(history_file))
+    reopened.append({"run_id": 4})
+    assert history_file.read_text(encoding="utf-8").splitlines() == [
+        '{"seq": 1, "run_id": 1}',
+        '{"seq": 2, "run_id": 2}',
+        '{"seq": 3, "run_id": 4}',
+    ]
+    assert Path(str(history_file) + INDEX_SUFFIX).stat().st_size == 3 * 8
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import io
+from pathlib import Path
+
+import pytest
+
+from shadow.change_events import ChangeEvent
+from shadow.fat_image import FatImageReader, FatImageWriter
+from shadow.ignore_rules import IgnoreRules
+from shadow.manifest import scan_master
+from shadow.watcher_service import WatcherService
+
+
+class _QueuedWatcher:
+    name = "poll"
+
+    def __init__(self, events: list[ChangeEvent]) -> None:
+        self._events = list(events)
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+    def poll_event(self, timeout_seconds: float = 0.0):
+        return self._events.pop(0) if self._events else None
+
+
+def _build_master(master_dir: Path) -> None:
+    (master_dir / "op1" / "scratch").mkdir(parents=True)
+    (master_dir / ".Trashes").mkdir()
+    for relative_path in (
+        "part.nc",
+        "upload.nc.part",
+        "~$notes.docx",
+        "Thumbs.db",
+        "op1/FINAL.NC",
+        "op1/draft.bak",
+        "op1/scratch/trial.nc",
+        ".Trashes/old.nc",
+    ):
+        (master_dir / relative_path).write_text("G0\n", encoding="utf-8")
+    (master_dir / "op1" / ".cncignore").write_text("# robocze\n*.bak\nscratch/\n", encoding="utf-8")
+
+
+def test_rules_combine_global_patterns_with_per_directory_files(tmp_path: Path) -> None:
+    _build_master(tmp_path)
+    rules = IgnoreRules.from_environment({"CNC_MASTER_DIR": str(tmp_path)})
+
+    assert rules.is_ignored("upload.nc.part")
+    assert rules.is_ignored("OLD.TMP")
+    assert rules.is_ignored(".Trashes/old.nc")
+    assert rules.is_ignored("op1/draft.bak")
+    assert rules.is_ignored("op1/scratch/trial.nc")
+    assert rules.is_ignored("op1/.cncignore")
+    assert not rules.is_ignored("draft.bak")
+    assert not rules.is_ignored("op1/FINAL.NC")
+
+    (tmp_path / "op1" / ".cncignore").write_text("/FINAL.NC\n", encoding="utf-8")
+    assert rules.is_ignored("op1/final.nc")
+    assert not rules.is_ignored("op1/draft.bak")
+
+    custom = IgnoreRules.from_environment(
+        {"CNC_MASTER_DIR": str(tmp_path), "CNC_SHADOW_IGNORE_PATTERNS": "*.bak", "CNC_SHADOW_IGNORE_FILE": ""}
+    )
+    assert custom.is_ignored("draft.bak")
+    assert not custom.is_ignored("upload.nc.part")
+    with pytest.raises(ValueError):
+        IgnoreRules.from_environment({"CNC_SHADOW_IGNORE_FILE": "op1/.cncignore"})
+
+
+def test_scan_and_native_image_skip_ignored_entries(tmp_path: Path) -> None:
+    _build_master(tmp_path)
+    rules = IgnoreRules(str(tmp_path))
+
+    snapshot = scan_master(str(tmp_path), rules)
+    image = io.BytesIO()
+    FatImageWriter(str(tmp_path), 64 * 1024 * 1024, "CNC_USB", ignore_rules=rules).write(image)
+    image_paths = {path for path, _is_dir, _cluster, _size in FatImageReader(image).iter_entries()}
+
+    assert set(snapshot.files) == {"part.nc", "op1/FINAL.NC"}
+    assert snapshot.directories == {"op1"}
+    assert "op1/scratch" in snapshot.ignored
+    assert image_paths == {"part.nc", "op1", "op1/FINAL.NC"}
+
+
+def test_watcher_drops_junk_events_and_rescans_on_rule_changes(tmp_path: Path, monkeypatch) -> None:
+    events = [
+        ChangeEvent(path="~$notes.docx", operation="create"),
+        ChangeEvent(path="part.nc.part", operation="modify"),
+        ChangeEvent(path="part.nc", operation="move", previous_path="part.nc.part"),
+        ChangeEvent(path="old.tmp", operation="move", previous_path="old.nc"),
+        ChangeEvent(path=".Trashes/old.nc", operation="delete"),
+        ChangeEvent(path="op1/.cncignore", operation="modify"),
+    ]
+    monkeypatch.setattr(WatcherService, "_candidates", lambda self: [_QueuedWatcher(events)])
+    watcher = WatcherService(str(tmp_path), backend="poll", ignore_rules=IgnoreRules(str(tmp_path)))
+    watcher.start()
+
+    received = []
+    while True:
+        event = watcher.poll_event()
+        if event is None:
+            break
+        received.append((event.operation, event.path))
+
+    assert received == [("create", "part.nc"), ("delete", "old.nc"), ("modify", "")]
@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+from shadow.image_clone import clone_file, preallocate_fd, stream_file
+
+
+def test_clone_file_copies_full_image(tmp_path: Path) -> None:
+    source_path = tmp_path / "template.img"
+    with source_path.open("wb") as source_handle:
+        source_handle.write(b"\xeb\x58\x90MSWIN4.1")
+        source_handle.seek(3 * 1024 * 1024 - 4)
+        source_handle.write(b"TAIL")
+    target_path = tmp_path / "slot_a.img.tmp"
+    target_path.write_bytes(b"stale data that must disappear" * 100000)
+
+    method = clone_file(str(source_path), str(target_path))
+
+    assert method in {"reflink", "copy_file_range", "copy"}
+    assert target_path.read_bytes() == source_path.read_bytes()
+
+
+def test_preallocate_fd_skips_empty_size(tmp_path: Path) -> None:
+    image_path = tmp_path / "slot.img"
+    with image_path.open("wb") as image_handle:
+        assert preallocate_fd(image_handle.fileno(), 0) is False
+    assert os.path.getsize(image_path) == 0
+
+
+def test_stream_file_copies_only_data_segments(tmp_path: Path) -> None:
+    source_path = tmp_path / "staging.img"
+    with source_path.open("wb") as source_handle:
+        source_handle.write(b"BOOT")
+        source_handle.seek(8 * 1024 * 1024)
+        source_handle.write(b"DATA")
+        source_handle.truncate(16 * 1024 * 1024)
+    target_path = tmp_path / "slot_a.img.tmp"
+
+    written = stream_file(str(source_path), str(target_path))
+
+    assert 8 <= written < 16 * 1024 * 1024
+    assert target_path.read_bytes() == source_path.read_bytes()
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from shadow.capacity import CapacityError
+from shadow.luns import LunConfigError, ShadowLunGroup, load_lun_configs
+from shadow.usb_manager import MultiLunExport, UsbManager
+
+
+class _FakeUsbManager:
+    def __init__(self) -> None:
+        self.loaded = False
+        self.exports: list[list[str]] = []
+
+    def is_exporting(self) -> bool:
+        return self.loaded
+
+    def stop_export(self) -> bool:
+        self.loaded = False
+        return True
+
+    def start_export(self, image_paths) -> bool:
+        self.exports.append(list(image_paths))
+        self.loaded = True
+        return True
+
+
+class _RecordingManager:
+    def __init__(self) -> None:
+        self.changes: list[tuple[str, str]] = []
+        self.uploads: list[tuple[str, int]] = []
+
+    def notify_change(self, path: str, operation: str, size=None) -> None:
+        self.changes.append((path, operation))
+
+    def check_upload(self, path: str, size: int) -> None:
+        self.uploads.append((path, size))
+
+
+def test_lun_configs_validate_names_and_overlay_environment(tmp_path: Path) -> None:
+    base = {
+        "CNC_MASTER_DIR": str(tmp_path / "master"),
+        "CNC_SHADOW_LUN_DIR": str(tmp_path / "luns"),
+        "CNC_SHADOW_LOCK_FILE": "/var/run/cnc-shadow.lock",
+        "CNC_SHADOW_TEMPLATE_DIR": str(tmp_path / "templates"),
+        "CNC_SHADOW_LUNS": " op1, op2 ",
+    }
+
+    luns = load_lun_configs(base)
+    environment = luns[1].environment(base)
+
+    assert [lun.name for lun in luns] == ["op1", "op2"]
+    assert environment["CNC_MASTER_DIR"] == str(tmp_path / "master" / "op2")
+    assert environment["CNC_USB_IMG_B"] == str(tmp_path / "luns" / "op2" / "cnc_usb_b.img")
+    assert environment["CNC_SHADOW_LOCK_FILE"] == "/var/run/cnc-shadow-op2.lock"
+    assert environment["CNC_SHADOW_TEMPLATE_DIR"] == str(tmp_path / "templates" / "op2")
+    assert environment["CNC_USB_LABEL"] == "OP2"
+    assert "CNC_SHADOW_STAGING_DIR" not in environment
+    assert load_lun_configs({"CNC_SHADOW_LUNS": ""}) == []
+    with pytest.raises(LunConfigError, match="Zduplikowana"):
+        load_lun_configs({"CNC_SHADOW_LUNS": "op1,OP1"})
+    with pytest.raises(LunConfigError, match="Nieprawidlowa nazwa"):
+        load_lun_configs({"CNC_SHADOW_LUNS": "op1,../etc"})
+
+
+def test_usb_manager_exports_all_luns_in_one_module_load(monkeypatch: pytest.MonkeyPatch) -> None:
+    commands: list[list[str]] = []
+    usb_manager = UsbManager.from_environment({})
+    monkeypatch.setattr(usb_manager, "_resolve_binary", lambda name: name)
+    monkeypatch.setattr(usb_manager, "_wait_for_module_state", lambda expect_loaded, timeout_seconds: True)
+    monkeypatch.setattr(
+        usb_manager,
+        "_run_root_command",
+        lambda command: commands.append(command) or subprocess.CompletedProcess(command, 0),
+    )
+
+    assert usb_manager.start_export(["/luns/op1/a.img", "/luns/op2/b.img"])
+
+    assert commands == [
+        [
+            "modprobe",
+            "g_mass_storage",
+            "file=/luns/op1/a.img,/luns/op2/b.img",
+            "luns=2",
+            "ro=1,1",
+            "removable=1,1",
+        ]
+    ]
+
+
+def test_multi_lun_export_restarts_module_with_current_slot_of_every_lun(tmp_path: Path) -> None:
+    op1_image = tmp_path / "op1_a.img"
+    op2_image = tmp_path / "op2_b.img"
+    op1_image.write_bytes(b"\0")
+    op2_image.write_bytes(b"\0")
+    usb_manager = _FakeUsbManager()
+    export = MultiLunExport(usb_manager, ["op1", "op2"])
+    export.register("op1", str(op1_image))
+    export.register("op2", str(tmp_path / "missing.img"))
+
+    assert export.lun("op1").stop_export()
+    assert export.lun("op2").start_export(str(op2_image))
+
+    assert usb_manager.exports == [[str(op1_image), str(op2_image)]]
+    with pytest.raises(ValueError):
+        export.lun("op3")
+
+
+def test_lun_group_routes_changes_and_uploads_by_subdirectory(tmp_path: Path) -> None:
+    environment = {
+        "CNC_MASTER_DIR": str(tmp_path / "master"),
+        "CNC_SHADOW_LUNS": "op1,op2",
+    }
+    op1 = _RecordingManager()
+    op2 = _RecordingManager()
+    group = ShadowLunGroup(
+        master_dir=environment["CNC_MASTER_DIR"],
+        luns=load_lun_configs(environment),
+        managers={"op1": op1, "op2": op2},
+        export=MultiLunExport(_FakeUsbManager(), ["op1", "op2"]),
+        environment=environment,
+    )
+
+    group.notify_change(str(tmp_path / "master" / "op2" / "part.nc"), "create")
+    group.notify_change(str(tmp_path / "master" / "loose.nc"), "create")
+    group.check_upload(str(tmp_path / "master" / "op1" / "part.nc"), 10)
+    with pytest.raises(CapacityError, match="poza katalogami LUN"):
+        group.check_upload(str(tmp_path / "master" / "loose.nc"), 10)
+
+    assert op1.changes == []
+    assert op2.changes == [(str(tmp_path / "master" / "op2" / "part.nc"), "create")]
+    assert op1.uploads == [(str(tmp_path / "master" / "op1" / "part.nc"), 10)]
@@ -0,0 +1,341 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from shadow.change_events import ChangeEvent, parse_watcher_event
+from shadow.debounce import AdaptiveDebouncer
+from shadow.rebuild_engine import RebuildCancelled, RebuildReport
+from shadow.shadow_manager import ShadowManager
+import shadow.write_settle as write_settle_module
+from shadow.write_settle import WriteSettleTracker
+
+
+class _FakeUsbManager:
+    def __init__(self) -> None:
+        self.exported: list[str] = []
+
+    def stop_export(self) -> bool:
+        return True
+
+    def start_export(self, image_path: str) -> bool:
+        self.exported.append(image_path)
+        return True
+
+
+class _BlockingRebuildEngine:
+    def __init__(self, master_dir: str) -> None:
+        self.master_dir = master_dir
+        self.started = threading.Event()
+        self.calls = 0
+
+    def rebuild(self, rebuild_slot_path, source_slot_path=None, cancel_event=None) -> RebuildReport:
+        self.calls += 1
+        if self.calls == 1:
+            self.started.set()
+            assert cancel_event is not None
+            assert cancel_event.wait(timeout=5.0)
+            raise RebuildCancelled("Przebudowa przerwana: nowe zmiany w CNC_MASTER_DIR.")
+        return RebuildReport(mode="full", reason=None, changes=1, slot_size_mb=32)
+
+
+class _AlwaysPreemptedEngine:
+    def __init__(self) -> None:
+        self.started = threading.Event()
+        self.preemptible_calls = 0
+
+    def rebuild(self, rebuild_slot_path, source_slot_path=None, cancel_event=None) -> RebuildReport:
+        if cancel_event is None:
+            return RebuildReport(mode="full", reason=None, changes=1, slot_size_mb=32)
+        self.preemptible_calls += 1
+        self.started.set()
+        assert cancel_event.wait(timeout=5.0)
+        raise RebuildCancelled("Przebudowa przerwana: nowe zmiany w CNC_MASTER_DIR.")
+
+
+def _make_manager(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> ShadowManager:
+    monkeypatch.setattr(ShadowManager, "_set_led_mode", lambda self, mode_name: True)
+    master_dir = tmp_path / "master"
+    master_dir.mkdir()
+    return ShadowManager.from_environment(
+        {
+            "CNC_MASTER_DIR": str(master_dir),
+            "CNC_USB_IMG_A": str(tmp_path / "cnc_usb_a.img"),
+            "CNC_USB_IMG_B": str(tmp_path / "cnc_usb_b.img"),
+            "CNC_ACTIVE_SLOT_FILE": str(tmp_path / "active_slot.state"),
+            "CNC_SHADOW_STATE_FILE": str(tmp_path / "shadow_state.json"),
+            "CNC_SHADOW_HISTORY_FILE": str(tmp_path / "shadow_history.jsonl"),
+            "CNC_SHADOW_MANIFEST_FILE": str(tmp_path / "shadow_manifest.json"),
+            "CNC_SHADOW_LOCK_FILE": str(tmp_path / "shadow.lock"),
+            "CNC_SHADOW_DEBOUNCE_SECONDS": "0",
+        }
+    )
+
+
+def test_change_during_build_preempts_cycle_before_export(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    manager = _make_manager(tmp_path, monkeypatch)
+    engine = _BlockingRebuildEngine(str(tmp_path / "master"))
+    usb_manager = _FakeUsbManager()
+    manager._rebuild_engine = engine
+    manager._usb_manager = usb_manager
+
+    worker = threading.Thread(target=manager._run_rebuild_cycle, args=("manual", False))
+    worker.start()
+    assert engine.started.wait(timeout=5.0)
+    manager.notify_change(str(tmp_path / "master" / "part.nc"), "create", size=120)
+    worker.join(timeout=5.0)
+
+    assert usb_manager.exported == []
+    assert manager.get_rebuild_history(1)[0]["result"] == "preempted"
+    assert manager._state_store.load_or_initialize().fsm_state == "IDLE"
+    assert manager._next_change(timeout_seconds=0) == ChangeEvent(
+        path="part.nc",
+        operation="create",
+        size=120,
+        source="webui",
+    )
+
+    assert manager._run_rebuild_cycle(trigger="watch", mark_lock_conflict_error=True)
+    latest = manager.get_rebuild_history(1)[0]
+    assert latest["result"] == "ok"
+    assert latest["preempted_runs"] == 1
+    assert usb_manager.exported == [str(tmp_path / "cnc_usb_b.img")]
+
+
+def test_repeated_preemptions_end_in_non_preemptible_max_latency_build(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    manager = _make_manager(tmp_path, monkeypatch)
+    engine = _AlwaysPreemptedEngine()
+    manager._rebuild_engine = engine
+    manager._usb_manager = _FakeUsbManager()
+    manager._debouncer = AdaptiveDebouncer(
+        quiet_seconds=0.2,
+        min_quiet_seconds=0.2,
+        max_latency_seconds=1.0,
+        min_interval_seconds=0.0,
+    )
+
+    event = ChangeEvent(path="part1.nc", operation="create")
+    reasons = []
+    for index in range(20):
+        meta = manager._wait_for_debounce(event)
+        reasons.append(meta["debounce_reason"])
+        if meta["debounce_reason"] == "max_latency":
+            break
+        engine.started.clear()
+        worker = threading.Thread(
+            target=manager._run_rebuild_cycle,
+            args=("watch", True),
+            kwargs={"debounce_meta": meta, "change_set": meta["change_set"]},
+        )
+        worker.start()
+        assert engine.started.wait(timeout=5.0)
+        time.sleep(0.1)
+        manager._enqueue_change(ChangeEvent(path=f"part{index + 2}.nc", operation="create"))
+        worker.join(timeout=5.0)
+        event = manager._next_change(timeout_seconds=0)
+
+    assert reasons[-1] == "max_latency"
+    assert len(reasons) >= 3
+    assert manager._run_rebuild_cycle(
+        "watch",
+        True,
+        preemptible=False,
+        debounce_meta=meta,
+        change_set=meta["change_set"],
+    )
+    latest = manager.get_rebuild_history(1)[0]
+    assert latest["result"] == "ok"
+    assert latest["preempted_runs"] == engine.preemptible_calls == len(reasons) - 1
+
+
+def test_watcher_echo_of_webui_change_is_not_queued_twice(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    manager = _make_manager(tmp_path, monkeypatch)
+    master_dir = str(tmp_path / "master")
+    (tmp_path / "master" / "programs").mkdir()
+    (tmp_path / "master" / "programs" / "part.nc").write_bytes(b"G" * 42)
+
+    manager.notify_change("programs/part.nc", "modify", size=42)
+    manager._enqueue_change(parse_watcher_event(f"{master_dir}/programs/part.nc:CLOSE_WRITE,CLOSE", master_dir))
+    manager._enqueue_change(parse_watcher_event(f"{master_dir}/programs/other.nc:DELETE", master_dir))
+
+    queued = [manager._next_change(timeout_seconds=0), manager._next_change(timeout_seconds=0)]
+    assert [event.describe() for event in queued] == [
+        "webui:modify:programs/part.nc (42 B)",
+        "watcher:delete:programs/other.nc",
+    ]
+    assert manager._next_change(timeout_seconds=0) is None
+    with pytest.raises(ValueError):
+        manager.notify_change("/etc/passwd", "delete")
+
+
+def test_only_matching_watcher_echo_is_suppressed_once(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    manager = _make_manager(tmp_path, monkeypatch)
+    master_dir = str(tmp_path / "master")
+    part = tmp_path / "master" / "part.nc"
+    part.write_bytes(b"G0 X0\n")
+
+    manager.notify_change(str(part), "create", size=6)
+    manager._enqueue_change(parse_watcher_event(f"{master_dir}/part.nc:CREATE", master_dir))
+    manager._enqueue_change(parse_watcher_event(f"{master_dir}/part.nc:CLOSE_WRITE,CLOSE", master_dir))
+    manager._enqueue_change(parse_watcher_event(f"{master_dir}/part.nc:CLOSE_WRITE,CLOSE", master_dir))
+
+    manager.notify_change(str(part), "modify", size=6)
+    manager._enqueue_change(parse_watcher_event(f"{master_dir}/part.nc:DELETE", master_dir))
+    manager.notify_change(str(part), "modify", size=6)
+    part.write_bytes(b"G0 X0 Y0 Z0\n")
+    manager._enqueue_change(parse_watcher_event(f"{master_dir}/part.nc:CLOSE_WRITE,CLOSE", master_dir))
+
+    part.unlink()
+    manager.notify_change(str(part), "delete")
+    manager._enqueue_change(parse_watcher_event(f"{master_dir}/part.nc:DELETE", master_dir))
+
+    queued = []
+    while (event := manager._next_change(timeout_seconds=0)) is not None:
+        queued.append(event.describe())
+    assert queued == [
+        "webui:create:part.nc (6 B)",
+        "watcher:modify:part.nc",
+        "webui:modify:part.nc (6 B)",
+        "watcher:delete:part.nc",
+        "webui:modify:part.nc (6 B)",
+        "watcher:modify:part.nc",
+        "webui:delete:part.nc",
+    ]
+
+
+def test_change_set_of_preempted_cycle_is_carried_into_next_history_entry(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    manager = _make_manager(tmp_path, monkeypatch)
+    engine = _BlockingRebuildEngine(str(tmp_path / "master"))
+    manager._rebuild_engine = engine
+    manager._usb_manager = _FakeUsbManager()
+    first = manager._wait_for_debounce(ChangeEvent(path="draft.nc", operation="create"))
+
+    worker = threading.Thread(
+        target=manager._run_rebuild_cycle,
+        args=("watch", True),
+        kwargs={"debounce_meta": first, "change_set": first["change_set"]},
+    )
+    worker.start()
+    assert engine.started.wait(timeout=5.0)
+    manager._enqueue_change(ChangeEvent(path="part.nc", operation="move", previous_path="draft.nc"))
+    worker.join(timeout=5.0)
+    second = manager._wait_for_debounce(manager._next_change(timeout_seconds=0))
+
+    assert manager._run_rebuild_cycle("watch", True, debounce_meta=second, change_set=second["change_set"])
+    preempted, latest = manager.get_rebuild_history(2)[1], manager.get_rebuild_history(2)[0]
+    assert preempted["result"] == "preempted"
+    assert preempted["changes"]["created"] == ["draft.nc"]
+    assert latest["changes"]["created"] == ["part.nc"]
+    assert latest["changes"]["events"] == 2
+
+
+def test_rebuild_waits_until_uploaded_file_is_closed_and_stable(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    manager = _make_manager(tmp_path, monkeypatch)
+    master_dir = tmp_path / "master"
+    manager._write_settle = WriteSettleTracker(str(master_dir), settle_seconds=0.2, max_wait_seconds=5.0)
+    upload = open(master_dir / "big.nc", "w", encoding="utf-8")
+    upload.write("G0 X0\n")
+    upload.flush()
+    closed = threading.Event()
+
+    def finish_upload() -> None:
+        time.sleep(0.3)
+        upload.write("G1 X1\n")
+        upload.close()
+        closed.set()
+
+    writer = threading.Thread(target=finish_upload)
+    writer.start()
+    meta = manager._wait_for_debounce(ChangeEvent(path="big.nc", operation="create"))
+    writer.join()
+
+    assert closed.is_set()
+    assert meta["settle_ms"] >= 300
+    assert meta["unsettled_paths"] == []
+
+    manager._write_settle = WriteSettleTracker(str(master_dir), settle_seconds=0.2, max_wait_seconds=0.3)
+    with open(master_dir / "big.nc", "a", encoding="utf-8"):
+        capped = manager._wait_for_debounce(ChangeEvent(path="big.nc", operation="modify"))
+
+    assert capped["unsettled_paths"] == ["big.nc"]
+    assert capped["settle_ms"] < 1000
+
+
+
+def test_writer_opening_file_during_probe_is_detected_without_signals(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    upload_path = tmp_path / "big.nc"
+    upload_path.write_text("G0 X0\n", encoding="utf-8")
+    old_time = time.time() - 60
+    os.utime(upload_path, (old_time, old_time))
+    tracker = WriteSettleTracker(str(tmp_path), settle_seconds=0.2, max_wait_seconds=5.0)
+    tracker.track(["big.nc"])
+    writers = []
+    real_listdir = write_settle_module.os.listdir
+
+    def listdir_opening_writer(path):
+        if path == "/proc" and not writers:
+            writers.append(open(upload_path, "a", encoding="utf-8"))
+        return real_listdir(path)
+
+    monkeypatch.setattr(write_settle_module.os, "listdir", listdir_opening_writer)
+    try:
+        assert tracker.pending() == ["big.nc"]
+    finally:
+        writers[0].close()
+    monkeypatch.setattr(write_settle_module.os, "listdir", real_listdir)
+
+    assert tracker.pending() == []
+
+
+def test_rebuild_cycle_publishes_fsm_transitions_and_history_entry(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    manager = _make_manager(tmp_path, monkeypatch)
+    engine = _BlockingRebuildEngine(str(tmp_path / "master"))
+    engine.calls = 1
+    manager._rebuild_engine = engine
+    manager._usb_manager = _FakeUsbManager()
+    subscription = manager.subscribe_events()
+
+    assert manager._run_rebuild_cycle(trigger="manual", mark_lock_conflict_error=False)
+    events = []
+    while (event := subscription.get(timeout_seconds=0)) is not None:
+        events.append(event)
+    subscription.close()
+
+    assert [event.payload["fsm_state"] for event in events if event.event_type == "state"] == [
+        "CHANGE_DETECTED",
+        "BUILD_SLOT_B",
+        "EXPORT_STOP",
+        "EXPORT_START",
+        "READY",
+    ]
+    assert events[-1].event_type == "history"
+    assert events[-1].payload["result"] == "ok"
+    assert [event.event_id for event in events] == sorted(event.event_id for event in events)
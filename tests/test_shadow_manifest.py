@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+from shadow.manifest import ContentManifest
+
+
+def make_manifest(tmp_path: Path) -> tuple[ContentManifest, Path]:
+    master_dir = tmp_path / "master"
+    master_dir.mkdir()
+    return ContentManifest(str(master_dir), str(tmp_path / "manifest.json")), master_dir
+
+
+def test_first_check_reports_change_without_hashing(tmp_path: Path) -> None:
+    manifest, master_dir = make_manifest(tmp_path)
+    (master_dir / "part.nc").write_bytes(b"G0 X0\n")
+
+    content_check = manifest.check()
+
+    assert content_check.changed is True
+    assert content_check.hashed_files == 0
+
+
+def test_rewrite_with_identical_bytes_is_not_a_change(tmp_path: Path) -> None:
+    manifest, master_dir = make_manifest(tmp_path)
+    program = master_dir / "part.nc"
+    program.write_bytes(b"G0 X0\n")
+    manifest.commit(manifest.check())
+
+    program.write_bytes(b"G0 X1\n")
+    os.utime(program, ns=(1_000_000_000, 1_000_000_000))
+    content_check = manifest.check()
+    assert content_check.changed is True
+    manifest.commit(content_check)
+
+    program.write_bytes(b"G0 X1\n")
+    os.utime(program, ns=(2_000_000_000, 2_000_000_000))
+    content_check = manifest.check()
+
+    assert content_check.changed is False
+    assert content_check.hashed_files == 1
+
+
+def test_unchanged_stat_skips_hashing(tmp_path: Path) -> None:
+    manifest, master_dir = make_manifest(tmp_path)
+    (master_dir / "sub").mkdir()
+    (master_dir / "sub" / "part.nc").write_bytes(b"G0 X0\n")
+    manifest.commit(manifest.check())
+
+    content_check = manifest.check()
+
+    assert content_check.changed is False
+    assert content_check.hashed_files == 0
+
+
+def test_removed_directory_is_a_change(tmp_path: Path) -> None:
+    manifest, master_dir = make_manifest(tmp_path)
+    (master_dir / "old").mkdir()
+    manifest.commit(manifest.check())
+
+    (master_dir / "old").rmdir()
+
+    assert manifest.check().changed is True
@@ -1,10 +1,14 @@
 from __future__ import annotations
 
+import threading
+import time
 from pathlib import Path
 
 import pytest
 
-from shadow.rebuild_engine import RebuildConfig, RebuildEngine, RebuildError
+from shadow.fat_image import FatImageReader
+from shadow.manifest import scan_master
+from shadow.rebuild_engine import RebuildCancelled, RebuildConfig, RebuildEngine, RebuildError
 
 
 def test_from_environment_uses_default_usb_label() -> None:
@@ -17,6 +21,38 @@ def test_from_environment_rejects_too_long_usb_label() -> None:
         RebuildEngine.from_environment({"CNC_USB_LABEL": "TOO_LONG_LABEL"})
 
 
+def test_from_environment_rejects_unknown_image_builder() -> None:
+    with pytest.raises(RebuildError, match="CNC_SHADOW_IMAGE_BUILDER"):
+        RebuildEngine.from_environment({"CNC_SHADOW_IMAGE_BUILDER": "mkisofs"})
+
+
+def test_full_rebuild_native_builder_writes_readable_image(tmp_path: Path) -> None:
+    master_dir = tmp_path / "master"
+    (master_dir / "programs").mkdir(parents=True)
+    (master_dir / "programs" / "Frez plyty.nc").write_bytes(b"G1 X10 Y10\n" * 50)
+    target_path = tmp_path / "slot_a.img"
+
+    engine = RebuildEngine(
+        RebuildConfig(
+            master_dir=str(master_dir),
+            slot_size_mb=64,
+            tmp_suffix=".tmp",
+            usb_label="CNC_A11",
+        )
+    )
+    stats = engine.full_rebuild(str(target_path))
+
+    assert {"scan", "write", "fsync", "publish"} <= set(stats.phases_ms)
+    assert (stats.files_copied, stats.bytes_copied) == (1, len(b"G1 X10 Y10\n" * 50))
+    assert target_path.stat().st_size == 64 * 1024 * 1024
+    assert not (tmp_path / "slot_a.img.tmp").exists()
+    with target_path.open("rb") as image_handle:
+        reader = FatImageReader(image_handle)
+        entries = {path: (cluster, size) for path, _is_dir, cluster, size in reader.iter_entries()}
+        cluster, size = entries["programs/Frez plyty.nc"]
+        assert reader.read_file(cluster, size) == b"G1 X10 Y10\n" * 50
+
+
 def test_full_rebuild_passes_usb_label_to_mkfs(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
     commands: list[list[str]] = []
 
@@ -40,6 +76,7 @@ def test_full_rebuild_passes_usb_label_to_mkfs(tmp_path: Path, monkeypatch: pyte
             slot_size_mb=256,
             tmp_suffix=".tmp",
             usb_label="CNC_A11",
+            image_builder="mtools",
         )
     )
     engine.full_rebuild(str(target_path))
@@ -49,3 +86,308 @@ def test_full_rebuild_passes_usb_label_to_mkfs(tmp_path: Path, monkeypatch: pyte
     assert "-n" in commands[1]
     label_index = commands[1].index("-n") + 1
     assert commands[1][label_index] == "CNC_A11"
+
+
+def _make_incremental_engine(tmp_path: Path, master_dir: Path) -> RebuildEngine:
+    return RebuildEngine(
+        RebuildConfig(
+            master_dir=str(master_dir),
+            slot_size_mb=1,
+            tmp_suffix=".tmp",
+            usb_label="CNC_USB",
+            incremental=True,
+            image_builder="mtools",
+        )
+    )
+
+
+def _record_commands(monkeypatch: pytest.MonkeyPatch) -> list[list[str]]:
+    commands: list[list[str]] = []
+
+    def fake_run_command(command, error_message: str) -> None:
+        del error_message
+        commands.append(list(command))
+        if Path(command[0]).name == "truncate":
+            Path(command[-1]).write_bytes(b"")
+
+    monkeypatch.setattr(RebuildEngine, "_run_command", staticmethod(fake_run_command))
+    monkeypatch.setattr(RebuildEngine, "_has_binary", staticmethod(lambda _name: True))
+    monkeypatch.setattr(RebuildEngine, "_fsync_path", staticmethod(lambda _path: None))
+    return commands
+
+
+def test_rebuild_falls_back_to_full_without_source_manifest(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    commands = _record_commands(monkeypatch)
+    master_dir = tmp_path / "master"
+    master_dir.mkdir()
+    (master_dir / "part.nc").write_text("G0 X0\n", encoding="utf-8")
+    source_slot = tmp_path / "slot_a.img"
+    source_slot.write_bytes(b"\0" * 1024 * 1024)
+
+    engine = _make_incremental_engine(tmp_path, master_dir)
+    report = engine.rebuild(str(tmp_path / "slot_b.img"), str(source_slot))
+
+    assert report.mode == "full"
+    assert report.reason == "missing_source_manifest"
+    assert commands[1][0].endswith("mkfs.vfat")
+    assert (tmp_path / "slot_b.img.manifest.json").is_file()
+
+
+def test_rebuild_applies_only_delta_from_published_slot(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    commands = _record_commands(monkeypatch)
+    master_dir = tmp_path / "master"
+    (master_dir / "old").mkdir(parents=True)
+    (master_dir / "keep.nc").write_text("G0 X0\n" * 100, encoding="utf-8")
+    (master_dir / "old" / "a.nc").write_text("G0 X1\n", encoding="utf-8")
+    source_slot = tmp_path / "slot_a.img"
+    source_slot.write_bytes(b"\0" * 1024 * 1024)
+
+    engine = _make_incremental_engine(tmp_path, master_dir)
+    published = scan_master(str(master_dir))
+    engine._write_slot_manifest(str(source_slot), published, engine._sizing.choose(published))
+
+    (master_dir / "old" / "a.nc").unlink()
+    (master_dir / "old").rmdir()
+    (master_dir / "new").mkdir()
+    (master_dir / "new" / "b.nc").write_text("G1 X2\n", encoding="utf-8")
+
+    target_slot = tmp_path / "slot_b.img"
+    report = engine.rebuild(str(target_slot), str(source_slot))
+
+    assert report.mode == "incremental"
+    assert report.changes == 4
+    assert (report.stats.files_copied, report.stats.bytes_copied) == (1, len("G1 X2\n"))
+    assert {"clone", "delta", "fsync", "publish", "manifest"} <= set(report.stats.phases_ms)
+    assert [Path(command[0]).name for command in commands] == ["mdeltree", "mmd", "mcopy"]
+    assert commands[0][-1] == "::/old"
+    assert commands[1][-1] == "::/new"
+    assert commands[2][-2:] == [str(master_dir / "new" / "b.nc"), "::/new/"]
+    assert target_slot.read_bytes() == source_slot.read_bytes()
+
+
+def test_mtools_builder_clones_template_until_label_changes(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    commands: list[list[str]] = []
+
+    def fake_run_command(command, error_message: str) -> None:
+        del error_message
+        commands.append(list(command))
+        if Path(command[0]).name == "truncate":
+            with open(command[-1], "wb") as image_handle:
+                image_handle.truncate(1024 * 1024)
+
+    monkeypatch.setattr(RebuildEngine, "_run_command", staticmethod(fake_run_command))
+    monkeypatch.setattr(RebuildEngine, "_fsync_path", staticmethod(lambda _path: None))
+    master_dir = tmp_path / "master"
+    master_dir.mkdir()
+    template_dir = tmp_path / "templates"
+
+    def make_engine(usb_label: str) -> RebuildEngine:
+        return RebuildEngine(
+            RebuildConfig(
+                master_dir=str(master_dir),
+                slot_size_mb=1,
+                tmp_suffix=".tmp",
+                usb_label=usb_label,
+                image_builder="mtools",
+                template_dir=str(template_dir),
+            )
+        )
+
+    engine = make_engine("CNC_A11")
+    engine.full_rebuild(str(tmp_path / "slot_a.img"))
+    engine.full_rebuild(str(tmp_path / "slot_b.img"))
+
+    mkfs_commands = [command for command in commands if Path(command[0]).name == "mkfs.vfat"]
+    assert len(mkfs_commands) == 1
+    assert (tmp_path / "slot_b.img").stat().st_size == 1024 * 1024
+    assert (tmp_path / "slot_b.img").read_bytes()[67:71] != b"\0\0\0\0"
+    assert len(list(template_dir.iterdir())) == 1
+
+    make_engine("CNC_B22").full_rebuild(str(tmp_path / "slot_a.img"))
+
+    mkfs_commands = [command for command in commands if Path(command[0]).name == "mkfs.vfat"]
+    assert len(mkfs_commands) == 2
+    assert mkfs_commands[1][mkfs_commands[1].index("-n") + 1] == "CNC_B22"
+    assert len(list(template_dir.iterdir())) == 1
+
+
+def test_rebuild_auto_sizing_shrinks_native_image(tmp_path: Path) -> None:
+    master_dir = tmp_path / "master"
+    master_dir.mkdir()
+    (master_dir / "part.nc").write_bytes(b"G1 X1\n" * 1000)
+    source_slot = tmp_path / "slot_a.img"
+    with source_slot.open("wb") as image_handle:
+        image_handle.truncate(1024 * 1024 * 1024)
+    target_path = tmp_path / "slot_b.img"
+
+    engine = RebuildEngine.from_environment(
+        {
+            "CNC_MASTER_DIR": str(master_dir),
+            "CNC_SHADOW_SLOT_SIZE_MB": "1024",
+            "CNC_SHADOW_SLOT_SIZING": "auto",
+            "CNC_SHADOW_FAT_TYPE": "auto",
+        }
+    )
+    report = engine.rebuild(str(target_path), str(source_slot))
+
+    assert report.slot_size_mb == 32
+    assert target_path.stat().st_size == 32 * 1024 * 1024
+    with target_path.open("rb") as image_handle:
+        reader = FatImageReader(image_handle)
+        assert reader.geometry.fat_type == 16
+        entries = {path: (cluster, size) for path, _is_dir, cluster, size in reader.iter_entries()}
+        assert reader.read_file(*entries["part.nc"]) == b"G1 X1\n" * 1000
+
+
+def test_cancellable_command_kills_subprocess_when_changes_arrive() -> None:
+    cancel_event = threading.Event()
+    threading.Timer(0.3, cancel_event.set).start()
+    started = time.monotonic()
+
+    with pytest.raises(RebuildCancelled, match="sleep"):
+        RebuildEngine._run_cancellable_command(["sleep", "30"], "Nie udalo sie.", cancel_event)
+
+    assert time.monotonic() - started < 5.0
+
+
+def test_rebuild_cancelled_before_publish_keeps_previous_slot(tmp_path: Path) -> None:
+    master_dir = tmp_path / "master"
+    master_dir.mkdir()
+    (master_dir / "part.nc").write_bytes(b"G1 X1\n" * 1000)
+    target_path = tmp_path / "slot_b.img"
+    target_path.write_bytes(b"previous image")
+    cancel_event = threading.Event()
+    cancel_event.set()
+
+    engine = RebuildEngine(
+        RebuildConfig(master_dir=str(master_dir), slot_size_mb=64, tmp_suffix=".tmp", usb_label="CNC_USB")
+    )
+    with pytest.raises(RebuildCancelled):
+        engine.rebuild(str(target_path), cancel_event=cancel_event)
+
+    assert target_path.read_bytes() == b"previous image"
+    assert not (tmp_path / "slot_b.img.tmp").exists()
+
+
+def test_full_rebuild_stages_image_in_memory_and_streams_to_slot(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    master_dir = tmp_path / "master"
+    master_dir.mkdir()
+    (master_dir / "part.nc").write_bytes(b"G1 X1\n" * 1000)
+    staging_dir = tmp_path / "shm"
+    target_path = tmp_path / "slot_a.img"
+    monkeypatch.setattr(RebuildEngine, "_available_memory_bytes", staticmethod(lambda: 512 * 1024 * 1024))
+
+    engine = RebuildEngine(
+        RebuildConfig(
+            master_dir=str(master_dir),
+            slot_size_mb=64,
+            tmp_suffix=".tmp",
+            usb_label="CNC_USB",
+            staging_dir=str(staging_dir),
+        )
+    )
+    stats = engine.full_rebuild(str(target_path))
+
+    assert stats.build_location == "staging"
+    assert stats.staging_fallback is None
+    assert "stream" in stats.phases_ms
+    assert list(staging_dir.iterdir()) == []
+    assert target_path.stat().st_size == 64 * 1024 * 1024
+    with target_path.open("rb") as image_handle:
+        reader = FatImageReader(image_handle)
+        entries = {path: (cluster, size) for path, _is_dir, cluster, size in reader.iter_entries()}
+        assert reader.read_file(*entries["part.nc"]) == b"G1 X1\n" * 1000
+
+
+def test_full_rebuild_skips_staging_when_memory_is_low(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    master_dir = tmp_path / "master"
+    master_dir.mkdir()
+    (master_dir / "part.nc").write_bytes(b"G1 X1\n" * 1000)
+    staging_dir = tmp_path / "shm"
+    target_path = tmp_path / "slot_a.img"
+    monkeypatch.setattr(RebuildEngine, "_available_memory_bytes", staticmethod(lambda: 32 * 1024 * 1024))
+
+    engine = RebuildEngine(
+        RebuildConfig(
+            master_dir=str(master_dir),
+            slot_size_mb=64,
+            tmp_suffix=".tmp",
+            usb_label="CNC_USB",
+            staging_dir=str(staging_dir),
+            staging_min_free_mb=64,
+        )
+    )
+    stats = engine.full_rebuild(str(target_path))
+
+    assert (stats.build_location, stats.staging_fallback) == ("direct", "low_memory")
+    assert "stream" not in stats.phases_ms
+    assert not staging_dir.exists()
+    assert target_path.stat().st_size == 64 * 1024 * 1024
+
+
+def test_mtools_read_optimized_layout_copies_in_fat_order(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    commands = _record_commands(monkeypatch)
+    master_dir = tmp_path / "master"
+    (master_dir / "b_dir" / "nested").mkdir(parents=True)
+    (master_dir / "A_dir").mkdir()
+    (master_dir / "b_dir" / "nested" / "deep.nc").write_text("G1\n")
+    (master_dir / "b_dir" / "z.nc").write_text("G1\n")
+    (master_dir / "b_dir" / "Y.nc").write_text("G1\n")
+    (master_dir / "root.nc").write_text("G1\n")
+
+    engine = RebuildEngine(
+        RebuildConfig(
+            master_dir=str(master_dir),
+            slot_size_mb=64,
+            tmp_suffix=".tmp",
+            usb_label="CNC_USB",
+            image_builder="mtools",
+            template_dir=None,
+            layout_policy="read_optimized",
+        )
+    )
+    engine.full_rebuild(str(tmp_path / "slot_a.img"))
+
+    copy_commands = [command for command in commands if Path(command[0]).name in {"mmd", "mcopy"}]
+    assert [Path(command[0]).name for command in copy_commands] == ["mmd", "mcopy", "mcopy", "mcopy"]
+    assert copy_commands[0][3:] == ["::/A_dir", "::/b_dir", "::/b_dir/nested"]
+    assert [Path(path).name for path in copy_commands[1][4:-1]] == ["root.nc"]
+    assert [Path(path).name for path in copy_commands[2][4:-1]] == ["Y.nc", "z.nc"]
+    assert copy_commands[2][-1] == "::/b_dir/"
+    assert copy_commands[3][-1] == "::/b_dir/nested/"
+
+
+def test_current_layout_is_read_from_source_slot_manifest(tmp_path: Path) -> None:
+    master_dir = tmp_path / "master"
+    master_dir.mkdir()
+    (master_dir / "part.nc").write_bytes(b"G1\n" * 100)
+    source_slot = tmp_path / "slot_a.img"
+    engine = RebuildEngine(
+        RebuildConfig(
+            master_dir=str(master_dir),
+            slot_size_mb=64,
+            tmp_suffix=".tmp",
+            usb_label="CNC_USB",
+            layout_policy="read_optimized",
+        )
+    )
+    snapshot = scan_master(str(master_dir))
+    published = engine._sizing.choose(snapshot)
+    engine._write_slot_manifest(str(source_slot), snapshot, published)
+
+    assert engine._current_layout(str(source_slot)) is None
+    with source_slot.open("wb") as slot_handle:
+        slot_handle.truncate(64 * 1024 * 1024)
+    assert engine._current_layout(str(source_slot)) == published
+    assert engine._current_layout(None) is None
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import pytest
+
+from shadow.fat_image import FAT16, FAT32
+from shadow.manifest import ManifestEntry, MasterSnapshot
+from shadow.slot_sizing import SlotCapacityError, SlotLayout, SlotSizingPolicy
+
+
+def _snapshot(file_count: int, file_size: int) -> MasterSnapshot:
+    return MasterSnapshot(
+        files={f"programs/part_{index:03d}.nc": ManifestEntry(size=file_size, mtime_ns=0) for index in range(file_count)},
+        directories={"programs"},
+    )
+
+
+def test_auto_sizing_picks_smallest_class_with_headroom() -> None:
+    snapshot = _snapshot(file_count=100, file_size=200_000)
+
+    assert SlotSizingPolicy("auto", 1024, fat_type="32").choose(snapshot).size_mb == 64
+    layout = SlotSizingPolicy("auto", 1024, fat_type="auto").choose(snapshot)
+    assert (layout.size_mb, layout.fat_type, layout.sectors_per_cluster) == (32, FAT16, 4)
+
+    grown = SlotSizingPolicy("auto", 1024, fat_type="auto").choose(_snapshot(file_count=100, file_size=4_000_000))
+    assert (grown.size_mb, grown.fat_type) == (512, FAT32)
+
+
+def test_auto_sizing_keeps_current_class_until_content_shrinks_enough() -> None:
+    policy = SlotSizingPolicy("auto", 1024, fat_type="32")
+    snapshot = _snapshot(file_count=100, file_size=200_000)
+
+    assert policy.choose(snapshot, current_size_mb=128).size_mb == 128
+    assert policy.choose(snapshot, current_size_mb=256).size_mb == 256
+    assert policy.choose(snapshot, current_size_mb=1024).size_mb == 64
+
+
+def test_sizing_rejects_content_larger_than_slot() -> None:
+    snapshot = _snapshot(file_count=20, file_size=4_000_000)
+
+    with pytest.raises(SlotCapacityError, match="przekracza maksymalny rozmiar slotu 64 MB"):
+        SlotSizingPolicy("auto", 64).choose(snapshot)
+    with pytest.raises(SlotCapacityError, match="nie miesci sie w slocie 64 MB"):
+        SlotSizingPolicy("fixed", 64).choose(snapshot)
+    assert SlotSizingPolicy("fixed", 128).choose(snapshot).sectors_per_cluster is None
+
+
+def test_read_optimized_layout_uses_large_clusters_for_large_programs() -> None:
+    large_programs = _snapshot(file_count=40, file_size=2_000_000)
+    layout = SlotSizingPolicy("fixed", 512, fat_type="auto", layout_policy="read_optimized").choose(large_programs)
+    assert (layout.fat_type, layout.sectors_per_cluster) == (FAT16, 64)
+
+    small_programs = _snapshot(file_count=400, file_size=700)
+    layout = SlotSizingPolicy("fixed", 512, fat_type="32", layout_policy="read_optimized").choose(small_programs)
+    assert (layout.fat_type, layout.sectors_per_cluster) == (FAT32, 1)
+
+
+def _programs_with_small_files(small_count: int) -> MasterSnapshot:
+    snapshot = _snapshot(file_count=40, file_size=2_000_000)
+    snapshot.files.update(
+        {f"programs/sub_{index:03d}.nc": ManifestEntry(size=100, mtime_ns=0) for index in range(small_count)}
+    )
+    return snapshot
+
+
+def test_read_optimized_layout_keeps_current_cluster_size_within_hysteresis() -> None:
+    policy = SlotSizingPolicy("fixed", 512, fat_type="auto", layout_policy="read_optimized")
+    large_clusters = SlotLayout(size_mb=512, fat_type=FAT16, sectors_per_cluster=64)
+    small_clusters = SlotLayout(size_mb=512, fat_type=FAT16, sectors_per_cluster=32)
+
+    assert policy.choose(_programs_with_small_files(250)) == small_clusters
+    assert policy.choose(_programs_with_small_files(250), current_layout=large_clusters) == large_clusters
+    assert policy.choose(_programs_with_small_files(350), current_layout=large_clusters) == small_clusters
+
+    assert policy.choose(_programs_with_small_files(150)) == large_clusters
+    assert policy.choose(_programs_with_small_files(150), current_layout=small_clusters) == small_clusters
+    assert policy.choose(_programs_with_small_files(0), current_layout=small_clusters) == large_clusters
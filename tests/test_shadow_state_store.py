@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import pytest
+
+import shadow.state_store as state_store_module
+from shadow.state_store import StateStore
+
+
+def test_only_durable_transitions_are_fsynced(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    synced: list[int] = []
+    real_fsync = state_store_module.os.fsync
+    monkeypatch.setattr(state_store_module.os, "fsync", lambda fd: synced.append(fd) or real_fsync(fd))
+    store = StateStore(str(tmp_path / "shadow_state.json"))
+    state = store.load_or_initialize()
+    synced.clear()
+
+    durable_steps = []
+    for fsm_state, run_id, active_slot in (
+        ("CHANGE_DETECTED", 0, "A"),
+        ("BUILD_SLOT_B", 1, "A"),
+        ("EXPORT_STOP", 1, "A"),
+        ("EXPORT_START", 1, "A"),
+        ("READY", 1, "B"),
+    ):
+        state.fsm_state = fsm_state
+        state.run_id = state.rebuild_counter = run_id
+        state.active_slot = active_slot
+        before = len(synced)
+        store.save(state)
+        durable_steps.append((fsm_state, len(synced) > before))
+
+    assert durable_steps == [
+        ("CHANGE_DETECTED", False),
+        ("BUILD_SLOT_B", True),
+        ("EXPORT_STOP", False),
+        ("EXPORT_START", False),
+        ("READY", True),
+    ]
+    assert json.loads((tmp_path / "shadow_state.json").read_text(encoding="utf-8"))["fsm_state"] == "READY"
+
+
+def test_state_is_served_from_memory_as_independent_copies(tmp_path: Path) -> None:
+    state_file = tmp_path / "shadow_state.json"
+    store = StateStore(str(state_file))
+    state = store.load_or_initialize()
+    state.fsm_state = "ERROR"
+    state.last_error = {"code": "ERR_NO_SPACE", "message": "brak miejsca"}
+    store.save(state)
+    state_file.write_text("{}", encoding="utf-8")
+
+    current = store.current()
+    current.last_error["code"] = "ERR_CHANGED"
+
+    assert store.current().fsm_state == "ERROR"
+    assert store.current().last_error == {"code": "ERR_NO_SPACE", "message": "brak miejsca"}
+    assert StateStore(str(state_file)).load_or_initialize().fsm_state == "IDLE"
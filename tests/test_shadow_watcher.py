@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+import shadow.watcher_service as watcher_module
+from shadow.watcher_service import (
+    IN_Q_OVERFLOW,
+    InotifyWatcher,
+    PollingWatcher,
+    WatcherService,
+    WatcherUnavailableError,
+)
+
+
+def _drain(watcher, polls: int = 5) -> list:
+    events = []
+    for _ in range(polls):
+        while True:
+            event = watcher.poll_event(timeout_seconds=0.2)
+            if event is None:
+                break
+            events.append(event)
+    return events
+
+
+def test_native_watcher_follows_new_subdirectories(tmp_path: Path) -> None:
+    watcher = WatcherService(str(tmp_path), backend="inotify")
+    watcher.start()
+    try:
+        assert watcher.backend == "inotify"
+        nested = tmp_path / "programs" / "op1"
+        nested.mkdir(parents=True)
+        (nested / "early.nc").write_text("G0\n", encoding="utf-8")
+        _drain(watcher, polls=1)
+        (nested / "late.nc").write_text("G1\n", encoding="utf-8")
+        (nested / "early.nc").unlink()
+
+        events = _drain(watcher)
+    finally:
+        watcher.stop()
+
+    described = {(event.path, event.operation) for event in events}
+    assert ("programs/op1/late.nc", "modify") in described
+    assert ("programs/op1/early.nc", "delete") in described
+    assert all(event.timestamp > 0 for event in events)
+
+
+def test_native_watcher_pairs_renames_into_one_record(tmp_path: Path) -> None:
+    (tmp_path / "programs").mkdir()
+    (tmp_path / "programs" / "old.nc").write_text("G0\n", encoding="utf-8")
+    watcher = WatcherService(str(tmp_path), backend="inotify")
+    watcher.start()
+    try:
+        (tmp_path / "programs" / "old.nc").rename(tmp_path / "programs" / "new.nc")
+        (tmp_path / "programs").rename(tmp_path / "archive")
+        (tmp_path / "archive" / "next.nc").write_text("G1\n", encoding="utf-8")
+        events = _drain(watcher)
+    finally:
+        watcher.stop()
+
+    assert [(event.operation, event.previous_path, event.path) for event in events if event.operation == "move"] == [
+        ("move", "programs/old.nc", "programs/new.nc"),
+        ("move", "programs", "archive"),
+    ]
+    assert ("archive/next.nc", "modify") in {(event.path, event.operation) for event in events}
+
+
+def test_native_watcher_reports_overflow_as_full_rescan(tmp_path: Path) -> None:
+    watcher = InotifyWatcher(str(tmp_path))
+    watcher.start()
+    try:
+        watcher._handle_event(-1, IN_Q_OVERFLOW, "")
+        event = watcher.poll_event()
+    finally:
+        watcher.stop()
+
+    assert event.path == ""
+    assert event.operation == "modify"
+
+
+def test_watcher_falls_back_to_inotifywait_when_native_backend_is_unavailable(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    started = []
+
+    def unavailable():
+        raise WatcherUnavailableError("Brak inotify w libc")
+
+    monkeypatch.setattr(watcher_module, "_load_libc", unavailable)
+    monkeypatch.setattr(watcher_module.InotifywaitWatcher, "start", lambda self: started.append(self))
+
+    watcher = WatcherService(str(tmp_path), backend="auto")
+    watcher.start()
+
+    assert watcher.backend == "inotifywait"
+    assert len(started) == 1
+    with pytest.raises(WatcherUnavailableError):
+        WatcherService(str(tmp_path), backend="inotify").start()
+
+
+def test_polling_watcher_diffs_cached_stat_snapshot(tmp_path: Path) -> None:
+    (tmp_path / "programs").mkdir()
+    (tmp_path / "programs" / "part.nc").write_text("G0\n", encoding="utf-8")
+    (tmp_path / "programs" / "old.nc").write_text("G0\n", encoding="utf-8")
+    (tmp_path / "stale.nc").write_text("G0\n", encoding="utf-8")
+    watcher = PollingWatcher(str(tmp_path), interval_seconds=0.01, full_scan_seconds=0.02)
+    watcher.start()
+
+    (tmp_path / "programs" / "old.nc").rename(tmp_path / "programs" / "new.nc")
+    (tmp_path / "jobs" / "op1").mkdir(parents=True)
+    (tmp_path / "jobs" / "op1" / "first.nc").write_text("G1\n", encoding="utf-8")
+    (tmp_path / "stale.nc").unlink()
+    watcher.poll_once()
+    structural = _drain(watcher, polls=1)
+
+    (tmp_path / "programs" / "part.nc").write_text("G0\nG1\n", encoding="utf-8")
+    watcher.poll_once()
+    content = _drain(watcher, polls=1)
+    watcher.stop()
+
+    assert {(event.operation, event.previous_path, event.path) for event in structural} == {
+        ("move", "programs/old.nc", "programs/new.nc"),
+        ("create", None, "jobs"),
+        ("create", None, "jobs/op1"),
+        ("create", None, "jobs/op1/first.nc"),
+        ("delete", None, "stale.nc"),
+    }
+    assert [(event.operation, event.path) for event in content] == [("modify", "programs/part.nc")]
+
+
+def test_auto_backend_falls_back_to_polling_without_inotify_tools(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def unavailable():
+        raise WatcherUnavailableError("Brak inotify w libc")
+
+    def missing_binary(self):
+        raise FileNotFoundError("inotifywait")
+
+    monkeypatch.setattr(watcher_module, "_load_libc", unavailable)
+    monkeypatch.setattr(watcher_module.InotifywaitWatcher, "start", missing_binary)
+
+    watcher = WatcherService(str(tmp_path), backend="auto", poll_interval_seconds=0.01)
+    watcher.start()
+    (tmp_path / "part.nc").write_text("G0\n", encoding="utf-8")
+    events = _drain(watcher, polls=2)
+    backend = watcher.backend
+    watcher.stop()
+
+    assert backend == "poll"
+    assert [(event.operation, event.path) for event in events] == [("create", "part.nc")]
+    with pytest.raises(FileNotFoundError):
+        WatcherService(str(tmp_path), backend="inotifywait").start()
+
+
+def test_failed_watcher_is_restarted_with_backoff_and_reconciliation_scan(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    class _CrashingWatcher:
+        name = "inotifywait"
+
+        def start(self) -> None:
+            pass
+
+        def stop(self) -> None:
+            pass
+
+        def poll_event(self, timeout_seconds: float = 0.0):
+            raise watcher_module.WatcherFailedError("inotifywait zakonczony (kod 1)")
+
+    monkeypatch.setattr(watcher_module, "_RESTART_BACKOFF_INITIAL_SECONDS", 0.1)
+    monkeypatch.setattr(WatcherService, "_candidates", lambda self: [_CrashingWatcher()])
+    watcher = WatcherService(str(tmp_path), backend="inotifywait")
+    watcher.start()
+
+    assert watcher.poll_event(timeout_seconds=0.0) is None
+    first_delay = watcher.status()["restart_in_s"]
+    assert watcher.status()["state"] == "restarting"
+    rescan = watcher.poll_event(timeout_seconds=1.0)
+    assert watcher.poll_event(timeout_seconds=0.0) is None
+
+    status = watcher.status()
+    assert rescan is not None and rescan.path == ""
+    assert status["restarts"] == 1
+    assert status["last_error"] == "inotifywait zakonczony (kod 1)"
+    assert status["restart_in_s"] > first_delay
@@ -0,0 +1,277 @@
+from __future__ import annotations
+
+import importlib.util
+import io
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+from shadow.history_log import HistoryLog
+from shadow.history_stats import HistoryStats, summarize_samples
+from shadow.luns import ShadowLunGroup, load_lun_configs
+from shadow.state_store import ShadowState
+from shadow.usb_manager import MultiLunExport
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+WEBUI_DIR = REPO_ROOT / "webui"
+
+if str(WEBUI_DIR) not in sys.path:
+    sys.path.insert(0, str(WEBUI_DIR))
+
+
+def load_module(module_path: Path, module_name: str):
+    spec = importlib.util.spec_from_file_location(module_name, module_path)
+    if spec is None or spec.loader is None:
+        raise RuntimeError(f"Cannot load module: {module_path}")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+webui_app = load_module(WEBUI_DIR / "app.py", "webui_app_for_shadow_tests")
+
+
+class _RecordingManager:
+    def __init__(self) -> None:
+        self.changes: list[tuple[str, str, int | None]] = []
+
+    def notify_change(self, path: str, operation: str, size: int | None = None) -> None:
+        self.changes.append((path, operation, size))
+
+
+def test_upload_and_delete_notify_shadow_manager(tmp_path: Path, monkeypatch) -> None:
+    manager = _RecordingManager()
+    monkeypatch.setattr(webui_app, "SHADOW_MASTER_DIR", str(tmp_path))
+    monkeypatch.setattr(webui_app, "get_shadow_manager_instance", lambda: manager)
+    client = webui_app.app.test_client()
+
+    client.post(
+        "/upload",
+        data={"dir": "", "file": (io.BytesIO(b"G0 X0\n"), "part.nc")},
+        content_type="multipart/form-data",
+    )
+    client.post(
+        "/upload",
+        data={"dir": "", "file": (io.BytesIO(b"G0 X1 Y1\n"), "part.nc")},
+        content_type="multipart/form-data",
+    )
+    client.post("/delete-files", data={"dir": "", "confirm_delete": "yes", "files": ["part.nc"]})
+
+    target_path = str(tmp_path / "part.nc")
+    assert manager.changes == [
+        (target_path, "create", 6),
+        (target_path, "modify", 9),
+        (target_path, "delete", None),
+    ]
+
+
+class _RejectingManager(_RecordingManager):
+    def check_upload(self, path: str, size: int) -> None:
+        from shadow.capacity import CapacityError
+
+        raise CapacityError(f"Plik {path} ({size} B) nie miesci sie w slocie.")
+
+
+def test_upload_rejected_by_capacity_admission_is_not_saved(tmp_path: Path, monkeypatch) -> None:
+    manager = _RejectingManager()
+    monkeypatch.setattr(webui_app, "SHADOW_MASTER_DIR", str(tmp_path))
+    monkeypatch.setattr(webui_app, "get_shadow_manager_instance", lambda: manager)
+    client = webui_app.app.test_client()
+
+    response = client.post(
+        "/upload",
+        data={"dir": "", "file": (io.BytesIO(b"G0 X0\n"), "part.nc")},
+        content_type="multipart/form-data",
+    )
+
+    assert response.status_code == 302
+    message = parse_qs(urlparse(response.headers["Location"]).query)["msg"][0]
+    assert message.startswith("Upload odrzucony: Plik")
+    assert not (tmp_path / "part.nc").exists()
+    assert manager.changes == []
+
+
+class _SizeLimitedManager(_RecordingManager):
+    def __init__(self, limit: int) -> None:
+        super().__init__()
+        self.limit = limit
+        self.size_checks: list[tuple[str, int]] = []
+        self.path_checks: list[str] = []
+
+    def check_upload_size(self, directory: str, size: int) -> None:
+        from shadow.capacity import CapacityError
+
+        self.size_checks.append((directory, size))
+        if size > self.limit:
+            raise CapacityError(f"Plik {directory} ({size} B) nie miesci sie w slocie.")
+
+    def check_upload(self, path: str, size: int) -> None:
+        self.path_checks.append(path)
+
+
+def test_upload_is_rejected_from_content_length_before_the_body_is_parsed(tmp_path: Path, monkeypatch) -> None:
+    (tmp_path / "programs").mkdir()
+    manager = _SizeLimitedManager(limit=4096)
+    monkeypatch.setattr(webui_app, "SHADOW_MASTER_DIR", str(tmp_path))
+    monkeypatch.setattr(webui_app, "get_shadow_manager_instance", lambda: manager)
+    client = webui_app.app.test_client()
+
+    response = client.post(
+        "/upload?dir=programs",
+        data={"dir": "programs", "file": (io.BytesIO(b"G1" * 4096), "big.nc")},
+        content_type="multipart/form-data",
+    )
+    client.post(
+        "/upload?dir=programs",
+        data={"dir": "programs", "file": (io.BytesIO(b"G0 X0\n"), "small.nc")},
+        content_type="multipart/form-data",
+    )
+
+    query = parse_qs(urlparse(response.headers["Location"]).query)
+    assert query["msg"][0].startswith("Upload odrzucony: Plik")
+    assert query["dir"] == ["programs"]
+    assert [directory for directory, _size in manager.size_checks] == [str(tmp_path / "programs")] * 2
+    assert manager.size_checks[0][1] > 8192
+    assert manager.path_checks == [str(tmp_path / "programs" / "small.nc")]
+    assert not (tmp_path / "programs" / "big.nc").exists()
+    assert (tmp_path / "programs" / "small.nc").exists()
+
+
+class _StreamingManager:
+    def __init__(self, bus) -> None:
+        self.bus = bus
+
+    def subscribe_events(self, last_event_id=None):
+        return self.bus.subscribe(last_event_id)
+
+
+def test_shadow_events_stream_replays_missed_events_and_releases_subscription(monkeypatch) -> None:
+    from shadow.event_bus import EventBus
+
+    bus = EventBus()
+    monkeypatch.setattr(webui_app, "CNC_SHADOW_ENABLED", True)
+    monkeypatch.setattr(webui_app, "get_shadow_manager_instance", lambda: _StreamingManager(bus))
+    bus.publish("state", {"fsm_state": "BUILD_SLOT_B"})
+    bus.publish("history", {"result": "ok", "run_id": 7})
+
+    response = webui_app.app.test_client().get("/api/shadow/events", headers={"Last-Event-ID": "1"})
+    chunks = iter(response.response)
+
+    assert response.mimetype == "text/event-stream"
+    assert next(chunks) == b"retry: 3000\n\n"
+    assert next(chunks) == b'id: 2\nevent: history\ndata: {"result": "ok", "run_id": 7}\n\n'
+    bus.publish("state", {"fsm_state": "READY"})
+    assert next(chunks) == b'id: 3\nevent: state\ndata: {"fsm_state": "READY"}\n\n'
+    response.close()
+    assert bus.subscriber_count == 0
+
+
+class _StatsManager:
+    def __init__(self, stats) -> None:
+        self._stats = stats
+
+    def get_history_stats(self, window_seconds: float, trigger: str | None = None):
+        return summarize_samples(self._stats.samples(window_seconds, trigger), window_seconds)
+
+
+def test_shadow_history_filters_pages_and_stats_percentiles(tmp_path: Path, monkeypatch) -> None:
+    history_log = HistoryLog(str(tmp_path / "shadow_history.jsonl"))
+    stats = HistoryStats(retention_seconds=7 * 24 * 3600)
+    now = datetime.now(timezone.utc)
+    for index in range(10):
+        entry = history_log.append(
+            {
+                "trigger": "manual" if index % 2 else "auto",
+                "result": "error" if index == 9 else "ok",
+                "finished_at": (now - timedelta(hours=9 - index)).isoformat(timespec="seconds"),
+                "duration_ms": (index + 1) * 100,
+                "phases_ms": {"write": index + 1},
+            }
+        )
+        stats.add(entry)
+    monkeypatch.setattr(webui_app, "CNC_SHADOW_ENABLED", True)
+    monkeypatch.setattr(webui_app, "SHADOW_HISTORY_FILE", history_log.path)
+    monkeypatch.setattr(webui_app, "get_shadow_manager_instance", lambda: None)
+    client = webui_app.app.test_client()
+
+    first = client.get("/api/shadow/history?trigger=auto&result=ok&limit=2").get_json()
+    second = client.get(f"/api/shadow/history?trigger=auto&result=ok&limit=2&cursor={first['next_cursor']}").get_json()
+    since = (now - timedelta(hours=1, minutes=30)).isoformat()
+    recent = client.get("/api/shadow/history", query_string={"since": since}).get_json()
+
+    assert [entry["seq"] for entry in first["history"]] == [9, 7]
+    assert [entry["seq"] for entry in second["history"]] == [5, 3]
+    assert [entry["seq"] for entry in recent["history"]] == [10, 9]
+    assert recent["next_cursor"] is None
+    assert client.get("/api/shadow/history?cursor=zzz").status_code == 400
+    assert client.get("/api/shadow/stats").status_code == 503
+
+    monkeypatch.setattr(webui_app, "get_shadow_manager_instance", lambda: _StatsManager(stats))
+    payload = client.get("/api/shadow/stats?window_hours=4.5").get_json()["stats"]
+
+    assert payload["count"] == 5
+    assert payload["failure_rate"] == 0.2
+    assert payload["duration_ms"]["p50"] == 700
+    assert payload["duration_ms"]["p99"] == 900
+    assert payload["phases_ms"]["write"]["p95"] == 9
+    for window_hours in ("inf", "-inf", "nan", "1e400"):
+        assert client.get(f"/api/shadow/stats?window_hours={window_hours}").status_code == 400
+    assert client.get("/api/shadow/stats?window_hours=1e300").get_json()["stats"]["count"] == 10
+    assert len(stats.samples(float("inf"))) == 10
+    assert stats.samples(float("nan")) == []
+
+
+class _LunStateManager:
+    def __init__(self, state: ShadowState) -> None:
+        self.state = state
+
+    def get_state(self) -> ShadowState:
+        return self.state
+
+    def get_capacity_status(self):
+        return None
+
+    def get_watcher_status(self):
+        return {"state": "running"}
+
+
+def test_status_combines_lun_states_instead_of_root_state_file(tmp_path: Path, monkeypatch) -> None:
+    stale_state_file = tmp_path / "shadow_state.json"
+    stale_state_file.write_text('{"fsm_state": "READY", "active_slot": "A", "run_id": 1}', encoding="utf-8")
+    environment = {"CNC_MASTER_DIR": str(tmp_path / "master"), "CNC_SHADOW_LUNS": "a,b"}
+    lun_a = _LunStateManager(
+        ShadowState(fsm_state="BUILD_SLOT_B", active_slot="A", rebuild_slot="B", run_id=7, rebuild_counter=7)
+    )
+    lun_b = _LunStateManager(ShadowState(fsm_state="READY", active_slot="B", run_id=4, rebuild_counter=4))
+    group = ShadowLunGroup(
+        master_dir=environment["CNC_MASTER_DIR"],
+        luns=load_lun_configs(environment),
+        managers={"a": lun_a, "b": lun_b},
+        export=MultiLunExport(object(), ["a", "b"]),
+        environment=environment,
+    )
+    monkeypatch.setattr(webui_app, "CNC_SHADOW_ENABLED", True)
+    monkeypatch.setattr(webui_app, "SHADOW_STATE_FILE", str(stale_state_file))
+    monkeypatch.setattr(webui_app, "get_shadow_manager_instance", lambda: group)
+    client = webui_app.app.test_client()
+
+    payload = client.get("/api/status").get_json()
+    assert payload["switching"] is True
+    assert payload["shadow_state"]["fsm_state"] == "BUILD_SLOT_B"
+    assert payload["shadow_state"]["run_id"] == 7
+    assert [lun["fsm_state"] for lun in payload["luns"]] == ["BUILD_SLOT_B", "READY"]
+
+    lun_a.state = ShadowState(fsm_state="READY", active_slot="B", run_id=8, rebuild_counter=8)
+    lun_b.state = ShadowState(
+        fsm_state="ERROR",
+        active_slot="B",
+        run_id=5,
+        rebuild_counter=5,
+        last_error={"code": "ERR_NO_SPACE", "message": "brak miejsca"},
+    )
+    payload = client.get("/api/status").get_json()
+    assert payload["switching"] is False
+    assert payload["shadow_state"]["fsm_state"] == "ERROR"
+    assert payload["shadow_state"]["run_id"] == 8
+    assert payload["shadow_state"]["last_error"] == {"code": "ERR_NO_SPACE", "message": "brak miejsca", "lun": "b"}
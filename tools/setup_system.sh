@@ -229,7 +229,13 @@ apply_shadow_runtime_permissions() {
     shadow_entries+=("${CNC_USB_IMG_B:-/var/lib/cnc-control/cnc_usb_b.img}")
     shadow_entries+=("${CNC_ACTIVE_SLOT_FILE:-/var/lib/cnc-control/shadow_active_slot.state}")
     shadow_entries+=("${CNC_SHADOW_STATE_FILE:-/var/lib/cnc-control/shadow_state.json}")
-    shadow_entries+=("${CNC_SHADOW_HISTORY_FILE:-/var/lib/cnc-control/shadow_history.json}")
+    shadow_entries+=("${CNC_SHADOW_HISTORY_FILE:-/var/lib/cnc-control/shadow_history.jsonl}")
+    shadow_entries+=("${CNC_SHADOW_MANIFEST_FILE:-/var/lib/cnc-control/shadow_manifest.json}")
+    shadow_entries+=("${CNC_SHADOW_TEMPLATE_DIR:-/var/lib/cnc-control/templates}")
+    if [ -n "${CNC_SHADOW_LUNS:-}" ]; then
+        mkdir -p "${CNC_SHADOW_LUN_DIR:-/var/lib/cnc-control/luns}"
+        shadow_entries+=("${CNC_SHADOW_LUN_DIR:-/var/lib/cnc-control/luns}")
+    fi
 
     for entry in "${shadow_entries[@]}"; do
         if [ -e "${entry}" ]; then
@@ -532,7 +538,7 @@ upsert_env_var "${ENV_DEST}" "CNC_USB_IMG_B" "/var/lib/cnc-control/cnc_usb_b.img
 upsert_env_var "${ENV_DEST}" "CNC_ACTIVE_SLOT" "A"
 upsert_env_var "${ENV_DEST}" "CNC_ACTIVE_SLOT_FILE" "/var/lib/cnc-control/shadow_active_slot.state"
 upsert_env_var "${ENV_DEST}" "CNC_SHADOW_STATE_FILE" "/var/lib/cnc-control/shadow_state.json"
-upsert_env_var "${ENV_DEST}" "CNC_SHADOW_HISTORY_FILE" "/var/lib/cnc-control/shadow_history.json"
+upsert_env_var "${ENV_DEST}" "CNC_SHADOW_HISTORY_FILE" "/var/lib/cnc-control/shadow_history.jsonl"
 upsert_env_var "${ENV_DEST}" "CNC_SHADOW_SLOT_SIZE_MB" "1024"
 upsert_env_var "${ENV_DEST}" "CNC_SHADOW_TMP_SUFFIX" ".tmp"
 upsert_env_var "${ENV_DEST}" "CNC_SHADOW_LOCK_FILE" "/var/run/cnc-shadow.lock"
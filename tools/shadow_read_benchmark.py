@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""Measure sequential read time of SHADOW slot images built with each layout policy."""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from shadow.fat_image import FatImageError, FatImageReader  # noqa: E402
+from shadow.rebuild_engine import RebuildConfig, RebuildEngine, RebuildError  # noqa: E402
+from shadow.slot_sizing import LAYOUT_POLICIES, SlotCapacityError  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Build slot images from CNC_MASTER_DIR with each layout policy and measure "
+            "how long a cluster-by-cluster sequential read of every file takes."
+        )
+    )
+    parser.add_argument(
+        "--master-dir",
+        default=os.environ.get("CNC_MASTER_DIR", "/var/lib/cnc-control/master"),
+        help="Directory with CNC programs (default: CNC_MASTER_DIR).",
+    )
+    parser.add_argument(
+        "--slot-size-mb",
+        type=int,
+        default=int(os.environ.get("CNC_SHADOW_SLOT_SIZE_MB", "256")),
+        help="Slot image size in MB.",
+    )
+    parser.add_argument(
+        "--fat-type",
+        choices=("16", "32", "auto"),
+        default=os.environ.get("CNC_SHADOW_FAT_TYPE", "32"),
+        help="FAT type passed to the sizing policy.",
+    )
+    parser.add_argument(
+        "--policy",
+        action="append",
+        choices=sorted(LAYOUT_POLICIES),
+        help="Layout policy to benchmark (repeatable, default: all).",
+    )
+    parser.add_argument(
+        "--work-dir",
+        default=None,
+        help="Directory for benchmark images (default: temporary directory).",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Read passes per image.")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+    return parser.parse_args()
+
+
+def build_image(master_dir: str, image_path: str, args: argparse.Namespace, policy: str) -> None:
+    engine = RebuildEngine(
+        RebuildConfig(
+            master_dir=master_dir,
+            slot_size_mb=args.slot_size_mb,
+            tmp_suffix=".tmp",
+            usb_label="CNC_BENCH",
+            fat_type=args.fat_type,
+            layout_policy=policy,
+        )
+    )
+    engine.full_rebuild(image_path)
+
+
+def drop_page_cache(fd: int) -> None:
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def measure_image(image_path: str, repeat: int) -> Dict[str, object]:
+    with open(image_path, "rb") as image_handle:
+        reader = FatImageReader(image_handle)
+        geometry = reader.geometry
+        files = [(path, cluster, size) for path, is_dir, cluster, size in reader.iter_entries() if not is_dir]
+        chains = {path: reader.cluster_chain(cluster) for path, cluster, _size in files}
+
+    fragments = sum(
+        sum(1 for previous, current in zip(chain, chain[1:]) if current != previous + 1)
+        for chain in chains.values()
+    )
+    total_bytes = sum(size for _path, _cluster, size in files)
+    timings_ms: List[float] = []
+    fd = os.open(image_path, os.O_RDONLY)
+    try:
+        for _ in range(max(1, repeat)):
+            drop_page_cache(fd)
+            started = time.perf_counter()
+            for path, _cluster, _size in files:
+                for cluster in chains[path]:
+                    os.pread(fd, geometry.cluster_size, geometry.cluster_offset(cluster))
+            timings_ms.append((time.perf_counter() - started) * 1000)
+    finally:
+        os.close(fd)
+
+    best_ms = min(timings_ms)
+    return {
+        "fat_type": geometry.fat_type,
+        "cluster_bytes": geometry.cluster_size,
+        "files": len(files),
+        "bytes": total_bytes,
+        "fragments": fragments,
+        "reads": sum(len(chain) for chain in chains.values()),
+        "read_ms": round(best_ms, 1),
+        "mb_s": round(total_bytes / (1024 * 1024) / (best_ms / 1000), 2) if best_ms > 0 else None,
+    }
+
+
+def print_table(results: Dict[str, Dict[str, object]]) -> None:
+    columns = ("fat_type", "cluster_bytes", "files", "fragments", "reads", "read_ms", "mb_s")
+    print(f"{'policy':<16}" + "".join(f"{column:>14}" for column in columns))
+    for policy, result in results.items():
+        print(f"{policy:<16}" + "".join(f"{str(result[column]):>14}" for column in columns))
+
+
+def main() -> int:
+    args = parse_args()
+    policies = args.policy or sorted(LAYOUT_POLICIES)
+    if not os.path.isdir(args.master_dir):
+        print(f"ERROR: master directory not found: {args.master_dir}", file=sys.stderr)
+        return 1
+
+    results: Dict[str, Dict[str, object]] = {}
+    with tempfile.TemporaryDirectory(dir=args.work_dir, prefix="cnc-read-bench-") as work_dir:
+        for policy in policies:
+            image_path = os.path.join(work_dir, f"{policy}.img")
+            try:
+                build_image(args.master_dir, image_path, args, policy)
+                results[policy] = measure_image(image_path, args.repeat)
+            except (RebuildError, SlotCapacityError, FatImageError, OSError) as exc:
+                print(f"ERROR: {policy}: {exc}", file=sys.stderr)
+                return 1
+            finally:
+                if os.path.exists(image_path):
+                    os.remove(image_path)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
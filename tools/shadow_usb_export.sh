@@ -31,34 +31,82 @@ if [ "${CNC_SHADOW_ENABLED:-false}" != "true" ]; then
     exit 1
 fi
 
-SLOT_FILE="${CNC_ACTIVE_SLOT_FILE:-/var/lib/cnc-control/shadow_active_slot.state}"
-IMG_A="${CNC_USB_IMG_A:-/var/lib/cnc-control/cnc_usb_a.img}"
-IMG_B="${CNC_USB_IMG_B:-/var/lib/cnc-control/cnc_usb_b.img}"
+resolve_active_image() {
+    local slot_file="${1}"
+    local img_a="${2}"
+    local img_b="${3}"
+    local active_slot=""
+    local active_image=""
+
+    if [ ! -f "${slot_file}" ]; then
+        echo "Brak pliku aktywnego slotu: ${slot_file}" >&2
+        return 1
+    fi
 
-if [ ! -f "${SLOT_FILE}" ]; then
-    echo "Brak pliku aktywnego slotu: ${SLOT_FILE}"
-    exit 1
-fi
+    active_slot="$(tr -d '\r\n' < "${slot_file}" | tr '[:lower:]' '[:upper:]')"
+    case "${active_slot}" in
+        A)
+            active_image="${img_a}"
+            ;;
+        B)
+            active_image="${img_b}"
+            ;;
+        *)
+            echo "Nieprawidlowa wartosc ACTIVE_SLOT: ${active_slot}" >&2
+            return 1
+            ;;
+    esac
+
+    if [ ! -f "${active_image}" ] || [ ! -s "${active_image}" ]; then
+        echo "Brak poprawnego obrazu aktywnego slotu: ${active_image}" >&2
+        return 1
+    fi
+    echo "${active_image}"
+}
 
-ACTIVE_SLOT="$(tr -d '\r\n' < "${SLOT_FILE}" | tr '[:lower:]' '[:upper:]')"
-case "${ACTIVE_SLOT}" in
-    A)
-        ACTIVE_IMAGE="${IMG_A}"
-        ;;
-    B)
-        ACTIVE_IMAGE="${IMG_B}"
-        ;;
-    *)
-        echo "Nieprawidlowa wartosc ACTIVE_SLOT: ${ACTIVE_SLOT}"
+EXPORT_FILES=""
+LUN_COUNT=0
+if [ -n "${CNC_SHADOW_LUNS:-}" ]; then
+    # PL: Kazdy LUN ma wlasna pare slotow w CNC_SHADOW_LUN_DIR/<nazwa>.
+    # EN: Each LUN has its own slot pair in CNC_SHADOW_LUN_DIR/<name>.
+    LUN_DIR="${CNC_SHADOW_LUN_DIR:-/var/lib/cnc-control/luns}"
+    IFS=',' read -r -a LUN_NAMES <<< "${CNC_SHADOW_LUNS}"
+    for LUN_NAME in "${LUN_NAMES[@]}"; do
+        LUN_NAME="$(echo "${LUN_NAME}" | tr -d '[:space:]')"
+        if [ -z "${LUN_NAME}" ]; then
+            continue
+        fi
+        LUN_STATE_DIR="${LUN_DIR}/${LUN_NAME}"
+        LUN_IMAGE="$(resolve_active_image \
+            "${LUN_STATE_DIR}/shadow_active_slot.state" \
+            "${LUN_STATE_DIR}/cnc_usb_a.img" \
+            "${LUN_STATE_DIR}/cnc_usb_b.img")" || exit 1
+        EXPORT_FILES="${EXPORT_FILES:+${EXPORT_FILES},}${LUN_IMAGE}"
+        LUN_COUNT=$((LUN_COUNT + 1))
+    done
+    if [ "${LUN_COUNT}" -eq 0 ]; then
+        echo "Nieprawidlowa wartosc CNC_SHADOW_LUNS: ${CNC_SHADOW_LUNS}"
         exit 1
-        ;;
-esac
-
-if [ ! -f "${ACTIVE_IMAGE}" ] || [ ! -s "${ACTIVE_IMAGE}" ]; then
-    echo "Brak poprawnego obrazu aktywnego slotu: ${ACTIVE_IMAGE}"
-    exit 1
+    fi
+else
+    EXPORT_FILES="$(resolve_active_image \
+        "${CNC_ACTIVE_SLOT_FILE:-/var/lib/cnc-control/shadow_active_slot.state}" \
+        "${CNC_USB_IMG_A:-/var/lib/cnc-control/cnc_usb_a.img}" \
+        "${CNC_USB_IMG_B:-/var/lib/cnc-control/cnc_usb_b.img}")" || exit 1
+    LUN_COUNT=1
 fi
 
+repeat_flag() {
+    local count="${1}"
+    local values="1"
+    local index=1
+    while [ "${index}" -lt "${count}" ]; do
+        values="${values},1"
+        index=$((index + 1))
+    done
+    echo "${values}"
+}
+
 get_udc_name() {
     if [ ! -d "/sys/class/udc" ]; then
         return 0
@@ -106,7 +154,7 @@ set_led_mode() {
     return 0
 }
 
-echo "[SHADOW EXPORT] Start eksportu USB dla aktywnego slotu ${ACTIVE_SLOT} (${ACTIVE_IMAGE})..."
+echo "[SHADOW EXPORT] Start eksportu USB (${LUN_COUNT} LUN): ${EXPORT_FILES}..."
 
 if lsmod | grep -q '^g_mass_storage'; then
     echo "Odłączanie poprzedniego eksportu USB..."
@@ -118,7 +166,12 @@ if ! ensure_udc_available; then
 fi
 
 echo "Podłączanie USB Mass Storage (RO) dla SHADOW..."
-sudo modprobe g_mass_storage file="${ACTIVE_IMAGE}" removable=1 ro=1
+if [ "${LUN_COUNT}" -gt 1 ]; then
+    sudo modprobe g_mass_storage file="${EXPORT_FILES}" luns="${LUN_COUNT}" \
+        removable="$(repeat_flag "${LUN_COUNT}")" ro="$(repeat_flag "${LUN_COUNT}")"
+else
+    sudo modprobe g_mass_storage file="${EXPORT_FILES}" removable=1 ro=1
+fi
 set_led_mode SHADOW_READY
 
 echo "[SHADOW EXPORT] Gotowe."
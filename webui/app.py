@@ -7,11 +7,14 @@ from flask import (
     send_file,
     after_this_request,
     jsonify,
+    Response,
+    stream_with_context,
 )
 import subprocess
 import os
 import tempfile
 import json
+import math
 import re
 import shutil
 import sys
@@ -79,7 +82,7 @@ SHADOW_STATE_FILE = os.environ.get(
 )
 SHADOW_HISTORY_FILE = os.environ.get(
     "CNC_SHADOW_HISTORY_FILE",
-    "/var/lib/cnc-control/shadow_history.json",
+    "/var/lib/cnc-control/shadow_history.jsonl",
 )
 SHADOW_MASTER_DIR = os.environ.get(
     "CNC_MASTER_DIR",
@@ -114,12 +117,11 @@ ZEROTIER_SETUP_SCRIPT = os.environ.get(
 APP_VERSION_FILE = os.path.join(CONTROL_REPO_DIR, ".app_version")
 SEMVER_TAG_RE = re.compile(r"^v?\d+\.\d+\.\d+(?:[-+].*)?$")
 ZEROTIER_NETWORK_ID_RE = re.compile(r"^[0-9a-fA-F]{16}$")
-HIDDEN_NAMES = {
-    ".Spotlight-V100",
-    ".fseventsd",
-    ".Trashes",
-}
+SHADOW_EVENTS_KEEPALIVE_SECONDS = 15
+SHADOW_EVENTS_RETRY_MS = 3000
+SHADOW_STATS_DEFAULT_WINDOW_HOURS = 24
 _LED_IDLE_SET = False
+_UPLOAD_IGNORE_RULES = None
 HOSTS_SYNC_SCRIPT = (
     "import pathlib, sys\n"
     "hostname = sys.argv[1]\n"
@@ -141,6 +143,19 @@ HOSTS_SYNC_SCRIPT = (
 
 
 def _set_led_mode(mode_name):
+    # PL: Zapis trybu w procesie (bez uruchamiania interpretera); CLI tylko jako fallback.
+    # EN: In-process mode write (no interpreter spawn); the CLI is only a fallback.
+    if REPO_ROOT not in sys.path:
+        sys.path.append(REPO_ROOT)
+    try:
+        from led_status_cli import set_led_mode
+    except ImportError:
+        _run_led_cli(mode_name)
+        return
+    set_led_mode(mode_name, fallback=_run_led_cli)
+
+
+def _run_led_cli(mode_name):
     candidates = []
     cli_script = os.path.join(REPO_ROOT, "led_status_cli.py")
     if sys.executable:
@@ -169,7 +184,7 @@ def _set_led_mode(mode_name):
                 timeout=2,
             )
             if result.returncode == 0:
-                return
+                return True
             app.logger.warning(
                 "LED CLI zakonczyl sie kodem %s (%s).",
                 result.returncode,
@@ -182,6 +197,7 @@ def _set_led_mode(mode_name):
             continue
 
     app.logger.warning("Nie udalo sie ustawic trybu LED: %s", mode_name)
+    return False
 
 
 if hasattr(app, "before_serving"):
@@ -649,7 +665,7 @@ body.ui-busy #loading-overlay * {
 <hr>
 
 <h3>Upload pliku</h3>
-<form method=post enctype=multipart/form-data action="/upload">
+<form method=post enctype=multipart/form-data action="/upload?dir={{ current_dir|urlencode }}">
   <input type="hidden" name="dir" value="{{ current_dir }}">
   <input type=file name=file>
   <input type=submit value=Upload>
@@ -804,17 +820,24 @@ body.ui-busy #loading-overlay * {
       <th>RESULT</th>
       <th>SLOT</th>
       <th>CZAS (ms)</th>
+      <th>USB OFF (ms)</th>
+      <th>MB/s</th>
+      <th>ZMIANY</th>
       <th>KONIEC</th>
     </tr>
   </thead>
   <tbody id="shadow-history-body">
   {% for entry in shadow_history %}
-    <tr>
+    <tr title="{% for phase, phase_ms in (entry.phases_ms or {}).items() %}{{ phase }}={{ phase_ms }}ms {% endfor %}">
       <td>{{ entry.run_id }}</td>
       <td>{{ entry.trigger }}</td>
       <td>{{ entry.result }}</td>
       <td>{{ entry.active_slot_before }}→{{ entry.active_slot_after }}</td>
       <td>{{ entry.duration_ms }}</td>
+      <td>{{ entry.usb_downtime_ms if entry.usb_downtime_ms is not none else "-" }}</td>
+      <td>{{ entry.throughput_mb_s if entry.throughput_mb_s is not none else "-" }}</td>
+      {% set changes = entry.changes %}
+      <td>{% if changes %}{% if changes.full_rescan %}rescan {% endif %}+{{ changes.created|length }} ~{{ changes.modified|length }} -{{ changes.deleted|length }} →{{ changes.renamed|length }}{% else %}-{% endif %}</td>
       <td>{{ entry.finished_at }}</td>
     </tr>
   {% endfor %}
@@ -825,6 +848,10 @@ body.ui-busy #loading-overlay * {
 
 <script>
   const AP_ENABLED = {{ "true" if ap_enabled else "false" }};
+  const SHADOW_SWITCHING_STATES = ["CHANGE_DETECTED", "BUILD_SLOT_A", "BUILD_SLOT_B", "EXPORT_STOP", "EXPORT_START"];
+  // PL: Ostatni stan FSM kazdego LUN (klucz "" bez LUN); przelaczanie trwa, gdy dowolny LUN przelacza.
+  // EN: Last FSM state per LUN ("" key without LUNs); switching lasts while any LUN is switching.
+  const shadowLunStates = new Map();
   const overlay = document.getElementById("loading-overlay");
   const timeoutMessage = document.getElementById("loading-timeout");
   const messageLabel = document.getElementById("loading-message");
@@ -1252,6 +1279,24 @@ body.ui-busy #loading-overlay * {
     return String(value);
   }
 
+  function formatShadowPhases(phases) {
+    if (!phases || typeof phases !== "object") {
+      return "";
+    }
+    return Object.entries(phases)
+      .map(([phase, durationMs]) => `${phase}=${durationMs}ms`)
+      .join(" ");
+  }
+
+  function formatShadowChanges(changes) {
+    if (!changes || typeof changes !== "object") {
+      return "-";
+    }
+    const count = (key) => (Array.isArray(changes[key]) ? changes[key].length : 0);
+    const prefix = changes.full_rescan ? "rescan " : "";
+    return `${prefix}+${count("created")} ~${count("modified")} -${count("deleted")} →${count("renamed")}`;
+  }
+
   function renderShadowHistory(entries) {
     const body = document.getElementById("shadow-history-body");
     const table = document.getElementById("shadow-history-table");
@@ -1269,6 +1314,7 @@ body.ui-busy #loading-overlay * {
 
     entries.forEach((entry) => {
       const row = document.createElement("tr");
+      row.title = formatShadowPhases(entry.phases_ms);
       const runIdCell = document.createElement("td");
       runIdCell.textContent = formatShadowHistoryValue(entry.run_id);
       row.appendChild(runIdCell);
@@ -1291,6 +1337,18 @@ body.ui-busy #loading-overlay * {
       durationCell.textContent = formatShadowHistoryValue(entry.duration_ms);
       row.appendChild(durationCell);
 
+      const downtimeCell = document.createElement("td");
+      downtimeCell.textContent = formatShadowHistoryValue(entry.usb_downtime_ms);
+      row.appendChild(downtimeCell);
+
+      const throughputCell = document.createElement("td");
+      throughputCell.textContent = formatShadowHistoryValue(entry.throughput_mb_s);
+      row.appendChild(throughputCell);
+
+      const changesCell = document.createElement("td");
+      changesCell.textContent = formatShadowChanges(entry.changes);
+      row.appendChild(changesCell);
+
       const timeCell = document.createElement("td");
       timeCell.textContent = formatShadowHistoryValue(entry.finished_at);
       row.appendChild(timeCell);
@@ -1308,6 +1366,9 @@ body.ui-busy #loading-overlay * {
     if (!manualButton || !statusLabel) {
       return;
     }
+    let shadowHistoryEntries = [];
+    let historyTimer = null;
+    let manualTimer = null;
 
     function setShadowStatus(text, level) {
       statusLabel.textContent = text;
@@ -1376,7 +1437,8 @@ body.ui-busy #loading-overlay * {
           return;
         }
         const payload = await response.json();
-        renderShadowHistory(payload && payload.history ? payload.history : []);
+        shadowHistoryEntries = payload && payload.history ? payload.history : [];
+        renderShadowHistory(shadowHistoryEntries);
       } catch (error) {
         // PL: Brak historii nie powinien zaklocac glownego UI.
         // EN: Missing history must not disturb the main UI.
@@ -1412,10 +1474,87 @@ body.ui-busy #loading-overlay * {
       }
     });
 
+    function startShadowPolling() {
+      if (historyTimer === null) {
+        historyTimer = setInterval(refreshShadowHistory, 3000);
+      }
+      if (manualTimer === null) {
+        manualTimer = setInterval(refreshManualStatus, 1000);
+      }
+    }
+
+    function stopShadowPolling() {
+      if (historyTimer !== null) {
+        clearInterval(historyTimer);
+        historyTimer = null;
+      }
+      if (manualTimer !== null) {
+        clearInterval(manualTimer);
+        manualTimer = null;
+      }
+    }
+
+    function connectShadowEvents() {
+      if (typeof EventSource === "undefined") {
+        startShadowPolling();
+        return;
+      }
+      const source = new EventSource("/api/shadow/events");
+      source.addEventListener("open", () => {
+        stopShadowPolling();
+        refreshShadowHistory();
+        refreshManualStatus();
+      });
+      source.addEventListener("error", () => {
+        // PL: Przy zerwaniu strumienia wracamy do odpytywania, az EventSource polaczy sie ponownie.
+        // EN: Fall back to polling while the stream is down; EventSource reconnects on its own.
+        startShadowPolling();
+      });
+      source.addEventListener("history", (event) => {
+        try {
+          shadowHistoryEntries = [JSON.parse(event.data), ...shadowHistoryEntries].slice(0, 10);
+        } catch (error) {
+          return;
+        }
+        renderShadowHistory(shadowHistoryEntries);
+      });
+      source.addEventListener("manual", (event) => {
+        try {
+          const display = formatManualStatus(JSON.parse(event.data));
+          setShadowStatus(display.text, display.level);
+        } catch (error) {
+          // PL: Uszkodzone zdarzenie pomijamy; kolejne odswiezy status.
+          // EN: Skip a malformed event; the next one refreshes the status.
+        }
+      });
+      source.addEventListener("state", (event) => {
+        try {
+          const state = JSON.parse(event.data);
+          shadowLunStates.set(state.lun || "", state.fsm_state);
+          applySwitching(isAnyShadowLunSwitching());
+        } catch (error) {
+          // PL: Stan FSM odswiezy takze /api/status.
+          // EN: /api/status refreshes the FSM state as well.
+        }
+      });
+    }
+
     refreshShadowHistory();
     refreshManualStatus();
-    setInterval(refreshShadowHistory, 3000);
-    setInterval(refreshManualStatus, 1000);
+    connectShadowEvents();
+  }
+
+  function isAnyShadowLunSwitching() {
+    return Array.from(shadowLunStates.values()).some((fsmState) => SHADOW_SWITCHING_STATES.includes(fsmState));
+  }
+
+  function syncShadowLunStates(payload) {
+    shadowLunStates.clear();
+    if (Array.isArray(payload.luns)) {
+      payload.luns.forEach((lun) => shadowLunStates.set(lun.name, lun.fsm_state));
+    } else if (payload.shadow_state) {
+      shadowLunStates.set("", payload.shadow_state.fsm_state);
+    }
   }
 
   function applySwitching(switching) {
@@ -1457,6 +1596,7 @@ body.ui-busy #loading-overlay * {
         maybeRefreshFileListFromShadowState(payload.shadow_state);
       }
       if (payload && "switching" in payload) {
+        syncShadowLunStates(payload);
         applySwitching(payload.switching);
       }
     } catch (error) {
@@ -2340,7 +2480,20 @@ body.ui-busy #loading-overlay * {
 """
 
 def is_hidden_file(name):
-    return name.startswith(".") or name in HIDDEN_NAMES
+    return name.startswith(".")
+
+
+def get_upload_ignore_rules():
+    global _UPLOAD_IGNORE_RULES
+    if _UPLOAD_IGNORE_RULES is None:
+        try:
+            from shadow.ignore_rules import IgnoreRules
+
+            _UPLOAD_IGNORE_RULES = IgnoreRules.from_environment(os.environ)
+        except Exception as exc:
+            app.logger.warning("Nie mozna wczytac regul ignorowania SHADOW: %s", exc)
+            return None
+    return _UPLOAD_IGNORE_RULES
 
 
 def normalize_relative_upload_path(raw_path):
@@ -2405,11 +2558,15 @@ def list_upload_entries(upload_dir, raw_dir):
     except OSError:
         return None, None
 
+    ignore_rules = get_upload_ignore_rules()
+    matcher = ignore_rules.matcher(current_rel) if ignore_rules is not None else None
     for name in names:
         if is_hidden_file(name):
             continue
         entry_abs = os.path.join(current_abs, name)
         is_directory = os.path.isdir(entry_abs) and not os.path.islink(entry_abs)
+        if matcher is not None and matcher.ignores(name, is_directory):
+            continue
         rel_path = name if not current_rel else f"{current_rel}/{name}"
         entries.append(
             {
@@ -2465,11 +2622,19 @@ def get_upload_directory():
 def read_shadow_state():
     if not CNC_SHADOW_ENABLED:
         return None
-    try:
-        with open(SHADOW_STATE_FILE, "r", encoding="utf-8") as state_file:
-            payload = json.load(state_file)
-    except (OSError, json.JSONDecodeError):
-        return None
+    payload = None
+    manager = get_shadow_manager_instance()
+    if manager is not None and hasattr(manager, "get_state"):
+        try:
+            payload = manager.get_state().to_dict()
+        except Exception as exc:
+            app.logger.warning("Nie mozna odczytac stanu SHADOW z managera: %s", exc)
+    if payload is None:
+        try:
+            with open(SHADOW_STATE_FILE, "r", encoding="utf-8") as state_file:
+                payload = json.load(state_file)
+        except (OSError, json.JSONDecodeError):
+            return None
 
     return {
         "fsm_state": str(payload.get("fsm_state", "UNKNOWN")),
@@ -2490,6 +2655,86 @@ def get_shadow_manager_instance():
     return get_shadow_manager()
 
 
+def notify_shadow_change(path, operation, size=None):
+    manager = get_shadow_manager_instance()
+    if manager is None:
+        return
+    try:
+        manager.notify_change(path, operation, size)
+    except Exception as exc:
+        app.logger.warning("Nie mozna powiadomic SHADOW o zmianie %s: %s", path, exc)
+
+
+def check_shadow_upload(path, size):
+    manager = get_shadow_manager_instance()
+    if manager is None:
+        return None
+    try:
+        from shadow.capacity import CapacityError
+    except Exception:
+        return None
+    try:
+        manager.check_upload(path, size)
+    except CapacityError as exc:
+        return str(exc)
+    except Exception as exc:
+        app.logger.warning("Nie mozna sprawdzic pojemnosci SHADOW dla %s: %s", path, exc)
+    return None
+
+
+def check_shadow_upload_size(directory, size):
+    manager = get_shadow_manager_instance()
+    if manager is None or not hasattr(manager, "check_upload_size"):
+        return None
+    try:
+        from shadow.capacity import CapacityError
+    except Exception:
+        return None
+    try:
+        manager.check_upload_size(directory, size)
+    except CapacityError as exc:
+        return str(exc)
+    except Exception as exc:
+        app.logger.warning("Nie mozna sprawdzic pojemnosci SHADOW dla %s: %s", directory, exc)
+    return None
+
+
+def read_shadow_capacity():
+    manager = get_shadow_manager_instance()
+    if manager is None:
+        return None
+    try:
+        capacity_status = manager.get_capacity_status()
+    except Exception as exc:
+        app.logger.warning("Nie mozna odczytac pojemnosci SHADOW: %s", exc)
+        return None
+    if capacity_status is None:
+        return None
+    return capacity_status.to_dict()
+
+
+def read_shadow_watcher_status():
+    manager = get_shadow_manager_instance()
+    if manager is None:
+        return None
+    try:
+        return manager.get_watcher_status()
+    except Exception as exc:
+        app.logger.warning("Nie mozna odczytac stanu watchera SHADOW: %s", exc)
+        return None
+
+
+def read_shadow_luns():
+    manager = get_shadow_manager_instance()
+    if manager is None or not hasattr(manager, "get_lun_states"):
+        return None
+    try:
+        return manager.get_lun_states()
+    except Exception as exc:
+        app.logger.warning("Nie mozna odczytac stanu LUN SHADOW: %s", exc)
+        return None
+
+
 def read_shadow_history(limit=20):
     resolved_limit = max(1, min(int(limit), 100))
     manager = get_shadow_manager_instance()
@@ -2499,18 +2744,31 @@ def read_shadow_history(limit=20):
         except Exception as exc:
             app.logger.warning("Nie mozna odczytac historii SHADOW z managera: %s", exc)
 
-    if not os.path.isfile(SHADOW_HISTORY_FILE):
-        return []
+    from shadow.history_log import HistoryLog
+
     try:
-        with open(SHADOW_HISTORY_FILE, "r", encoding="utf-8") as history_file:
-            payload = json.load(history_file)
-    except (OSError, json.JSONDecodeError):
-        return []
-    if not isinstance(payload, list):
+        return HistoryLog(SHADOW_HISTORY_FILE).latest(resolved_limit)
+    except OSError as exc:
+        app.logger.warning("Nie mozna odczytac historii SHADOW z pliku: %s", exc)
         return []
-    entries = [entry for entry in payload if isinstance(entry, dict)]
-    entries = list(reversed(entries))
-    return entries[:resolved_limit]
+
+
+def query_shadow_history(query):
+    manager = get_shadow_manager_instance()
+    if manager is not None and hasattr(manager, "query_history"):
+        try:
+            return manager.query_history(query)
+        except Exception as exc:
+            app.logger.warning("Nie mozna odczytac historii SHADOW z managera: %s", exc)
+
+    from shadow.history_log import HistoryLog
+    from shadow.history_query import query_entries
+
+    try:
+        return query_entries(HistoryLog(SHADOW_HISTORY_FILE).iter_latest(), query)
+    except OSError as exc:
+        app.logger.warning("Nie mozna odczytac historii SHADOW z pliku: %s", exc)
+        return [], None
 
 
 def shadow_fsm_group(fsm_state):
@@ -3254,6 +3512,9 @@ def api_status():
             "shadow_state": shadow_state,
             "switching": switching,
             "ap_enabled": CNC_AP_ENABLED,
+            "capacity": read_shadow_capacity(),
+            "luns": read_shadow_luns(),
+            "watcher": read_shadow_watcher_status(),
         }
     )
 
@@ -3262,13 +3523,31 @@ def api_status():
 def api_shadow_history():
     if not CNC_SHADOW_ENABLED:
         return jsonify({"error": "Tryb SHADOW jest wylaczony"}), 409
-    raw_limit = request.args.get("limit", "20")
+    from shadow.history_query import HistoryQuery
+
+    try:
+        query = HistoryQuery.from_args(request.args)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    history, next_cursor = query_shadow_history(query)
+    return jsonify({"history": history, "next_cursor": next_cursor})
+
+
+@app.route("/api/shadow/stats", methods=["GET"])
+def api_shadow_stats():
+    if not CNC_SHADOW_ENABLED:
+        return jsonify({"error": "Tryb SHADOW jest wylaczony"}), 409
+    manager = get_shadow_manager_instance()
+    if manager is None or not hasattr(manager, "get_history_stats"):
+        return jsonify({"error": "Manager SHADOW nie jest dostepny"}), 503
     try:
-        limit = int(raw_limit)
+        window_hours = float(request.args.get("window_hours", SHADOW_STATS_DEFAULT_WINDOW_HOURS))
     except (TypeError, ValueError):
-        limit = 20
-    history = read_shadow_history(limit=limit)
-    return jsonify({"history": history})
+        return jsonify({"error": "Nieprawidlowa wartosc window_hours"}), 400
+    if not math.isfinite(window_hours) or window_hours <= 0:
+        return jsonify({"error": "Nieprawidlowa wartosc window_hours"}), 400
+    trigger = (request.args.get("trigger") or "").strip() or None
+    return jsonify({"stats": manager.get_history_stats(window_hours * 3600, trigger)})
 
 
 @app.route("/api/shadow/manual-rebuild", methods=["POST"])
@@ -3298,6 +3577,39 @@ def api_shadow_manual_status():
     return jsonify(status)
 
 
+@app.route("/api/shadow/events", methods=["GET"])
+def api_shadow_events():
+    if not CNC_SHADOW_ENABLED:
+        return jsonify({"error": "Tryb SHADOW jest wylaczony"}), 409
+    manager = get_shadow_manager_instance()
+    if manager is None or not hasattr(manager, "subscribe_events"):
+        return jsonify({"error": "Manager SHADOW nie jest dostepny"}), 503
+    try:
+        last_event_id = int(request.headers.get("Last-Event-ID", ""))
+    except ValueError:
+        last_event_id = None
+    subscription = manager.subscribe_events(last_event_id)
+
+    def stream():
+        try:
+            yield f"retry: {SHADOW_EVENTS_RETRY_MS}\n\n"
+            while not subscription.closed:
+                event = subscription.get(timeout_seconds=SHADOW_EVENTS_KEEPALIVE_SECONDS)
+                if event is None:
+                    yield ": keepalive\n\n"
+                    continue
+                payload = json.dumps(event.payload, ensure_ascii=False)
+                yield f"id: {event.event_id}\nevent: {event.event_type}\ndata: {payload}\n\n"
+        finally:
+            subscription.close()
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.route("/api/restart-gui", methods=["POST"])
 def api_restart_gui():
     restart_result, restart_error = restart_systemd_unit(WEBUI_SYSTEMD_UNIT, timeout=10)
@@ -3663,6 +3975,19 @@ def upload():
     if not upload_dir:
         return redirect_to_index("Brak konfiguracji CNC_MASTER_DIR")
 
+    # PL: Wstepna kontrola pojemnosci z naglowka Content-Length, zanim Werkzeug zbuforuje cialo zadania.
+    # EN: Early capacity check from Content-Length, before Werkzeug buffers the request body.
+    if request.content_length:
+        probe_dir, probe_current_dir = resolve_upload_path(
+            upload_dir,
+            request.args.get("dir"),
+            expect_directory=True,
+        )
+        if probe_dir:
+            capacity_error = check_shadow_upload_size(probe_dir, request.content_length)
+            if capacity_error:
+                return redirect_to_index(f"Upload odrzucony: {capacity_error}", probe_current_dir)
+
     target_dir, current_dir = resolve_upload_path(
         upload_dir,
         request.form.get("dir"),
@@ -3682,13 +4007,26 @@ def upload():
     if safe_name == "":
         return redirect_to_index("Nieprawidłowa nazwa pliku", current_dir)
 
+    target_path = os.path.join(target_dir, safe_name)
+    try:
+        f.stream.seek(0, os.SEEK_END)
+        upload_size = f.stream.tell()
+        f.stream.seek(0)
+    except (AttributeError, OSError):
+        upload_size = request.content_length or 0
+    capacity_error = check_shadow_upload(target_path, upload_size)
+    if capacity_error:
+        return redirect_to_index(f"Upload odrzucony: {capacity_error}", current_dir)
+
     try:
         os.makedirs(target_dir, exist_ok=True)
-        target_path = os.path.join(target_dir, safe_name)
+        existed = os.path.exists(target_path)
         f.save(target_path)
+        saved_size = os.path.getsize(target_path)
     except Exception:
         return redirect_to_index("Błąd zapisu pliku", current_dir)
 
+    notify_shadow_change(target_path, "modify" if existed else "create", saved_size)
     return redirect_to_index("Upload OK", current_dir)
 
 
@@ -3745,6 +4083,8 @@ def delete_files():
             deleted_count += 1
         except OSError:
             failed_count += 1
+            continue
+        notify_shadow_change(target_path, "delete")
 
     if deleted_count == 0:
         return redirect_to_index("Nie udalo sie usunac wybranych plikow", current_dir)
@@ -3970,10 +4310,14 @@ def start_webui():
 
 
 def start_shadow_mode():
+    from shadow.luns import ShadowLunGroup, load_lun_configs
     from shadow.runtime_registry import set_shadow_manager
     from shadow.shadow_manager import ShadowManager
 
-    shadow_manager = ShadowManager.from_environment(os.environ)
+    if load_lun_configs(os.environ):
+        shadow_manager = ShadowLunGroup.from_environment(os.environ)
+    else:
+        shadow_manager = ShadowManager.from_environment(os.environ)
     set_shadow_manager(shadow_manager)
     shadow_manager.start()
     start_webui()